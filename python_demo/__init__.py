@@ -0,0 +1,57 @@
+"""
+Python port of matrisomeannotatoR.
+
+The functions below are imported on first use, so that `import python_demo` stays
+cheap and the plotting backends (matplotlib, seaborn, plotly) and the R bridge
+(rpy2) are only loaded by the functions that need them.
+"""
+import importlib
+
+# Public name -> module it is defined in
+_EXPORTS = {
+    'matriannotate': 'python_demo.util',
+    'matrianalyze': 'python_demo.util',
+    'matri_bar': 'python_demo.gui',
+    'matri_flow': 'python_demo.gui',
+    'matri_ring': 'python_demo.gui',
+    'matri_star': 'python_demo.gui',
+    'render_batch': 'python_demo.render',
+    'run_batch': 'python_demo.batch',
+    'matriannotate_stream': 'python_demo.stream',
+    'write_annotated_stream': 'python_demo.stream',
+    'MatrianalyzeAccumulator': 'python_demo.stream',
+    'matrianalyze_sparse': 'python_demo.sparse',
+    'matriannotate_arrow': 'python_demo.engines',
+    'matrianalyze_arrow': 'python_demo.engines',
+    'matriannotate_polars': 'python_demo.engines',
+    'matrianalyze_polars': 'python_demo.engines',
+    'summarize': 'python_demo.summary',
+    'MatrisomeSummary': 'python_demo.summary',
+    'get_reference': 'python_demo.reference',
+    'diff_references': 'python_demo.delta',
+    'reannotate': 'python_demo.delta',
+    'update_totals': 'python_demo.delta',
+    'matriannotate_multi': 'python_demo.multi',
+    'read_mass_spec': 'python_demo.readers',
+    'read_cbioportal': 'python_demo.readers',
+    'set_result_cache': 'python_demo.result_cache',
+    'result_cache_stats': 'python_demo.result_cache',
+    'clear_result_cache': 'python_demo.result_cache',
+    'build_reference_store': 'python_demo.reference',
+    'set_reference_store': 'python_demo.reference',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    # Cache on the package so the lookup happens once
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
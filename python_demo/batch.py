@@ -0,0 +1,436 @@
+import contextvars
+import csv
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from pandas.api.types import is_object_dtype, is_string_dtype
+
+from python_demo.common import CATEGORY_LEVELS, DIVISION_LEVELS, check_arguments
+from python_demo.engines import read_source
+from python_demo.reference import detect_id_type, gene_keys, get_reference, reference_version
+from python_demo.render import FORMATS, PLOTS, render_summary
+from python_demo.stream import default_sep
+from python_demo.summary import MatrisomeSummary, summarize
+from python_demo.util import matrianalyze, matriannotate
+
+# Files picked up from a directory
+TABLE_EXTENSIONS = ('.csv', '.tsv', '.txt', '.parquet', '.feather', '.arrow')
+# Column names taken for the gene column when their values match the reference
+GENE_COLUMN_NAMES = ['gene', 'genes', 'gene symbol', 'gene_symbol', 'symbol', 'gene name', 'gene_name',
+                     'hugo_symbol', 'gene id', 'gene_id', 'entrez_gene_id', 'ensembl_gene_id', 'features']
+
+MANIFEST_NAME = 'batch_manifest.json'
+SUMMARY_NAME = 'summary.tsv'
+
+# Marks the end of a queue
+_DONE = object()
+
+
+def find_inputs(source):
+    """
+    Gene tables of a directory, a glob pattern or a list of paths, sorted by name.
+    """
+    if isinstance(source, (list, tuple)):
+        return [p for s in source for p in find_inputs(s)]
+    source = os.fspath(source)
+    if os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source)]
+    elif os.path.isfile(source):
+        return [source]
+    else:
+        paths = glob.glob(source)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(TABLE_EXTENSIONS))
+
+
+def sniff_sep(path, sample_size=65536):
+    """
+    Field separator of a text table, detected from its first lines; falls back to
+    default_sep(path) when the sample is inconclusive.
+    """
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        sample = f.read(sample_size)
+    # Whole lines only
+    if len(sample) == sample_size and '\n' in sample:
+        sample = sample[:sample.rindex('\n')]
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',\t;|').delimiter
+    except csv.Error:
+        header = sample.split('\n', 1)[0]
+        counts = {sep: header.count(sep) for sep in ',\t;|'}
+        best = max(counts, key=counts.get)
+        return best if counts[best] else default_sep(path)
+
+
+def read_input(path, sep=None):
+    """
+    Read a gene table: Parquet and Arrow IPC files as they are, text files with the
+    separator detected from their content unless given.
+
+    Returns:
+    - data: Data frame
+    - sep: Separator used, None for binary formats
+    """
+    if path.lower().endswith(('.parquet', '.feather', '.arrow')):
+        return read_source(path, 'pandas'), None
+    sep = sep or sniff_sep(path)
+    return pd.read_csv(path, sep=sep), sep
+
+
+def detect_gene_column(data, species, sample_size=500):
+    """
+    Guess the gene column of a table: the column whose values match the matrisome
+    reference of the species most often, preferring columns with a gene-like name.
+
+    Parameters:
+    - data: Data frame
+    - species: One of SPECIES
+    - sample_size: Number of values of every column looked up
+
+    Returns:
+    - gene_column: Column name, None if no column matches the reference
+    """
+    ref = get_reference(species)
+    best, best_key = None, None
+    for name in data.columns:
+        col = data[name]
+        named = str(name).strip().lower() in GENE_COLUMN_NAMES
+        # Numbers are only gene IDs in a column named like one
+        if not named and not (is_object_dtype(col.dtype) or is_string_dtype(col.dtype)):
+            continue
+        col = col.dropna()
+        if len(col) == 0:
+            continue
+        if len(col) > sample_size:
+            col = col.sample(sample_size, random_state=0)
+        keys = gene_keys(col)
+        score = (ref.codes(keys, detect_id_type(keys)) >= 0).mean()
+        key = (named and score > 0, score)
+        if score > 0 and (best_key is None or key > best_key):
+            best, best_key = name, key
+    return best
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _settings_key(settings):
+    return hashlib.blake2b(json.dumps(settings, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def _names(paths):
+    # Output folder of every file: its name without extension, unless two files share it
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+    return [s if stems.count(s) == 1 else os.path.basename(p).replace('.', '_') for s, p in zip(stems, paths)]
+
+
+def read_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _is_done(entry, file_key, settings):
+    return (entry is not None and entry.get('status') == 'done' and entry.get('settings') == settings
+            and all(entry.get(k) == v for k, v in file_key.items())
+            and all(os.path.exists(p) for p in entry.get('outputs', [])))
+
+
+def _counts_records(summary):
+    counts = summary.counts.stack()
+    return [[div, cat, int(n)] for (div, cat), n in counts.items() if n]
+
+
+def summary_from_records(records):
+    """
+    Rebuild a MatrisomeSummary from the division/category counts stored in the batch manifest.
+    """
+    counts = pd.DataFrame(records, columns=['division', 'category', 'n'])
+    divisions = _ordered(DIVISION_LEVELS, counts['division'])
+    categories = _ordered(CATEGORY_LEVELS, counts['category'])
+    counts = counts.pivot_table(index='division', columns='category', values='n', aggfunc='sum', fill_value=0)
+    counts = counts.reindex(index=divisions, columns=categories, fill_value=0).astype('int64')
+    counts.index.name, counts.columns.name = 'Annotated Matrisome Division', 'Annotated Matrisome Category'
+    return MatrisomeSummary(counts)
+
+
+def _ordered(levels, values):
+    values = set(values)
+    return [v for v in levels if v in values] + sorted(values - set(levels))
+
+
+def combine_summaries(summaries):
+    """
+    Cross-file table of gene counts in the matrianalyze layout: one row per division,
+    then one per category, and one column per file plus a 'Total' column.
+
+    Parameters:
+    - summaries: Dictionary of name -> MatrisomeSummary
+
+    Returns:
+    - z: Data frame indexed by "Matrisome Annotation"
+    """
+    divisions = _ordered(DIVISION_LEVELS, [v for s in summaries.values() for v in s.division_counts.index])
+    categories = _ordered(CATEGORY_LEVELS, [v for s in summaries.values() for v in s.category_counts.index])
+
+    a = pd.DataFrame({name: s.division_counts.reindex(divisions, fill_value=0) for name, s in summaries.items()},
+                     index=divisions)
+    b = pd.DataFrame({name: s.category_counts.reindex(categories, fill_value=0) for name, s in summaries.items()},
+                     index=categories)
+    z = pd.concat([a, b]).fillna(0).astype('int64')
+    z['Total'] = z.sum(axis=1)
+    z.index = z.index.astype(object)
+    z.index.name = "Matrisome Annotation"
+    return z
+
+
+def run_batch(source=None, output_dir=None, species=None, gene_column=None, id_type='auto', mode='expand',
+              duplicates='sum', plots=PLOTS, fmt='png', dpi=100, workers=None, render_processes=None,
+              queue_size=4, resume=True, write_annotated=False):
+    """
+    Annotate, analyze and plot every gene table of a directory.
+
+    The files flow through three stages joined by bounded queues: a reader thread,
+    a pool of threads annotating and analyzing, and a process pool rendering the plots,
+    so that reading and plotting overlap with annotation. Every file gets a folder in
+    output_dir with its matrianalyze table (matrianalyze.tsv), its plots and, with
+    write_annotated, the annotated table (annotated.tsv). The gene counts of all
+    files are written side by side to summary.tsv.
+
+    Finished files are recorded in batch_manifest.json; with resume a rerun skips the
+    files that are unchanged and were processed with the same settings.
+
+    Parameters:
+    - source: Directory, glob pattern or list of CSV/TSV/TXT, Parquet or Arrow IPC files
+    - output_dir: Directory the results are written to
+    - species: One of 'human', 'mouse', 'c.elegans', 'zebrafish', 'drosophila'
+    - gene_column: Column with gene IDs, detected for every file if None
+    - id_type, mode: See matriannotate
+    - duplicates: See matrianalyze
+    - plots, fmt, dpi: See render_summary; plots=[] skips rendering
+    - workers: Number of annotation threads, by default up to 4
+    - render_processes: Number of rendering processes, by default one per CPU up to 4
+    - queue_size: Number of tables each queue holds before the stage before it waits
+    - resume: If True files already processed are skipped
+    - write_annotated: If True the annotated tables are written too
+
+    Returns:
+    - z: Cross-file table of gene counts, see combine_summaries
+    """
+    if source is None:
+        print("no data provided, execution stops")
+        return
+
+    if output_dir is None:
+        print("no output directory provided, execution stops")
+        return
+
+    if not check_arguments(species=species, id_type=id_type, mode=mode, duplicates=duplicates):
+        return
+
+    if fmt not in FORMATS:
+        print(f"fmt should be one of {', '.join(FORMATS)}, execution stops")
+        return
+
+    unknown = [p for p in plots if p not in PLOTS]
+    if unknown:
+        print(f"plots {', '.join(unknown)} are not recognized, execution stops")
+        return
+
+    paths = find_inputs(source)
+    if not paths:
+        print(f"no gene tables found in {source}, execution stops")
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    settings = _settings_key({'species': species, 'gene_column': gene_column, 'id_type': id_type, 'mode': mode,
+                              'duplicates': duplicates, 'plots': list(plots), 'fmt': fmt, 'dpi': dpi,
+                              'write_annotated': write_annotated, 'version': reference_version()})
+
+    manifest = read_manifest(output_dir) if resume else {}
+    lock = threading.Lock()
+    pending = []
+    for name, path in zip(_names(paths), paths):
+        if _is_done(manifest.get(name), _file_key(path), settings):
+            print(f"{name} is up to date, skipped")
+        else:
+            pending.append((name, path))
+
+    def record(name, entry):
+        with lock:
+            manifest[name] = entry
+            _write_manifest(output_dir, manifest)
+        if entry['status'] == 'failed':
+            print(f"{name} failed: {entry['error']}")
+
+    def failed(name, path, error):
+        record(name, {**_file_key(path), 'settings': settings, 'status': 'failed', 'error': str(error)})
+
+    workers = workers or min(4, os.cpu_count() or 1)
+    read_queue = queue.Queue(maxsize=queue_size)
+    render_queue = queue.Queue(maxsize=queue_size)
+
+    def read_stage():
+        for name, path in pending:
+            try:
+                data, sep = read_input(path)
+                column = gene_column or detect_gene_column(data, species)
+                if column is None:
+                    raise ValueError("no column of gene IDs was found")
+                read_queue.put((name, path, data, sep, column))
+            except Exception as e:
+                failed(name, path, e)
+        for _ in range(workers):
+            read_queue.put(_DONE)
+
+    def compute_stage():
+        while True:
+            item = read_queue.get()
+            if item is _DONE:
+                return
+            name, path, data, sep, column = item
+            try:
+                folder = os.path.join(output_dir, name)
+                os.makedirs(folder, exist_ok=True)
+                ann = matriannotate(data, column, species, id_type, mode)
+                if ann is None:
+                    raise ValueError("annotation failed")
+                tbl = matrianalyze(ann, duplicates=duplicates)
+                outputs = []
+                if tbl is not None:
+                    outputs.append(os.path.join(folder, 'matrianalyze.tsv'))
+                    tbl.to_csv(outputs[-1], sep='\t')
+                if write_annotated:
+                    outputs.append(os.path.join(folder, 'annotated.tsv'))
+                    ann.to_csv(outputs[-1], sep='\t', index=False)
+                entry = {**_file_key(path), 'settings': settings, 'status': 'done', 'sep': sep,
+                         'gene_column': str(column), 'rows': len(data), 'counts': _counts_records(summarize(ann)),
+                         'outputs': outputs}
+                render_queue.put((name, path, folder, summarize(ann), entry))
+            except Exception as e:
+                failed(name, path, e)
+
+    def render_stage(pool):
+        # At most two renders in flight per process, so the queue before this stage fills up instead
+        slots = threading.Semaphore(2 * (render_processes or 1))
+        futures = []
+
+        def render(name, path, folder, summary, entry):
+            if not plots:
+                record(name, entry)
+                return
+
+            def done(future):
+                slots.release()
+                try:
+                    entry['outputs'] = entry['outputs'] + future.result()
+                    record(name, entry)
+                except Exception as e:
+                    failed(name, path, e)
+
+            slots.acquire()
+            try:
+                if pool is None:
+                    future = _Immediate(render_summary, summary, folder, list(plots), fmt, dpi)
+                else:
+                    future = pool.submit(render_summary, summary, folder, list(plots), fmt, dpi)
+            except Exception:
+                slots.release()
+                raise
+            futures.append(future)
+            future.add_done_callback(done)
+
+        item = None
+        try:
+            while True:
+                item = render_queue.get()
+                if item is _DONE:
+                    break
+                try:
+                    render(*item)
+                except Exception as e:
+                    # e.g. BrokenProcessPool once a render process was killed
+                    failed(item[0], item[1], e)
+        except Exception as e:
+            print(f"rendering stopped: {e}")
+            # Keep emptying the queue, so that the annotation threads never wait on it
+            while item is not _DONE:
+                item = render_queue.get()
+        for future in futures:
+            future.exception()
+
+    render_processes = render_processes or min(4, os.cpu_count() or 1)
+    pool = None
+    if plots and render_processes > 1 and len(pending) > 1:
+        # Spawned rather than forked, as this process runs threads
+        pool = ProcessPoolExecutor(max_workers=render_processes, mp_context=multiprocessing.get_context('spawn'))
+
+    try:
+        reader = _thread(read_stage, 'batch-read')
+        computers = [_thread(compute_stage, f'batch-annotate-{i}') for i in range(workers)]
+        renderer = _thread(render_stage, 'batch-render', pool)
+        for t in [reader, renderer] + computers:
+            t.start()
+        reader.join()
+        for t in computers:
+            t.join()
+        render_queue.put(_DONE)
+        renderer.join()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # Cross-file summary of every file finished now or in an earlier run
+    summaries = {name: summary_from_records(manifest[name]['counts']) for name in _names(paths)
+                 if manifest.get(name, {}).get('status') == 'done'}
+    if not summaries:
+        print("no file was processed, execution stops")
+        return
+    z = combine_summaries(summaries)
+    z.to_csv(os.path.join(output_dir, SUMMARY_NAME), sep='\t')
+    return z
+
+
+def _thread(target, name, *args):
+    # Threads start in an empty context; run each in a copy of this one, so that the
+    # stages of a run_batch inside instrument() are recorded
+    return threading.Thread(target=contextvars.copy_context().run, args=(target,) + args, name=name, daemon=True)
+
+
+class _Immediate:
+    # Runs the call at once; stands in for a future when rendering in this process
+    def __init__(self, fn, *args):
+        self._exception = None
+        try:
+            self._result = fn(*args)
+        except Exception as e:
+            self._exception = e
+
+    def result(self):
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        return self._exception
+
+    def add_done_callback(self, fn):
+        fn(self)
@@ -0,0 +1,350 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from python_demo.reference import get_reference
+from python_demo.summary import MatrisomeSummary
+from python_demo.util import matrianalyze, matriannotate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(ROOT, 'examples')
+
+
+def synthetic_table(rows, species='human', matrisome_fraction=0.5, n_values=4, seed=0, duplicate_rate=0.0,
+                    n_text=0):
+    """
+    Build a gene table for benchmarking.
+
+    Parameters:
+    - rows: Number of rows
+    - species: Species whose matrisome genes are sampled
+    - matrisome_fraction: Share of rows carrying a matrisome gene, the rest get made-up names
+    - n_values: Number of numeric sample columns
+    - duplicate_rate: Share of rows repeating the gene of an earlier row
+    - n_text: Number of text columns, e.g. descriptions, that matrianalyze has to skip
+
+    Returns:
+    - data: Data frame with a 'Gene Symbol' column, n_values numeric and n_text text columns
+    """
+    rng = np.random.default_rng(seed)
+    genes = get_reference(species).genes
+    other = np.array([f"GENE{i}" for i in range(max(len(genes), 1000, rows))], dtype=object)
+
+    is_matrisome = rng.random(rows) < matrisome_fraction
+    symbols = np.where(is_matrisome,
+                       genes[rng.integers(0, len(genes), rows)],
+                       other[rng.integers(0, len(other), rows)])
+
+    # Repeat earlier genes
+    repeat = np.flatnonzero(rng.random(rows) < duplicate_rate)
+    repeat = repeat[repeat > 0]
+    symbols[repeat] = symbols[rng.integers(0, repeat)]
+
+    data = {'Gene Symbol': symbols}
+    for i in range(n_values):
+        data[f'Sample {i + 1}'] = rng.poisson(5, rows)
+    for i in range(n_text):
+        data[f'Note {i + 1}'] = np.array(['up', 'down', 'n.s.'], dtype=object)[rng.integers(0, 3, rows)]
+    return pd.DataFrame(data)
+
+
+def example_tables(examples_dir=EXAMPLES_DIR):
+    """
+    The example inputs bundled with the repository, as benchmark fixtures.
+
+    Yields:
+    - name, data, gene_column, species
+    """
+    path = os.path.join(examples_dir, 'Mass-spec', 'mass-spec.csv')
+    if os.path.exists(path):
+        yield 'mass-spec', pd.read_csv(path), 'Gene Symbol', 'human'
+
+    for path in sorted(glob.glob(os.path.join(examples_dir, 'Breast*', '*.txt'))):
+        name = 'tcga ' + os.path.splitext(os.path.basename(path))[0]
+        yield name, pd.read_csv(path, sep='\t'), 'Gene', 'human'
+
+
+def bench_annotate(sizes=(10 ** 5, 10 ** 6, 10 ** 7), species='human', repeat=3):
+    """
+    Print the throughput of matriannotate on synthetic tables of increasing size.
+    The reference is loaded before timing, so only the annotation itself is measured.
+    """
+    get_reference(species)
+    results = []
+    for rows in sizes:
+        data = synthetic_table(rows, species)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            matriannotate(data=data, gene_column='Gene Symbol', species=species)
+            best = min(best, time.perf_counter() - start)
+        results.append({'rows': rows, 'seconds': best, 'rows_per_second': rows / best})
+        print(f"matriannotate {rows:>10} rows: {best:8.3f} s, {rows / best:,.0f} rows/s")
+    return pd.DataFrame(results)
+
+
+# Stages measured by the suite, in pipeline order
+STAGES = ['annotate', 'analyze', 'summary', 'render']
+
+
+def _reset_peak_rss():
+    # Linux resets the peak resident set size (VmHWM) when 5 is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak of the whole process, not of the stage, where it cannot be reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(func, repeat=3):
+    """
+    Run func repeat times.
+
+    Returns:
+    - seconds: Fastest wall time
+    - peak_mb: Peak resident set size during the first run
+    - result: Return value of the last run
+    """
+    best = float('inf')
+    peak = None
+    for i in range(repeat):
+        if i == 0:
+            _reset_peak_rss()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+        if i == 0:
+            peak = _peak_rss_mb()
+    return best, peak, result
+
+
+def bench_case(name, data, gene_column, species, stages=STAGES, repeat=3):
+    """
+    Measure every stage of the pipeline on one table.
+
+    Returns:
+    - results: List of dictionaries with case, stage, rows, columns, seconds and peak_mb
+    """
+    from python_demo.render import render_summary
+
+    results = []
+    ann = summary = None
+    steps = {
+        'annotate': lambda: matriannotate(data=data, gene_column=gene_column, species=species),
+        'analyze': lambda: matrianalyze(ann),
+        'summary': lambda: MatrisomeSummary.from_annotated(ann),
+        'render': lambda: render_summary(summary, out)
+    }
+
+    # Later stages need the output of the earlier ones
+    needed = set(stages) | {'annotate'} | ({'summary'} if 'render' in stages else set())
+
+    with tempfile.TemporaryDirectory() as out:
+        for stage in STAGES:
+            if stage not in needed:
+                continue
+            seconds, peak, result = measure(steps[stage], repeat)
+            if stage == 'annotate':
+                ann = result
+            elif stage == 'summary':
+                summary = result
+            if stage in stages:
+                results.append({'case': name, 'stage': stage, 'rows': len(data), 'columns': data.shape[1],
+                                'seconds': seconds, 'peak_mb': peak})
+    return results
+
+
+def bench_suite(sizes=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6), widths=(4,), duplicate_rates=(0.0,),
+                species=('human',), examples=True, stages=STAGES, repeat=3):
+    """
+    Benchmark annotate, analyze, summary and render on the bundled examples and on
+    synthetic tables of every combination of size, width, duplicate rate and species.
+
+    Rendering only depends on the summary, so it is measured on the examples and the
+    smallest synthetic table only.
+
+    Returns:
+    - results: Data frame with one row per case and stage
+    """
+    results = []
+    if examples:
+        for name, data, gene_column, sp in example_tables():
+            results += bench_case(name, data, gene_column, sp, stages, repeat)
+
+    for sp in species:
+        get_reference(sp)
+        for width in widths:
+            for rate in duplicate_rates:
+                for rows in sizes:
+                    data = synthetic_table(rows, sp, n_values=width, duplicate_rate=rate)
+                    case_stages = [s for s in stages if s != 'render' or rows == min(sizes)]
+                    name = f"synthetic {sp} rows={rows} width={width} dup={rate}"
+                    results += bench_case(name, data, 'Gene Symbol', sp, case_stages, repeat)
+
+    results = pd.DataFrame(results)
+    for row in results.itertuples():
+        print(f"{row.case:<55} {row.stage:<9} {row.seconds:9.4f} s {row.peak_mb:9.1f} MB")
+    return results
+
+
+def save_baseline(results, path):
+    """
+    Store suite results as the baseline later runs are compared against.
+    """
+    baseline = {f"{row.case}|{row.stage}": {'seconds': row.seconds, 'peak_mb': row.peak_mb}
+                for row in results.itertuples()}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+
+def compare_baseline(results, path, threshold=0.25):
+    """
+    Compare suite results with a stored baseline.
+
+    Parameters:
+    - results: Data frame returned by bench_suite
+    - path: Baseline written by save_baseline
+    - threshold: Relative slowdown or memory growth that counts as a regression
+
+    Returns:
+    - comparison: results with the baseline values, their ratios and a regression flag
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+
+    keys = results['case'] + '|' + results['stage']
+    comparison = results.copy()
+    comparison['base_seconds'] = [baseline.get(k, {}).get('seconds', np.nan) for k in keys]
+    comparison['base_peak_mb'] = [baseline.get(k, {}).get('peak_mb', np.nan) for k in keys]
+    comparison['time_ratio'] = comparison['seconds'] / comparison['base_seconds']
+    comparison['memory_ratio'] = comparison['peak_mb'] / comparison['base_peak_mb']
+    comparison['regression'] = (comparison['time_ratio'] > 1 + threshold) | (comparison['memory_ratio'] > 1 + threshold)
+
+    for row in comparison[comparison['regression']].itertuples():
+        print(f"regression: {row.case} {row.stage}: {row.seconds:.4f} s (baseline {row.base_seconds:.4f} s), "
+              f"{row.peak_mb:.1f} MB (baseline {row.base_peak_mb:.1f} MB)")
+    return comparison
+
+
+# Import budgets in seconds (cumulative, as reported by python -X importtime)
+IMPORT_BUDGETS = {
+    'python_demo': 0.05,
+    'python_demo.util': 1.5,
+    'python_demo.gui': 1.5,
+    'python_demo.render': 1.5,
+    'python_demo.cli': 1.5
+}
+
+# Backends that importing a module must leave for first use
+HEAVY_MODULES = ['rpy2', 'matplotlib', 'seaborn', 'plotly']
+
+
+def import_time(module, repeat=3):
+    """
+    Measure the cost of importing a module in a fresh interpreter.
+
+    Parameters:
+    - module: Dotted module name
+    - repeat: Number of interpreters started, the fastest one is kept
+
+    Returns:
+    - seconds: Cumulative import time of the module
+    - loaded: Modules of HEAVY_MODULES that the import loaded
+    """
+    code = (f"import sys; import {module}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    best, loaded = float('inf'), []
+    for _ in range(repeat):
+        run = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=root,
+                             capture_output=True, text=True, check=True)
+        # Lines read "import time: self [us] | cumulative | imported package"
+        for line in run.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                best = min(best, int(fields[1]) / 1e6)
+        loaded = [m for m in run.stdout.strip().split(',') if m]
+    return best, loaded
+
+
+def check_import_time(budgets=IMPORT_BUDGETS, repeat=3):
+    """
+    Import-time regression check: every module must import within its budget and
+    without loading any of HEAVY_MODULES.
+
+    Returns:
+    - ok: True if all modules pass
+    """
+    ok = True
+    for module, budget in budgets.items():
+        seconds, loaded = import_time(module, repeat)
+        passed = seconds <= budget and not loaded
+        ok &= passed
+        extra = f", loads {', '.join(loaded)}" if loaded else ""
+        print(f"import {module:<20} {seconds:6.3f} s (budget {budget:.2f} s{extra}) {'ok' if passed else 'FAIL'}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m python_demo.bench')
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('suite', help="benchmark every stage on examples and synthetic tables")
+    p.add_argument('--sizes', type=int, nargs='+', default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6])
+    p.add_argument('--widths', type=int, nargs='+', default=[4])
+    p.add_argument('--duplicate-rates', type=float, nargs='+', default=[0.0])
+    p.add_argument('--species', nargs='+', default=['human'])
+    p.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    p.add_argument('--no-examples', action='store_true')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--save', help="write the results as baseline to this path")
+    p.add_argument('--baseline', help="compare with the baseline at this path")
+    p.add_argument('--threshold', type=float, default=0.25, help="relative regression that fails the run")
+
+    sub.add_parser('annotate', help="throughput of matriannotate")
+    sub.add_parser('imports', help="import-time regression check")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'imports':
+        return 0 if check_import_time() else 1
+
+    if args.command == 'suite':
+        results = bench_suite(args.sizes, args.widths, args.duplicate_rates, args.species, not args.no_examples,
+                              args.stages, args.repeat)
+        failed = False
+        if args.baseline:
+            failed = compare_baseline(results, args.baseline, args.threshold)['regression'].any()
+        if args.save:
+            save_baseline(results, args.save)
+        return 1 if failed else 0
+
+    bench_annotate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import argparse
+import sys
+
+from python_demo.batch import run_batch
+from python_demo.common import ANNOTATE_MODES, DUPLICATE_POLICIES, ID_TYPES, SPECIES
+from python_demo.engines import (ENGINES, matrianalyze_arrow, matrianalyze_polars, matriannotate_arrow,
+                                 matriannotate_polars, read_source)
+from python_demo.multi import matriannotate_multi
+from python_demo.readers import INPUT_FORMATS, read_input_format
+from python_demo.render import FORMATS, PLOTS, render_summary
+from python_demo.result_cache import set_result_cache
+from python_demo.server import serve
+from python_demo.stream import default_sep, write_annotated_stream
+from python_demo.summary import summarize
+from python_demo.util import matrianalyze, matriannotate
+
+
+def read_table(path, sep=None):
+    """
+    Read a CSV/TSV gene table, the separator following the file name unless given,
+    or a Parquet/IPC file.
+    """
+    return read_source(path, 'pandas', sep)
+
+
+def write_table(data, path, index=False):
+    """
+    Write a data frame as CSV/TSV, or to standard output if path is '-'.
+    """
+    if path == '-':
+        data.to_csv(sys.stdout, sep='\t', index=index)
+    else:
+        data.to_csv(path, sep=default_sep(path), index=index)
+
+
+def _read(args):
+    if args.input_format is None:
+        if args.engine == 'pandas':
+            return read_table(args.input, args.sep)
+        return read_source(args.input, args.engine, args.sep)
+
+    # Only the gene column and the quantitative columns, plus the column to group by
+    keep = [args.groupby] if getattr(args, 'groupby', None) else []
+    data = read_input_format(args.input, args.input_format, args.gene_column, args.cache_dir, args.sep, keep)
+    if data is None or args.engine == 'pandas':
+        return data
+    if args.engine == 'arrow':
+        import pyarrow as pa
+        return pa.Table.from_pandas(data, preserve_index=False)
+    import polars as pl
+    return pl.from_pandas(data).lazy()
+
+
+def _annotate(args):
+    data = _read(args)
+    if data is None:
+        return
+    if args.species == 'all':
+        # One row per input row, with the first annotation of every species
+        if args.engine != 'pandas':
+            print("species 'all' runs on the pandas engine, execution stops")
+            return
+        return matriannotate_multi(data, args.gene_column, id_type=args.id_type)
+    if args.engine == 'arrow':
+        return matriannotate_arrow(data, args.gene_column, args.species, args.id_type, args.mode)
+    if args.engine == 'polars':
+        return matriannotate_polars(data, args.gene_column, args.species, args.id_type, args.mode)
+    return matriannotate(data=data, gene_column=args.gene_column, species=args.species, id_type=args.id_type,
+                         mode=args.mode)
+
+
+def _to_pandas(ann, engine):
+    if engine == 'polars':
+        return ann.collect().to_pandas()
+    if engine == 'arrow':
+        return ann.to_pandas()
+    return ann
+
+
+def cmd_annotate(args):
+    if args.chunksize:
+        # Large tables are annotated chunk by chunk
+        write_annotated_stream(args.input, args.output, args.gene_column, args.species, args.chunksize,
+                               args.sep, args.id_type, mode=args.mode)
+        return 0
+
+    ann = _annotate(args)
+    if ann is None:
+        return 1
+    write_table(_to_pandas(ann, args.engine), args.output)
+    return 0
+
+
+def cmd_analyze(args):
+    ann = _annotate(args)
+    if ann is None:
+        return 1
+    if args.engine == 'arrow':
+        tbl = matrianalyze_arrow(ann, duplicates=args.duplicates, groupby=args.groupby)
+    elif args.engine == 'polars':
+        exclude = [args.gene_column] if args.mode == 'append' else []
+        tbl = matrianalyze_polars(ann, duplicates=args.duplicates, groupby=args.groupby, exclude=exclude)
+    else:
+        tbl = matrianalyze(ann, duplicates=args.duplicates, groupby=args.groupby)
+    if tbl is None:
+        return 1
+    write_table(tbl, args.output, index=True)
+    return 0
+
+
+def cmd_plot(args):
+    ann = _annotate(args)
+    if ann is None:
+        return 1
+    for path in render_summary(summarize(_to_pandas(ann, args.engine)), args.output, args.plots, args.format, args.dpi):
+        print(path)
+    return 0
+
+
+def cmd_batch(args):
+    z = run_batch(args.input, args.output, args.species, args.gene_column, args.id_type, args.mode,
+                  args.duplicates, args.plots, args.format, args.dpi, args.workers, args.processes,
+                  resume=not args.restart, write_annotated=args.annotated)
+    if z is None:
+        return 1
+    write_table(z, '-', index=True)
+    return 0
+
+
+def cmd_serve(args):
+    serve(args.species, args.host, args.port, args.socket, args.quiet)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python_demo', description="Annotate and analyze matrisome genes.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def table_command(name, help):
+        p = sub.add_parser(name, help=help)
+        p.add_argument('input', help="CSV/TSV, Parquet or Arrow IPC gene table")
+        p.add_argument('-o', '--output', default='-', help="output path ('-' for standard output)")
+        p.add_argument('-s', '--species', required=True, choices=SPECIES + ['all'],
+                       help="'all' annotates against every species in one pass")
+        p.add_argument('-g', '--gene-column', required=True, help="column with gene IDs")
+        p.add_argument('--id-type', default='auto', choices=['auto'] + ID_TYPES)
+        p.add_argument('--sep', help="field separator of the input, by default from the file name")
+        p.add_argument('--mode', default='expand', choices=ANNOTATE_MODES,
+                       help="'append' keeps the input table as it is and adds the annotation columns")
+        p.add_argument('--engine', default='pandas', choices=ENGINES,
+                       help="'arrow' and 'polars' run multi-threaded and read Parquet/IPC directly")
+        p.add_argument('--input-format', choices=['auto'] + INPUT_FORMATS,
+                       help="read only the gene and quantitative columns of a mass-spec or cBioPortal table")
+        p.add_argument('--cache-dir', help="keep tables read with --input-format here as Parquet")
+        p.add_argument('--result-cache', help="directory of stored pandas engine results, reused for identical runs")
+        return p
+
+    p = table_command('annotate', "annotate a gene table")
+    p.add_argument('--chunksize', type=int, help="annotate the file in chunks of this many rows")
+    p.set_defaults(func=cmd_annotate)
+
+    p = table_command('analyze', "annotate a gene table and sum its numeric columns per division and category")
+    p.add_argument('--duplicates', default='sum', choices=DUPLICATE_POLICIES)
+    p.add_argument('--groupby', help="column to compute the table for each group of")
+    p.set_defaults(func=cmd_analyze)
+
+    p = table_command('plot', "annotate a gene table and render its plots into a directory")
+    p.add_argument('--plots', nargs='+', default=PLOTS, choices=PLOTS)
+    p.add_argument('--format', default='png', choices=FORMATS)
+    p.add_argument('--dpi', type=int, default=100)
+    p.set_defaults(func=cmd_plot)
+
+    p = sub.add_parser('batch', help="annotate, analyze and plot every gene table of a directory")
+    p.add_argument('input', nargs='+', help="directory, glob pattern or files")
+    p.add_argument('-o', '--output', required=True, help="output directory")
+    p.add_argument('-s', '--species', required=True, choices=SPECIES)
+    p.add_argument('-g', '--gene-column', help="column with gene IDs, detected for every file by default")
+    p.add_argument('--id-type', default='auto', choices=['auto'] + ID_TYPES)
+    p.add_argument('--mode', default='expand', choices=ANNOTATE_MODES)
+    p.add_argument('--duplicates', default='sum', choices=DUPLICATE_POLICIES)
+    p.add_argument('--plots', nargs='*', default=PLOTS, choices=PLOTS)
+    p.add_argument('--format', default='png', choices=FORMATS)
+    p.add_argument('--dpi', type=int, default=100)
+    p.add_argument('--workers', type=int, help="annotation threads")
+    p.add_argument('--processes', type=int, help="rendering processes")
+    p.add_argument('--annotated', action='store_true', help="also write the annotated tables")
+    p.add_argument('--restart', action='store_true', help="process every file again instead of resuming")
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser('serve', help="keep the references loaded and annotate gene lists over HTTP")
+    p.add_argument('--species', nargs='+', default=SPECIES, choices=SPECIES, help="species to keep loaded")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--socket', help="listen on this Unix socket instead of host and port")
+    p.add_argument('--quiet', action='store_true', help="do not log requests")
+    p.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'plot' and args.output == '-':
+        print("plot needs an output directory, execution stops")
+        return 1
+    if args.command == 'annotate' and args.chunksize and (args.engine != 'pandas' or args.species == 'all'):
+        print("chunked annotation runs on the pandas engine, execution stops")
+        return 1
+    if args.command == 'annotate' and args.chunksize and args.input_format:
+        print("chunked annotation reads the whole table, execution stops")
+        return 1
+    if args.command == 'annotate' and args.chunksize and args.output == '-':
+        print("chunked annotation needs an output file, execution stops")
+        return 1
+    if getattr(args, 'result_cache', None):
+        set_result_cache(cache_dir=args.result_cache)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,20 @@
 import pandas as pd
 
+SPECIES = ['human', 'mouse', 'c.elegans', 'zebrafish', 'drosophila']
+
+# Identifier types of gene.column: Gene Symbols, NCBI Gene IDs and Ensembl Gene IDs
+ID_TYPES = ['symbol', 'entrez', 'ensembl']
+
+# How matriannotate builds its output: 'expand' rebuilds the table with the annotation
+# columns first and a row per annotation, 'append' adds the annotation columns to the
+# user's table as it is
+ANNOTATE_MODES = ['expand', 'append']
+
+# How rows of the same gene with the same annotation are combined by matrianalyze
+DUPLICATE_POLICIES = ['sum', 'first', 'max']
+
+_CHOICES = {'mode': ANNOTATE_MODES, 'duplicates': DUPLICATE_POLICIES}
+
 
 def data_check1(data):
     if data is None:
@@ -17,3 +32,96 @@ def data_check2(data):
     if 'workflow' not in data.attrs or data.attrs['workflow'] != "matrisomeannotatoR":
         print("data should be annotated first, execution stops")
         return
+
+
+def argument_error(**arguments):
+    """
+    Check the species, id_type, mode and duplicates arguments shared by the annotation
+    and analysis functions; only the arguments given are checked. species may be one
+    species or a list of them, id_type may also be 'auto' or None.
+
+    Returns:
+    - error: Why the first invalid argument is invalid, None if all are valid
+    """
+    for name, value in arguments.items():
+        if name == 'species':
+            species = list(value) if isinstance(value, (list, tuple)) else [value]
+            if not species:
+                return "no species provided"
+            unknown = [s for s in species if s not in SPECIES]
+            if unknown:
+                return f"Species {', '.join(map(str, unknown))} is not recognized"
+        elif name == 'id_type':
+            if value != 'auto' and value is not None and value not in ID_TYPES:
+                return f"id_type {value} is not recognized"
+        elif value not in _CHOICES[name]:
+            return f"{name} should be one of {', '.join(_CHOICES[name])}"
+    return None
+
+
+def check_arguments(**arguments):
+    """
+    argument_error for the functions of the package: prints the error and returns
+    False for an invalid argument, returns True otherwise.
+    """
+    error = argument_error(**arguments)
+    if error is not None:
+        print(f"{error}, execution stops")
+        return False
+    return True
+
+
+# Level order of the annotation columns, as used by the plots
+DIVISION_LEVELS = [
+    "Drosophila matrisome",
+    "Nematode-specific core matrisome",
+    "Nematode-specific matrisome-associated",
+    "Putative Matrisome",
+    "Core matrisome",
+    "Matrisome-associated",
+    "Non-matrisome"
+]
+
+CATEGORY_LEVELS = [
+    "Apical Matrix",
+    "Cuticular Collagens",
+    "Cuticlins",
+    "ECM Glycoproteins",
+    "Collagens",
+    "Proteoglycans",
+    "ECM-affiliated Proteins",
+    "ECM Regulators",
+    "Secreted Factors",
+    "Non-matrisome"
+]
+
+# Colors of the division and category labels
+MATRISOME_COLORS = {
+    "Drosophila matrisome": "#B118DB",
+    "Nematode-specific core matrisome": "#B118DB",
+    "Nematode-specific matrisome-associated": "#741B47",
+    "Putative Matrisome": "#B118DB",
+    "Core matrisome": "#002253",
+    "Matrisome-associated": "#DB3E18",
+    "Apical Matrix": "#B3C5FC",
+    "Cuticular Collagens": "#B3C5FC",
+    "Cuticlins": "#BF9000",
+    "ECM Glycoproteins": "#13349D",
+    "Collagens": "#0584B7",
+    "Proteoglycans": "#59D8E6",
+    "ECM-affiliated Proteins": "#F4651E",
+    "ECM Regulators": "#F9A287",
+    "Secreted Factors": "#FFE188",
+    "Non-matrisome": "#D9D9D9"
+}
+
+
+def label_codes(labels):
+    """
+    Integer codes of a label column and the labels they refer to, in level order
+    for categoricals and sorted otherwise. Missing labels get code -1.
+    """
+    if isinstance(labels.dtype, pd.CategoricalDtype):
+        return labels.cat.codes.to_numpy(), labels.cat.categories
+    codes, uniques = pd.factorize(labels, sort=True)
+    return codes, pd.Index(uniques)
@@ -0,0 +1,270 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+from python_demo.common import CATEGORY_LEVELS, DIVISION_LEVELS
+from python_demo.multi import MULTI_SPECIES
+from python_demo.reference import GeneFingerprints, annotation_fingerprints, gene_keys, get_reference, normalize_ids
+from python_demo.summary import MatrisomeSummary
+from python_demo.util import (PairSums, annotate_codes, annotation_codes, copy_frame, numeric_columns, pair_sums,
+                              pair_totals)
+
+DIVISION = 'Annotated Matrisome Division'
+CATEGORY = 'Annotated Matrisome Category'
+
+
+def _annotations(ref, code):
+    rows = range(ref.starts[code], ref.starts[code] + ref.counts[code])
+    return "; ".join(f"{ref.division_levels[ref.division_codes[i]]} / {ref.category_levels[ref.category_codes[i]]}"
+                     for i in rows)
+
+
+def diff_references(old, new):
+    """
+    Genes whose annotations differ between two references of a species.
+
+    Parameters:
+    - old, new: MatrisomeReference (or MappedReference) of two reference versions,
+      e.g. get_reference(species, rda_path=...) for two .rda files
+
+    Returns:
+    - diff: Data frame with one row per gene that was added, removed or annotated
+      differently, with its old and new annotations as "division / category" lists
+    """
+    old_genes = pd.Index(np.asarray(old.genes, dtype=object))
+    new_genes = pd.Index(np.asarray(new.genes, dtype=object))
+    genes = old_genes.append(new_genes[~new_genes.isin(old_genes)])
+
+    i = old_genes.get_indexer(genes)
+    j = new_genes.get_indexer(genes)
+    before = np.where(i >= 0, annotation_fingerprints(old)[i], np.uint64(0))
+    after = np.where(j >= 0, annotation_fingerprints(new)[j], np.uint64(0))
+    changed = np.flatnonzero(before != after)
+
+    return pd.DataFrame({
+        'Gene': genes[changed],
+        'Change': np.select([i[changed] < 0, j[changed] < 0], ['added', 'removed'], default='changed'),
+        'Old Annotation': [_annotations(old, c) if c >= 0 else "" for c in i[changed]],
+        'New Annotation': [_annotations(new, c) if c >= 0 else "" for c in j[changed]]
+    })
+
+
+def _recorded(fingerprints, keys, matched, id_type):
+    # Fingerprint the table recorded for every key: by the key itself, else by the gene it
+    # matches now, else by its normalized form; 0 for keys that matched no gene
+    found = fingerprints.get(keys)
+    candidates = [(fingerprints.genes, matched)]
+    if id_type is not None:
+        candidates.append((normalize_ids(fingerprints.genes, id_type), normalize_ids(keys, id_type)))
+    for genes, names in candidates:
+        genes = pd.Index(genes)
+        first = np.flatnonzero(~genes.duplicated())
+        position = genes[first].get_indexer(np.asarray(names, dtype=object))
+        fill = (found == 0) & (position >= 0)
+        found[fill] = fingerprints.fingerprints[first[position[fill]]]
+    return found
+
+
+def reannotate(data=None, reference=None, previous=None):
+    """
+    Bring an annotated table up to a newer reference, re-annotating only the rows whose
+    genes the new reference annotates differently.
+
+    The genes whose annotations changed are found from the fingerprints the table
+    recorded (attrs['gene_fingerprints']), or from the previous reference if given.
+    Frames keep their attrs when pickled (DataFrame.to_pickle), so stored tables can
+    be updated later.
+
+    Parameters:
+    - data: Data frame annotated by matriannotate, in either mode; tables of matriannotate_multi
+      are annotated again instead
+    - reference: MatrisomeReference to update to, by default the current one of the table's species
+    - previous: MatrisomeReference the table was annotated with, if still available
+
+    Returns:
+    - ann: Annotated data frame as matriannotate would return it with the new reference
+    - removed: Rows of data that were replaced
+    - added: Rows of ann that replaced them
+    """
+    if data is None:
+        print("no data provided, execution stops")
+        return
+
+    if data.attrs.get('workflow') != "matrisomeannotatoR":
+        print("data should be annotated first, execution stops")
+        return
+
+    if data.attrs.get('species') == MULTI_SPECIES:
+        print("data was annotated against several species, annotate it again with matriannotate_multi, "
+              "execution stops")
+        return
+
+    fingerprints = data.attrs.get('gene_fingerprints')
+    if previous is None and not isinstance(fingerprints, GeneFingerprints):
+        print("data has no gene fingerprints, annotate it again with matriannotate, execution stops")
+        return
+
+    ref = reference if reference is not None else get_reference(data.attrs['species'])
+    if data.attrs.get('reference_version') == ref.version:
+        return data, data.iloc[:0], data.iloc[:0]
+
+    id_type = data.attrs.get('id_type')
+    append = 'gene_column' in data.attrs
+    keys = gene_keys(data[data.attrs['gene_column'] if append else 'Annotated Gene'])
+
+    # Compare the annotations of every distinct gene, old against new
+    inverse, uniques = pd.factorize(keys)
+    codes = ref.codes(uniques, id_type)
+    after = np.where(codes >= 0, annotation_fingerprints(ref)[codes], np.uint64(0))
+    if previous is not None:
+        old_codes = previous.codes(uniques, id_type)
+        before = np.where(old_codes >= 0, annotation_fingerprints(previous)[old_codes], np.uint64(0))
+    else:
+        matched = np.where(codes >= 0, np.asarray(ref.genes, dtype=object)[np.maximum(codes, 0)], None)
+        before = _recorded(fingerprints, uniques, matched, id_type)
+    changed = np.append(before != after, False)[inverse]
+
+    # Recode the existing annotations to the levels of the new reference
+    division_levels = ref.division_levels + [v for v in pd.unique(data[DIVISION]) if v not in ref.division_levels]
+    category_levels = ref.category_levels + [v for v in pd.unique(data[CATEGORY]) if v not in ref.category_levels]
+    division = pd.Categorical(data[DIVISION], categories=division_levels).codes
+    category = pd.Categorical(data[CATEGORY], categories=category_levels).codes
+
+    rows = np.flatnonzero(changed)
+    if append:
+        _, ref_rows = annotate_codes(ref, keys[rows], id_type, first=True)
+        division, category = division.copy(), category.copy()
+        division[rows], category[rows] = annotation_codes(ref, ref_rows)
+        ann = copy_frame(data)
+        new = rows
+    else:
+        ann, division, category, new = _reexpand(data, ref, keys, id_type, rows, division, category)
+
+    ann[DIVISION] = pd.Categorical.from_codes(division, division_levels)
+    ann[CATEGORY] = pd.Categorical.from_codes(category, category_levels)
+
+    ann.attrs = dict(data.attrs)
+    ann.attrs.pop('matrisome_summary', None)
+    ann.attrs['reference_version'] = ref.version
+    hit = np.unique(codes[codes >= 0])
+    ann.attrs['gene_fingerprints'] = GeneFingerprints(ref.version, np.asarray(ref.genes, dtype=object)[hit],
+                                                      annotation_fingerprints(ref)[hit])
+    return ann, data.iloc[rows], ann.iloc[new]
+
+
+def _reexpand(data, ref, keys, id_type, rows, division, category):
+    """
+    Replace the expanded rows of changed genes in a table annotated with mode='expand'.
+
+    The copies of one input row differ only in their annotation, so the rows of a
+    changed gene are grouped by all other columns; a group holding n input rows
+    with k annotations each has n * k rows and k distinct annotations.
+    """
+    others = [i for i, n in enumerate(data.columns) if n not in (DIVISION, CATEGORY)]
+    sub = data.iloc[rows, others]
+    group = pd.factorize(pd.util.hash_pandas_object(sub, index=False).to_numpy())[0]
+
+    pair = division[rows].astype(np.int64) * (int(category.max()) + 1) + category[rows]
+    distinct = pd.DataFrame({'group': group, 'pair': pair}).drop_duplicates()
+    k = np.bincount(distinct['group'], minlength=group.max() + 1 if len(group) else 0)
+    size = np.bincount(group, minlength=len(k))
+    first = rows[np.unique(group, return_index=True)[1]]
+
+    # One source row per input row, then the new expansion of those rows
+    inputs = np.repeat(first, size // np.maximum(k, 1))
+    expand, ref_rows = annotate_codes(ref, keys[inputs], id_type)
+    source = inputs if expand is None else inputs[expand]
+    new_division, new_category = annotation_codes(ref, ref_rows)
+
+    # New rows take the place of the first row of their group
+    kept = np.setdiff1d(np.arange(len(data)), rows, assume_unique=True)
+    order = np.argsort(np.concatenate([kept, source]), kind='stable')
+    take = np.concatenate([kept, source])[order]
+    new = np.flatnonzero(order >= len(kept))
+
+    ann = data.take(take)
+    ann.index = pd.RangeIndex(len(ann))
+    division = np.concatenate([division[kept], new_division])[order]
+    category = np.concatenate([category[kept], new_category])[order]
+    return ann, division, category, new
+
+
+def _levels(levels, values):
+    values = list(dict.fromkeys(values))
+    return [v for v in levels if v in values] + sorted(v for v in values if v not in levels)
+
+
+def update_totals(z=None, removed=None, added=None):
+    """
+    Update a matrianalyze table for rows that were replaced, as returned by reannotate,
+    without the rest of the table: the sums of the removed rows are taken off the
+    stored (division, category) sums and those of the added rows put on.
+
+    Every row of a gene is either replaced or kept, so the update is exact for all
+    duplicates policies; float sums can differ from a full recomputation in the last
+    digits.
+
+    Parameters:
+    - z: Data frame returned by matrianalyze without groupby, or by MatrianalyzeAccumulator;
+      tables grouped by a column are recomputed with matrianalyze instead
+    - removed: Rows taken out of the annotated table
+    - added: Rows put into the annotated table
+
+    Returns:
+    - z: Updated matrianalyze table
+    """
+    if z is None or not isinstance(z.attrs.get('matrisome_pairs'), PairSums):
+        print("z should be a matrianalyze table, execution stops")
+        return
+
+    stored = z.attrs['matrisome_pairs']
+    summary = z.attrs.get('matrisome_summary')
+    if stored.pairs.index.nlevels == 3:
+        print("tables grouped by a column are recomputed with matrianalyze, execution stops")
+        return
+    if not isinstance(summary, MatrisomeSummary):
+        print("z has no gene counts to update, recompute it with matrianalyze, execution stops")
+        return
+
+    columns = list(stored.pairs.columns)
+    counts = summary.counts.stack()
+    pairs = stored.pairs.copy()
+    pairs.index = pairs.index.to_flat_index()
+
+    for rows, sign in ((removed, -1), (added, 1)):
+        if rows is None or len(rows) == 0:
+            continue
+        tr = numeric_columns(rows, exclude=[rows.attrs['gene_column']] if 'gene_column' in rows.attrs else [])
+        missing = [col for col in columns if col not in tr.columns]
+        if missing:
+            print(f"columns {', '.join(map(str, missing))} are not numeric in the rows, execution stops")
+            return
+        part = pair_sums(rows, tr[columns], stored.duplicates)
+        part.index = part.index.to_flat_index()
+        pairs = pairs.add(sign * part, fill_value=0)
+        part_counts = MatrisomeSummary.from_annotated(rows).counts.stack()
+        counts = counts.add(sign * part_counts, fill_value=0)
+
+    # Pairs without rows are dropped, as pair_sums never reports them
+    counts = counts[counts > 0].astype(np.int64)
+    divisions = _levels(DIVISION_LEVELS, [key[0] for key in counts.index])
+    categories = _levels(CATEGORY_LEVELS, [key[1] for key in counts.index])
+    matrix = counts.unstack(fill_value=0).reindex(index=divisions, columns=categories, fill_value=0)
+    matrix.index.name, matrix.columns.name = DIVISION, CATEGORY
+
+    pairs = pairs.reindex(list(counts.index), fill_value=0)
+    index = pd.MultiIndex.from_arrays([pd.Categorical([key[0] for key in pairs.index], categories=divisions),
+                                       pd.Categorical([key[1] for key in pairs.index], categories=categories)],
+                                      names=[DIVISION, CATEGORY])
+    pairs.index = index
+    pairs = pairs.iloc[np.lexsort((index.codes[1], index.codes[0]))]
+    pairs = pairs.astype({col: np.int64 for col in columns if is_integer_dtype(stored.pairs[col].dtype)})
+
+    out = pair_totals(pairs)
+    out.attrs['workflow'] = "matrisomeanalyzeR"
+    out.attrs['matrisome_pairs'] = PairSums(pairs, stored.duplicates, stored.groupby)
+    out.attrs['matrisome_summary'] = MatrisomeSummary(matrix.astype(np.int64))
+    version = getattr(added, 'attrs', {}).get('reference_version')
+    if version is not None:
+        out.attrs['reference_version'] = version
+    return out
@@ -0,0 +1,542 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from python_demo.common import ANNOTATE_MODES, DUPLICATE_POLICIES, check_arguments
+from python_demo.reference import detect_id_type, gene_keys, get_reference
+from python_demo.stream import default_sep
+from python_demo.summary import MatrisomeSummary
+from python_demo.util import (ANNOTATION_COLUMNS, PairSums, annotate_codes, annotation_codes, expand_codes,
+                              matrianalyze, matriannotate, numeric_columns, pair_totals)
+
+# Execution engines of annotate and analyze; pyarrow and polars are only needed for their engine
+ENGINES = ['pandas', 'arrow', 'polars']
+
+GENE, DIVISION, CATEGORY = ANNOTATION_COLUMNS
+
+
+def read_source(path, engine='arrow', sep=None):
+    """
+    Open a Parquet, Arrow IPC/Feather or CSV/TSV file for one of the engines; text
+    files are split on sep, by default the separator following the file name.
+
+    Returns:
+    - table: pyarrow Table for the arrow engine, polars LazyFrame for the polars engine,
+      pandas DataFrame otherwise
+    """
+    ext = os.path.splitext(os.fspath(path))[1].lower()
+    ipc = ext in ('.arrow', '.feather', '.ipc')
+    sep = sep or default_sep(path)
+
+    if engine == 'polars':
+        import polars as pl
+
+        if ext == '.parquet':
+            return pl.scan_parquet(path)
+        if ipc:
+            return pl.scan_ipc(path)
+        return pl.scan_csv(path, separator=sep)
+
+    if engine == 'arrow':
+        if ext == '.parquet':
+            import pyarrow.parquet as pq
+            return pq.read_table(path)
+        if ipc:
+            import pyarrow.feather as feather
+            return feather.read_table(path)
+        import pyarrow.csv as csv
+        return csv.read_csv(path, parse_options=csv.ParseOptions(delimiter=sep))
+
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    if ipc:
+        return pd.read_feather(path)
+    return pd.read_csv(path, sep=sep)
+
+
+def _check(names, gene_column, species, id_type, mode):
+    if gene_column is None:
+        print("a column indicating gene IDs must be provided, execution stops")
+        return False
+
+    if gene_column not in names:
+        print(f"column {gene_column} was not found in data, execution stops")
+        return False
+
+    if not check_arguments(species=species, id_type=id_type, mode=mode):
+        return False
+
+    return True
+
+
+def matriannotate_arrow(table=None, gene_column=None, species=None, id_type='auto', mode='expand'):
+    """
+    matriannotate on a pyarrow Table.
+
+    Genes are matched once per distinct value of the gene column and the rows are
+    expanded with Arrow kernels. Missing values stay nulls instead of being filled
+    with "", and the annotation columns are dictionary arrays over the reference levels
+    (categoricals after to_pandas()). The identifier type is detected from the distinct
+    gene values.
+
+    Parameters:
+    - table: pyarrow Table, or the path of a Parquet, IPC or CSV file
+    - gene_column, species, id_type, mode: See matriannotate
+
+    Returns:
+    - table: Annotated pyarrow Table; its schema metadata holds workflow and id_type
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if table is None:
+        print("no data provided, execution stops")
+        return
+
+    if isinstance(table, (str, os.PathLike)):
+        table = read_source(table, 'arrow')
+
+    if not _check(table.column_names, gene_column, species, id_type, mode):
+        return
+
+    ref = get_reference(species)
+    genes = table.column(gene_column)
+
+    # Distinct gene values and the position of every row among them, -1 for missing genes
+    encoded = pc.dictionary_encode(genes).combine_chunks()
+    uniques = encoded.dictionary.to_pandas()
+    positions = pc.fill_null(encoded.indices, -1).to_numpy()
+
+    if id_type == 'auto':
+        id_type = detect_id_type(uniques)
+
+    unique_codes = np.append(ref.codes(gene_keys(uniques), id_type), -1)
+    rows, ref_rows = expand_codes(ref, unique_codes[positions], first=(mode == 'append'))
+    division, category = annotation_codes(ref, ref_rows)
+
+    division = pa.DictionaryArray.from_arrays(pa.array(division, pa.int8()), pa.array(ref.division_levels))
+    category = pa.DictionaryArray.from_arrays(pa.array(category, pa.int8()), pa.array(ref.category_levels))
+
+    if mode == 'append':
+        gene = _arrow_gene(genes, missing=True)
+        out = table.append_column(GENE, gene).append_column(DIVISION, division).append_column(CATEGORY, category)
+    else:
+        others = table.drop_columns([gene_column])
+        if rows is not None:
+            others = others.take(pa.array(rows))
+            genes = genes.take(pa.array(rows))
+        out = pa.table([_arrow_gene(genes), division, category] + others.columns,
+                       names=[GENE, DIVISION, CATEGORY] + others.column_names)
+
+    metadata = {'workflow': "matrisomeannotatoR", 'id_type': str(id_type), 'species': species,
+                'reference_version': ref.version}
+    if mode == 'append':
+        metadata['gene_column'] = gene_column
+    return out.replace_schema_metadata(metadata)
+
+
+def _arrow_gene(genes, missing=False):
+    # As matriannotate: "" is marked as missing; nulls are "" in expand mode and marked too in append mode
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if not (pa.types.is_string(genes.type) or pa.types.is_large_string(genes.type)):
+        return genes
+    if missing:
+        genes = pc.fill_null(genes, "")
+    gene = pc.if_else(pc.equal(genes, ""), "gene name missing in original data", genes)
+    return pc.fill_null(gene, "")
+
+
+def matrianalyze_arrow(table=None, duplicates='sum', groupby=None):
+    """
+    matrianalyze on an annotated pyarrow Table. The sums are computed with Arrow's
+    multi-threaded hash aggregation; the result is the same small pandas frame as
+    matrianalyze returns.
+
+    Parameters:
+    - table: Annotated pyarrow Table, or the path of a Parquet or IPC file with one
+    - duplicates, groupby: See matrianalyze
+
+    Returns:
+    - z: Data frame in the matrianalyze layout
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if table is None:
+        print("no data provided, execution stops")
+        return
+
+    if isinstance(table, (str, os.PathLike)):
+        table = read_source(table, 'arrow')
+
+    if DIVISION not in table.column_names or CATEGORY not in table.column_names:
+        print("data should be annotated first, execution stops")
+        return
+
+    metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+    exclude = list(ANNOTATION_COLUMNS) + ([metadata['gene_column']] if 'gene_column' in metadata else [])
+
+    groups = _arrow_groups(table, groupby)
+    if groups is False:
+        return
+    if isinstance(groupby, str):
+        exclude.append(groupby)
+
+    if not check_arguments(duplicates=duplicates):
+        return
+
+    # Numeric columns without missing values; text columns are parsed as matrianalyze does
+    values = {}
+    for name in table.column_names:
+        if name in exclude:
+            continue
+        col = table.column(name)
+        if pa.types.is_integer(col.type) or pa.types.is_floating(col.type):
+            if col.null_count or (pa.types.is_floating(col.type) and pc.any(pc.is_nan(col)).as_py()):
+                continue
+            values[name] = col
+        elif pa.types.is_string(col.type) or pa.types.is_large_string(col.type) or pa.types.is_dictionary(col.type):
+            parsed = numeric_columns(pd.DataFrame({name: col.to_pandas()}))
+            if parsed.shape[1]:
+                values[name] = pa.array(parsed.iloc[:, 0].to_numpy())
+
+    div_codes, div_labels = _arrow_codes(table.column(DIVISION))
+    cat_codes, cat_labels = _arrow_codes(table.column(CATEGORY))
+    keys = {'__division__': div_codes, '__category__': cat_codes}
+    if groups is not None:
+        keys = {'__group__': groups[0], **keys}
+    if duplicates != 'sum':
+        keys['__gene__'] = pc.dictionary_encode(table.column(GENE)).combine_chunks().indices
+
+    work = pa.table({**keys, **values})
+    # Leave out rows without a division, category or group, as matrianalyze does
+    valid = np.ones(len(work), dtype=bool)
+    for key in keys:
+        if key != '__gene__':
+            valid &= work.column(key).to_numpy() >= 0
+    if not valid.all():
+        work = work.filter(pa.array(valid))
+
+    names = list(values)
+    group_keys = [k for k in keys if k != '__gene__']
+    if duplicates != 'sum':
+        # Reduce the rows sharing gene, division and category first
+        how = 'first' if duplicates == 'first' else 'max'
+        work = work.group_by(list(keys), use_threads=(how != 'first')).aggregate([(n, how) for n in names])
+        work = work.rename_columns([f'{n}_{how}' if n in names else n for n in _strip(work.column_names, how)])
+        work = work.rename_columns(_strip(work.column_names, how))
+
+    sums = work.group_by(group_keys).aggregate([(n, 'sum') for n in names])
+    sums = sums.rename_columns(_strip(sums.column_names, 'sum')).to_pandas()
+
+    levels = [pd.Categorical.from_codes(sums['__division__'], div_labels),
+              pd.Categorical.from_codes(sums['__category__'], cat_labels)]
+    index_names = [DIVISION, CATEGORY]
+    if groups is not None:
+        levels = [pd.Categorical.from_codes(sums['__group__'], groups[1])] + levels
+        index_names = [groups[2]] + index_names
+
+    pairs = pd.DataFrame({n: sums[n] for n in names}, columns=names)
+    pairs.index = pd.MultiIndex.from_arrays(levels, names=index_names)
+    pairs = _sum_dtypes(pairs)
+
+    z = pair_totals(pairs)
+    z.attrs['workflow'] = "matrisomeanalyzeR"
+    z.attrs['matrisome_pairs'] = PairSums(pairs, duplicates, groupby if isinstance(groupby, str) else None)
+    z.attrs['matrisome_summary'] = MatrisomeSummary.from_codes(
+        div_codes.to_numpy(), div_labels, cat_codes.to_numpy(), cat_labels)
+    return z
+
+
+def _strip(names, how):
+    suffix = f'_{how}'
+    return [n[:-len(suffix)] if n.endswith(suffix) else n for n in names]
+
+
+def _sum_dtypes(pairs):
+    # Sums of integer columns are int64 and all other sums float64, as in matrianalyze
+    return pairs.astype({n: np.int64 if pd.api.types.is_integer_dtype(t) else np.float64
+                         for n, t in pairs.dtypes.items()})
+
+
+def _arrow_codes(col):
+    """
+    Codes and labels of a label column, in dictionary order for dictionary columns and
+    sorted otherwise (as label_codes does for pandas), -1 for missing values.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    col = col.combine_chunks() if isinstance(col, pa.ChunkedArray) else col
+    if pa.types.is_dictionary(col.type):
+        return pc.fill_null(col.indices, -1).cast(pa.int64()), pd.Index(col.dictionary.to_pylist())
+    labels = pc.unique(col.drop_null()).sort()
+    return pc.fill_null(pc.index_in(col, labels), -1).cast(pa.int64()), pd.Index(labels.to_pylist())
+
+
+def _arrow_groups(table, groupby):
+    import pyarrow as pa
+
+    if groupby is None:
+        return None
+    if isinstance(groupby, str):
+        if groupby not in table.column_names:
+            print(f"column {groupby} was not found in data, execution stops")
+            return False
+        codes, labels = _arrow_codes(table.column(groupby))
+        return codes, labels, groupby
+    if len(groupby) != len(table):
+        print("groupby should have one label per row of data, execution stops")
+        return False
+    codes, labels = _arrow_codes(pa.array(pd.Series(groupby), from_pandas=True))
+    return codes, labels, getattr(groupby, 'name', None) or "Group"
+
+
+def matriannotate_polars(frame=None, gene_column=None, species=None, id_type='auto', mode='expand'):
+    """
+    matriannotate on a polars DataFrame or LazyFrame.
+
+    The distinct genes are matched against the reference once and the annotation is
+    a polars join, so a LazyFrame stays lazy and the join runs on all cores. Missing
+    values stay nulls, and the annotation columns are Enums over the reference levels.
+
+    Parameters:
+    - frame: polars DataFrame or LazyFrame, or the path of a Parquet, IPC or CSV file
+    - gene_column, species, id_type, mode: See matriannotate
+
+    Returns:
+    - frame: Annotated frame, lazy if the input was lazy or a path
+    """
+    import polars as pl
+
+    if frame is None:
+        print("no data provided, execution stops")
+        return
+
+    if isinstance(frame, (str, os.PathLike)):
+        frame = read_source(frame, 'polars')
+
+    lazy = isinstance(frame, pl.LazyFrame)
+    lf = frame.lazy()
+    schema = lf.collect_schema()
+
+    if not _check(schema.names(), gene_column, species, id_type, mode):
+        return
+
+    ref = get_reference(species)
+    uniques = lf.select(pl.col(gene_column).drop_nulls().unique(maintain_order=True)).collect().to_series()
+    keys = gene_keys(uniques.to_pandas())
+
+    if id_type == 'auto':
+        id_type = detect_id_type(uniques.to_pandas())
+
+    rows, ref_rows = annotate_codes(ref, keys, id_type, first=(mode == 'append'))
+    index = np.arange(len(keys)) if rows is None else rows
+    division, category = annotation_codes(ref, ref_rows)
+
+    division_type, category_type = pl.Enum(ref.division_levels), pl.Enum(ref.category_levels)
+    mapping = pl.DataFrame([
+        uniques.gather(index),
+        pl.Series(DIVISION, np.array(ref.division_levels, dtype=object)[division], dtype=division_type),
+        pl.Series(CATEGORY, np.array(ref.category_levels, dtype=object)[category], dtype=category_type)
+    ])
+
+    # Genes with several annotations get a row each, in reference order
+    joined = lf.join(mapping.lazy(), on=gene_column, how='left', maintain_order='left_right')
+    annotations = [pl.col(DIVISION).fill_null(pl.lit("Non-matrisome", dtype=division_type)),
+                   pl.col(CATEGORY).fill_null(pl.lit("Non-matrisome", dtype=category_type))]
+
+    gene = pl.col(gene_column)
+    if schema[gene_column] == pl.String:
+        # As matriannotate: nulls are "" in expand mode and marked as missing in append mode
+        if mode == 'append':
+            gene = gene.fill_null("")
+        gene = pl.when(gene == "").then(pl.lit("gene name missing in original data")).otherwise(gene).fill_null("")
+    gene = gene.alias(GENE)
+
+    if mode == 'append':
+        out = joined.select([pl.col(n) for n in schema.names()] + [gene] + annotations)
+    else:
+        out = joined.select([gene] + annotations + [pl.col(n) for n in schema.names() if n != gene_column])
+
+    return out if lazy else out.collect()
+
+
+def matrianalyze_polars(frame=None, duplicates='sum', groupby=None, exclude=()):
+    """
+    matrianalyze on an annotated polars DataFrame or LazyFrame, with the sums computed
+    by a polars group-by; the result is the same small pandas frame as matrianalyze returns.
+
+    Parameters:
+    - frame: Annotated polars DataFrame or LazyFrame
+    - duplicates, groupby: See matrianalyze; groupby must be a column name
+    - exclude: Further columns that are not summed, such as the gene column of a
+      frame annotated with mode='append'
+
+    Returns:
+    - z: Data frame in the matrianalyze layout
+    """
+    import polars as pl
+
+    if frame is None:
+        print("no data provided, execution stops")
+        return
+
+    if isinstance(frame, (str, os.PathLike)):
+        frame = read_source(frame, 'polars')
+
+    df = frame.collect() if isinstance(frame, pl.LazyFrame) else frame
+
+    if DIVISION not in df.columns or CATEGORY not in df.columns:
+        print("data should be annotated first, execution stops")
+        return
+
+    if not check_arguments(duplicates=duplicates):
+        return
+
+    if groupby is not None and groupby not in df.columns:
+        print(f"column {groupby} was not found in data, execution stops")
+        return
+
+    skip = set(ANNOTATION_COLUMNS) | set(exclude) | ({groupby} if groupby is not None else set())
+
+    # Numeric columns without missing values; text columns are parsed as matrianalyze does
+    values = {}
+    for name, dtype in df.schema.items():
+        if name in skip:
+            continue
+        col = df.get_column(name)
+        if dtype.is_numeric():
+            if col.null_count() or (dtype.is_float() and col.is_nan().any()):
+                continue
+            values[name] = col
+        elif dtype == pl.String or dtype in (pl.Categorical, pl.Enum) or isinstance(dtype, (pl.Categorical, pl.Enum)):
+            parsed = numeric_columns(pd.DataFrame({name: col.to_pandas()}))
+            if parsed.shape[1]:
+                values[name] = pl.Series(name, parsed.iloc[:, 0].to_numpy())
+
+    div_codes, div_labels = _polars_codes(df.get_column(DIVISION))
+    cat_codes, cat_labels = _polars_codes(df.get_column(CATEGORY))
+    keys = {'__division__': div_codes, '__category__': cat_codes}
+    if groupby is not None:
+        group_codes, group_labels = _polars_codes(df.get_column(groupby))
+        keys = {'__group__': group_codes, **keys}
+    if duplicates != 'sum':
+        keys['__gene__'] = df.get_column(GENE)
+
+    work = pl.DataFrame({**keys, **values})
+    for key in keys:
+        if key != '__gene__':
+            work = work.filter(pl.col(key) >= 0)
+
+    names = list(values)
+    group_keys = [k for k in keys if k != '__gene__']
+    if duplicates == 'first':
+        work = work.group_by(list(keys), maintain_order=True).agg([pl.col(n).first() for n in names])
+    elif duplicates == 'max':
+        work = work.group_by(list(keys)).agg([pl.col(n).max() for n in names])
+
+    sums = work.group_by(group_keys).agg([pl.col(n).sum() for n in names]).to_pandas()
+
+    levels = [pd.Categorical.from_codes(sums['__division__'], div_labels),
+              pd.Categorical.from_codes(sums['__category__'], cat_labels)]
+    index_names = [DIVISION, CATEGORY]
+    if groupby is not None:
+        levels = [pd.Categorical.from_codes(sums['__group__'], group_labels)] + levels
+        index_names = [groupby] + index_names
+
+    pairs = pd.DataFrame({n: sums[n] for n in names}, columns=names)
+    pairs.index = pd.MultiIndex.from_arrays(levels, names=index_names)
+    pairs = _sum_dtypes(pairs)
+
+    z = pair_totals(pairs)
+    z.attrs['workflow'] = "matrisomeanalyzeR"
+    z.attrs['matrisome_pairs'] = PairSums(pairs, duplicates, groupby)
+    z.attrs['matrisome_summary'] = MatrisomeSummary.from_codes(
+        div_codes.to_numpy(), div_labels, cat_codes.to_numpy(), cat_labels)
+    return z
+
+
+def _polars_codes(col):
+    """
+    Codes and labels of a label column, in category order for Enums and sorted
+    otherwise (as label_codes does for pandas), -1 for missing values. Categoricals
+    have no fixed order in polars and are sorted too; the Enums of matriannotate_polars
+    keep the reference order.
+    """
+    import polars as pl
+
+    if isinstance(col.dtype, pl.Enum):
+        labels = col.dtype.categories
+        return col.to_physical().cast(pl.Int64).fill_null(-1), pd.Index(labels.to_list())
+    labels = col.drop_nulls().unique().sort()
+    codes = col.replace_strict(labels, pl.Series(np.arange(len(labels))), default=-1, return_dtype=pl.Int64)
+    return codes, pd.Index(labels.to_list())
+
+
+def _comparable(data):
+    # Categoricals as labels and missing values as "", so the engines compare cell by cell
+    data = data.reset_index(drop=True).copy()
+    for i in range(data.shape[1]):
+        col = data.iloc[:, i]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            col = col.astype(object)
+        if col.dtype == object or col.isna().any():
+            col = col.astype(object).where(col.notna(), "")
+        data.isetitem(i, col)
+    return data
+
+
+def check_parity(engines=('arrow', 'polars'), modes=ANNOTATE_MODES, duplicates=DUPLICATE_POLICIES):
+    """
+    Check that the arrow and polars engines give the results of the pandas path on the
+    bundled example tables.
+
+    Returns:
+    - results: Data frame with one row per example, engine and mode, and a column
+      'ok' that is True when the annotated tables and every matrianalyze table agree
+    """
+    import pyarrow as pa
+
+    from python_demo.bench import example_tables
+
+    results = []
+    for name, data, gene_column, species in example_tables():
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        for mode in modes:
+            expected = matriannotate(data, gene_column, species, mode=mode)
+            for engine in engines:
+                if engine == 'arrow':
+                    ann = matriannotate_arrow(table, gene_column, species, mode=mode)
+                    annotated = ann.to_pandas()
+                    analyze = lambda d: matrianalyze_arrow(ann, duplicates=d)
+                else:
+                    import polars as pl
+
+                    ann = matriannotate_polars(pl.from_arrow(table), gene_column, species, mode=mode)
+                    annotated = ann.to_pandas()
+                    skip = [gene_column] if mode == 'append' else []
+                    analyze = lambda d: matrianalyze_polars(ann, duplicates=d, exclude=skip)
+
+                problem = None
+                try:
+                    pd.testing.assert_frame_equal(_comparable(annotated), _comparable(expected), check_dtype=False)
+                    for d in duplicates:
+                        pd.testing.assert_frame_equal(analyze(d), matrianalyze(expected, duplicates=d))
+                except AssertionError as e:
+                    problem = str(e).strip().splitlines()[0]
+                results.append({'case': name, 'engine': engine, 'mode': mode, 'ok': problem is None,
+                                'problem': problem})
+
+    results = pd.DataFrame(results)
+    for row in results.itertuples():
+        print(f"{row.case:<50} {row.engine:<7} {row.mode:<7} {'ok' if row.ok else 'DIFF ' + row.problem}")
+    return results
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_parity()['ok'].all() else 1)
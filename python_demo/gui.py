@@ -1,11 +1,10 @@
+from xml.sax.saxutils import escape
+
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.patches import Patch
-import seaborn as sns
-import plotly.graph_objects as go
 
-from python_demo.common import data_check2
+from python_demo.common import MATRISOME_COLORS
+from python_demo.summary import get_summary
 
 
 def create_color_map(unique_values, default_color="#D9D9D9"):
@@ -14,79 +13,82 @@ def create_color_map(unique_values, default_color="#D9D9D9"):
 
     Parameters:
     - unique_values: List of unique values in the data
-    - base_colors: Dictionary with predefined color mappings
-    - default_color: Default color if a value is not in base_colors
+    - default_color: Default color if a value is not in MATRISOME_COLORS
 
     Returns:
     - color_map: Dictionary mapping unique values to colors
     """
-    color_map = {}
+    from matplotlib import colormaps
 
-    base_colors = {
-        "Drosophila matrisome": "#B118DB",
-        "Nematode-specific core matrisome": "#B118DB",
-        "Nematode-specific matrisome-associated": "#741B47",
-        "Putative Matrisome": "#B118DB",
-        "Core matrisome": "#002253",
-        "Matrisome-associated": "#DB3E18",
-        "Apical Matrix": "#B3C5FC",
-        "Cuticular Collagens": "#B3C5FC",
-        "Cuticlins": "#BF9000",
-        "ECM Glycoproteins": "#13349D",
-        "Collagens": "#0584B7",
-        "Proteoglycans": "#59D8E6",
-        "ECM-affiliated Proteins": "#F4651E",
-        "ECM Regulators": "#F9A287",
-        "Secreted Factors": "#FFE188",
-        "Non-matrisome": "#D9D9D9"
-    }
+    color_map = {}
+    tab20 = colormaps['tab20'].colors
 
     for i, value in enumerate(unique_values):
-        # Generate a color if not in base_colors
-        if value in base_colors:
-            color_map[value] = base_colors[value]
+        # Generate a color if not in MATRISOME_COLORS
+        if value in MATRISOME_COLORS:
+            color_map[value] = MATRISOME_COLORS[value]
         else:
-            color_map[value] = plt.cm.tab20.colors[i % len(plt.cm.tab20.colors)]
+            color_map[value] = tab20[i % len(tab20)]
     return color_map
 
 
-def matri_bar(data=None, print_plot=True):
-    data_check2(data)
+def bar_counts(summary):
+    """
+    Counts per division and per category, largest first, as drawn by matri_bar.
+
+    Parameters:
+    - summary: MatrisomeSummary
+
+    Returns:
+    - d1: Data frame with columns Var1 (label), Freq and source (the annotation column)
+    """
+    frames = []
+    for source, counts in (("Annotated Matrisome Division", summary.division_counts),
+                           ("Annotated Matrisome Category", summary.category_counts)):
+        v = counts.sort_values(ascending=False, kind='stable').rename('Freq').reset_index()
+        v.columns = ['Var1', 'Freq']
+        v['source'] = source
+        frames.append(v)
+    d1 = pd.concat(frames)
+    d1['Var1'] = d1['Var1'].astype(str)
+    return d1
+
+
+def draw_bar(fig, d1, source):
+    """
+    Draw the bar plot of one annotation column of bar_counts on a Figure.
+    """
+    import seaborn as sns
 
-    gdf = data.copy()
+    subset = d1[d1['source'] == source]
+    color_map = create_color_map(d1['Var1'].unique())
 
-    # Create data frames for counts
-    v1 = gdf['Annotated Matrisome Division'].value_counts().reset_index()
-    v1.columns = ['Var1', 'Freq']
-    v1['source'] = "Annotated Matrisome Division"
+    ax = fig.add_subplot()
+    p1 = sns.barplot(data=subset, x='Var1', y='Freq', hue='Var1', legend=False, palette=color_map, ax=ax)
 
-    v2 = gdf['Annotated Matrisome Category'].value_counts().reset_index()
-    v2.columns = ['Var1', 'Freq']
-    v2['source'] = "Annotated Matrisome Category"
+    # Fix xticks and labels
+    p1.set_xticks(range(len(subset['Var1'])))
+    p1.set_xticklabels(subset['Var1'], rotation=90, ha='right')
 
-    # Combine data
-    d1 = pd.concat([v1, v2])
+    p1.set_xlabel("")
+    p1.set_ylabel("Counts")
+    p1.set_title(source)
+    fig.tight_layout()  # Adjust layout to fit labels and titles
+    return fig
 
-    # Generate color map based on data
-    unique_values = d1['Var1'].unique()
-    color_map = create_color_map(unique_values)
 
-    # Plot for each source on a separate figure
-    sources = d1['source'].unique()
+def matri_bar(data=None, print_plot=True):
+    import matplotlib.pyplot as plt
 
-    for source in sources:
-        plt.figure(figsize=(12, 8))
-        subset = d1[d1['source'] == source]
-        p1 = sns.barplot(data=subset, x='Var1', y='Freq', hue='Var1', legend=False, palette=color_map)
+    summary = get_summary(data)
+    if summary is None:
+        return
 
-        # Fix xticks and labels
-        p1.set_xticks(range(len(subset['Var1'])))
-        p1.set_xticklabels(subset['Var1'], rotation=90, ha='right')
+    d1 = bar_counts(summary)
 
-        p1.set_xlabel("")
-        p1.set_ylabel("Counts")
-        p1.set_title(source)
-        plt.tight_layout()  # Adjust layout to fit labels and titles
+    # Plot for each source on a separate figure
+    for source in d1['source'].unique():
+        draw_bar(plt.figure(figsize=(12, 8)), d1, source)
 
         if print_plot:
             plt.show()
@@ -94,54 +96,56 @@ def matri_bar(data=None, print_plot=True):
             plt.savefig(f'{source}.png')  # Save figure if not printing
 
     # If print_plot is False, the function will save plots as files in the current directory.
+    # Use python_demo.render.render_batch for per-dataset paths.
+
+
+# Engines matri_flow can draw the flow diagram with
+FLOW_ENGINES = ['plotly', 'matplotlib', 'svg']
 
 
-def matri_flow(data=None, print_plot=True):
-    if data is None:
-        print("no data provided, execution stops")
+def matri_flow(data=None, print_plot=True, engine='plotly'):
+    """
+    Draw the division -> category flow (Sankey) diagram.
+
+    Parameters:
+    - data: Annotated data frame, matrianalyze table or MatrisomeSummary
+    - print_plot: Show the diagram, or save it as matri_flow.png (matri_flow.svg for the svg engine)
+    - engine: 'plotly' for the interactive diagram; 'matplotlib' and 'svg' draw it
+      natively, without plotly's image export
+
+    Returns:
+    - svg: The SVG document if engine is 'svg', otherwise None
+    """
+    summary = get_summary(data)
+    if summary is None:
         return
 
-    if not isinstance(data, pd.DataFrame):
-        print("data should be in data.frame format, execution stops")
+    if engine not in FLOW_ENGINES:
+        print(f"engine should be one of {', '.join(FLOW_ENGINES)}, execution stops")
         return
 
-    if 'workflow' not in data.attrs or data.attrs['workflow'] != "matrisomeannotatoR":
-        print("graphs can only be drawn for annotated files, execution stops")
+    if engine == 'matplotlib':
+        import matplotlib.pyplot as plt
+
+        draw_flow(plt.figure(figsize=(12, 8)), summary)
+        if print_plot:
+            plt.show()
+        else:
+            plt.savefig("matri_flow.png")
         return
 
-    # Create the alluvial data
-    d2 = pd.crosstab(data['Annotated Matrisome Division'], data['Annotated Matrisome Category'])
-    d2 = d2.reset_index()
-    d2 = d2.melt(id_vars='Annotated Matrisome Division', var_name='Annotated Matrisome Category', value_name='Freq')
-    d2 = d2[d2['Freq'] > 0]
-    d2 = d2.fillna("Non-matrisome")
-
-    # Define color mapping
-    color_map = {
-        "Drosophila matrisome": "#B118DB",
-        "Nematode-specific core matrisome": "#B118DB",
-        "Nematode-specific matrisome-associated": "#741B47",
-        "Putative Matrisome": "#B118DB",
-        "Core matrisome": "#002253",
-        "Matrisome-associated": "#DB3E18",
-        "Apical Matrix": "#B3C5FC",
-        "Cuticular Collagens": "#B3C5FC",
-        "Cuticlins": "#BF9000",
-        "ECM Glycoproteins": "#13349D",
-        "Collagens": "#0584B7",
-        "Proteoglycans": "#59D8E6",
-        "ECM-affiliated Proteins": "#F4651E",
-        "ECM Regulators": "#F9A287",
-        "Secreted Factors": "#FFE188",
-        "Non-matrisome": "#D9D9D9"
-    }
-
-    # Mapping the colors to categories
-    color_map_rev = {v: k for k, v in color_map.items()}
-    d2['color'] = d2['Annotated Matrisome Category'].map(color_map).fillna('#D9D9D9')
-
-    # Prepare the data for the Sankey diagram
-    labels = list(pd.concat([d2['Annotated Matrisome Division'], d2['Annotated Matrisome Category']]).unique())
+    if engine == 'svg':
+        svg = flow_svg(summary)
+        if not print_plot:
+            with open("matri_flow.svg", 'w') as f:
+                f.write(svg)
+        return svg
+
+    import plotly.graph_objects as go
+
+    # Division -> category flows, colored by category
+    d2 = summary.flows
+    labels = summary.labels
     label_map = {label: i for i, label in enumerate(labels)}
 
     source_indices = d2['Annotated Matrisome Division'].map(label_map)
@@ -174,48 +178,134 @@ def matri_flow(data=None, print_plot=True):
         fig.write_image("matri_flow.png")  # Save the figure if not printing
 
 
-def matri_ring(data=None, print_plot=True):
-    data_check2(data)
-
-    # Create data frame for counts
-    d2 = pd.crosstab(data['Annotated Matrisome Division'], data['Annotated Matrisome Category'])
-    d2 = d2.reset_index()
-    d2 = d2.melt(id_vars='Annotated Matrisome Division', var_name='Annotated Matrisome Category', value_name='Freq')
-    d2 = d2[d2['Freq'] > 0]
-
-    # Define color mapping
-    color_map = {
-        "Drosophila matrisome": "#B118DB",
-        "Nematode-specific core matrisome": "#B118DB",
-        "Nematode-specific matrisome-associated": "#741B47",
-        "Putative Matrisome": "#B118DB",
-        "Core matrisome": "#002253",
-        "Matrisome-associated": "#DB3E18",
-        "Apical Matrix": "#B3C5FC",
-        "Cuticular Collagens": "#B3C5FC",
-        "Cuticlins": "#BF9000",
-        "ECM Glycoproteins": "#13349D",
-        "Collagens": "#0584B7",
-        "Proteoglycans": "#59D8E6",
-        "ECM-affiliated Proteins": "#F4651E",
-        "ECM Regulators": "#F9A287",
-        "Secreted Factors": "#FFE188",
-        "Non-matrisome": "#D9D9D9"
-    }
-
-    d2['color'] = d2['Annotated Matrisome Category'].map(color_map).fillna('#D9D9D9')
+def flow_layout(summary, pad=0.02):
+    """
+    Lay out the flow diagram in unit coordinates, y running from 0 (top) to 1 (bottom).
+
+    Divisions are stacked on the left and categories on the right, the categories in
+    the order their flows leave the divisions so that the ribbons cross little.
+
+    Parameters:
+    - summary: MatrisomeSummary
+    - pad: Gap between two nodes of a column
 
+    Returns:
+    - nodes: List of (label, column, top, bottom, color), column 0 for divisions and 1 for categories
+    - links: List of (source top, source bottom, target top, target bottom, color)
+    """
+    flows = summary.flows
+    divisions = list(dict.fromkeys(flows['Annotated Matrisome Division']))
+    categories = list(dict.fromkeys(flows['Annotated Matrisome Category']))
+    total = max(summary.total, 1)
+
+    nodes = []
+    tops = {}
+    for column, labels, counts in ((0, divisions, summary.division_counts),
+                                   (1, categories, summary.category_counts)):
+        scale = (1 - pad * (len(labels) - 1)) / total
+        y = 0
+        for label in labels:
+            h = counts[label] * scale
+            nodes.append((label, column, y, y + h, MATRISOME_COLORS.get(label, "#D9D9D9")))
+            tops[column, label] = y
+            y += h + pad
+
+    # Ribbons leave a division in flow order and enter a category in division order
+    scale = (1 - pad * (len(divisions) - 1)) / total, (1 - pad * (len(categories) - 1)) / total
+    links = []
+    for division, category, freq, color in flows[['Annotated Matrisome Division', 'Annotated Matrisome Category',
+                                                  'Freq', 'color']].itertuples(index=False):
+        s0 = tops[0, division]
+        t0 = tops[1, category]
+        s1 = s0 + freq * scale[0]
+        t1 = t0 + freq * scale[1]
+        tops[0, division], tops[1, category] = s1, t1
+        links.append((s0, s1, t0, t1, color))
+
+    return nodes, links
+
+
+def draw_flow(fig, summary, node_width=0.03):
+    """
+    Draw the flow diagram on a Figure with matplotlib patches.
+    """
+    from matplotlib.path import Path
+    from matplotlib.patches import PathPatch, Rectangle
+
+    nodes, links = flow_layout(summary)
+    ax = fig.add_subplot()
+    x0, x1 = node_width, 1 - node_width
+
+    # Ribbons as two cubic Bezier curves joined by the node edges
+    for s0, s1, t0, t1, color in links:
+        xm = (x0 + x1) / 2
+        verts = [(x0, s0), (xm, s0), (xm, t0), (x1, t0), (x1, t1), (xm, t1), (xm, s1), (x0, s1), (x0, s0)]
+        codes = [Path.MOVETO] + [Path.CURVE4] * 3 + [Path.LINETO] + [Path.CURVE4] * 3 + [Path.CLOSEPOLY]
+        ax.add_patch(PathPatch(Path(verts, codes), facecolor=color, edgecolor='none', alpha=0.5))
+
+    for label, column, top, bottom, color in nodes:
+        x = 0 if column == 0 else x1
+        ax.add_patch(Rectangle((x, top), node_width, bottom - top, facecolor=color, edgecolor='black', linewidth=0.5))
+        if column == 0:
+            ax.text(x0 + 0.005, (top + bottom) / 2, label, ha='left', va='center', fontsize=10)
+        else:
+            ax.text(x1 - 0.005, (top + bottom) / 2, label, ha='right', va='center', fontsize=10)
+
+    ax.set_xlim(0, 1)
+    ax.set_ylim(1, 0)
+    ax.axis('off')
+    ax.set_title("Matrisome Flow")
+    fig.tight_layout()
+    return fig
+
+
+def flow_svg(summary, width=1000, height=600, node_width=20):
+    """
+    Draw the flow diagram as a standalone SVG document.
+
+    Returns:
+    - svg: SVG markup as a string
+    """
+    nodes, links = flow_layout(summary)
+    top, inner = 40, height - 60
+    x0, x1 = node_width, width - node_width
+    xm = width / 2
+
+    def y(v):
+        return top + v * inner
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+           f'viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="10">',
+           f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14">Matrisome Flow</text>']
+
+    for s0, s1, t0, t1, color in links:
+        out.append(f'<path d="M{x0},{y(s0):.2f} C{xm},{y(s0):.2f} {xm},{y(t0):.2f} {x1},{y(t0):.2f} '
+                   f'L{x1},{y(t1):.2f} C{xm},{y(t1):.2f} {xm},{y(s1):.2f} {x0},{y(s1):.2f} Z" '
+                   f'fill="{color}" fill-opacity="0.5"/>')
+
+    for label, column, t, b, color in nodes:
+        x = 0 if column == 0 else x1
+        out.append(f'<rect x="{x}" y="{y(t):.2f}" width="{node_width}" height="{y(b) - y(t):.2f}" '
+                   f'fill="{color}" stroke="black" stroke-width="0.5"/>')
+        tx, anchor = (x0 + 5, 'start') if column == 0 else (x1 - 5, 'end')
+        out.append(f'<text x="{tx}" y="{(y(t) + y(b)) / 2:.2f}" text-anchor="{anchor}" '
+                   f'dominant-baseline="middle">{escape(str(label))}</text>')
+
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+def draw_ring(fig, summary):
+    """
+    Draw the ring plot of the matrisome categories on a Figure.
+    """
     # Data preparation for plotting
-    fin = d2.groupby('Annotated Matrisome Category').agg({'Freq': 'sum', 'color': 'first'}).reset_index()
-    fin['Percent'] = (fin['Freq'] / fin['Freq'].sum() * 100).round(1)
+    fin = summary.categories.sort_values(by='Freq')
     fin['lab'] = fin['Annotated Matrisome Category'] + ' (' + fin['Freq'].astype(str) + ', ' + fin['Percent'].astype(
         str) + '%)'
-    fin = fin.sort_values(by='Freq')
-    fin['ymax'] = fin['Freq'].cumsum()
-    fin['ymin'] = fin['ymax'] - fin['Freq']
 
     # Plotting
-    fig, ax = plt.subplots(figsize=(12, 8), subplot_kw=dict(aspect="equal"))
+    ax = fig.add_subplot(aspect="equal")
 
     wedges, _ = ax.pie(
         fin['Freq'],
@@ -235,8 +325,19 @@ def matri_ring(data=None, print_plot=True):
         fontsize=10
     )
 
-    plt.title("Annotated Matrisome Categories")
-    plt.tight_layout()  # Adjust layout to fit labels and legends
+    ax.set_title("Annotated Matrisome Categories")
+    fig.tight_layout()  # Adjust layout to fit labels and legends
+    return fig
+
+
+def matri_ring(data=None, print_plot=True):
+    import matplotlib.pyplot as plt
+
+    summary = get_summary(data)
+    if summary is None:
+        return
+
+    draw_ring(plt.figure(figsize=(12, 8)), summary)
 
     # Save the figure if not printing
     if print_plot:
@@ -245,52 +346,15 @@ def matri_ring(data=None, print_plot=True):
         plt.savefig('matri_ring_with_legend.png')
 
 
-def matri_star(data=None, print_plot=True):
-    if data is None:
-        print("no data provided, execution stops")
-        return
-
-    if not isinstance(data, pd.DataFrame):
-        print("data should be in data.frame format, execution stops")
-        return
-
-    if 'workflow' not in data.attrs or data.attrs['workflow'] != "matrisomeannotatoR":
-        print("graphs can only be drawn for annotated files, execution stops")
-        return
-
-    # Create data frame for counts
-    d2 = pd.crosstab(data['Annotated Matrisome Division'], data['Annotated Matrisome Category'])
-    d2 = d2.reset_index()
-    d2 = d2.melt(id_vars='Annotated Matrisome Division', var_name='Annotated Matrisome Category', value_name='Freq')
-    d2 = d2[d2['Freq'] > 0]
-
-    # Define color mapping
-    color_map = {
-        "Drosophila matrisome": "#B118DB",
-        "Nematode-specific core matrisome": "#B118DB",
-        "Nematode-specific matrisome-associated": "#741B47",
-        "Putative Matrisome": "#B118DB",
-        "Core matrisome": "#002253",
-        "Matrisome-associated": "#DB3E18",
-        "Apical Matrix": "#B3C5FC",
-        "Cuticular Collagens": "#B3C5FC",
-        "Cuticlins": "#BF9000",
-        "ECM Glycoproteins": "#13349D",
-        "Collagens": "#0584B7",
-        "Proteoglycans": "#59D8E6",
-        "ECM-affiliated Proteins": "#F4651E",
-        "ECM Regulators": "#F9A287",
-        "Secreted Factors": "#FFE188",
-        "Non-matrisome": "#D9D9D9"
-    }
-
-    d2['color'] = d2['Annotated Matrisome Category'].map(color_map).fillna('#D9D9D9')
+def draw_star(fig, summary):
+    """
+    Draw the star plot of the matrisome categories on a Figure.
+    """
+    from matplotlib.patches import Circle, Patch
 
     # Data preparation for plotting
-    fin = d2.groupby('Annotated Matrisome Category').agg({'Freq': 'sum', 'color': 'first'}).reset_index()
-    fin['Percent'] = (fin['Freq'] / fin['Freq'].sum() * 100).round(1)
+    fin = summary.categories.sort_values(by='Freq')
     fin['lab'] = fin['Annotated Matrisome Category'] + ' (' + fin['Freq'].astype(str) + ')'
-    fin = fin.sort_values(by='Freq')
 
     # Check if Non-matrisome needs scaling
     max_freq = fin['Freq'].max()
@@ -310,14 +374,14 @@ def matri_star(data=None, print_plot=True):
     labels = fin['lab'].tolist()
     labels += labels[:1]  # Complete the loop
 
-    fig, ax = plt.subplots(figsize=(10, 8), subplot_kw=dict(polar=True))
+    ax = fig.add_subplot(polar=True)
 
     # Draw the bars
-    bars = ax.bar(angles, frequencies, color=colors, width=0.4, edgecolor='w', linewidth=1, zorder=2)
+    ax.bar(angles, frequencies, color=colors, width=0.4, edgecolor='w', linewidth=1, zorder=2)
 
     # Draw the white circle in the middle to create the hollow effect
-    centre_circle = plt.Circle((0, 0), 0.5, color='white', fc='white', linewidth=0)
-    fig.gca().add_artist(centre_circle)
+    centre_circle = Circle((0, 0), 0.5, color='white', fc='white', linewidth=0)
+    ax.add_artist(centre_circle)
 
     # Add labels
     for i in range(num_vars):
@@ -337,13 +401,25 @@ def matri_star(data=None, print_plot=True):
     ax.set_xticklabels(fin['Annotated Matrisome Category'].tolist(), fontsize=10)
 
     # Add legend
-    legend_elements = [Patch(facecolor=color_map[label], label=label) for label in fin['Annotated Matrisome Category']]
+    legend_elements = [Patch(facecolor=color, label=label)
+                       for label, color in zip(fin['Annotated Matrisome Category'], fin['color'])]
     ax.legend(handles=legend_elements, bbox_to_anchor=(1.1, 1), loc='upper left', fontsize=10)
 
-    plt.title("Annotated Matrisome Categories")
-    plt.tight_layout()
+    ax.set_title("Annotated Matrisome Categories")
+    fig.tight_layout()
+    return fig
+
+
+def matri_star(data=None, print_plot=True):
+    import matplotlib.pyplot as plt
+
+    summary = get_summary(data)
+    if summary is None:
+        return
+
+    draw_star(plt.figure(figsize=(10, 8)), summary)
 
     if print_plot:
         plt.show()
     else:
-        plt.savefig('matri_star_plot.png')
\ No newline at end of file
+        plt.savefig('matri_star_plot.png')
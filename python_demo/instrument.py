@@ -0,0 +1,165 @@
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Active instrumentation session of the current context, None when instrumentation is off
+_session = contextvars.ContextVar('matrisome_instrumentation', default=None)
+
+
+class _Session:
+    def __init__(self, callbacks, memory):
+        self.callbacks = callbacks
+        self.memory = memory
+        self.records = []
+        # Open stages of every thread, so that threads sharing the session nest their own stages
+        self._local = threading.local()
+
+    @property
+    def stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+
+@contextmanager
+def instrument(callback=None, memory=True):
+    """
+    Record the pipeline stages run inside the with block.
+
+    Every stage produces one record: a dictionary with stage, parent, start (epoch
+    seconds), seconds, rows_in, rows_out and peak_mb, plus any fields the stage adds.
+
+    Parameters:
+    - callback: Function, or list of functions, called with every record as its stage
+      ends, e.g. json_lines() or log_records()
+    - memory: If True the peak memory of every stage is traced with tracemalloc,
+      which slows allocation-heavy code down somewhat
+
+    Yields:
+    - records: List the records are appended to
+    """
+    callbacks = [] if callback is None else list(callback) if isinstance(callback, (list, tuple)) else [callback]
+    session = _Session(callbacks, memory)
+
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _session.set(session)
+    try:
+        yield session.records
+    finally:
+        _session.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+class Stage:
+    """
+    One running stage. Set rows_out, or add fields with set(), before the block ends.
+    """
+
+    def __init__(self, session, name, rows_in, fields):
+        self.session = session
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.fields = fields
+        self.peak = 0
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        session = self.session
+        if session.memory:
+            # Bank the peak of the enclosing stages before the peak is reset for this one
+            current, peak = tracemalloc.get_traced_memory()
+            for parent in session.stack:
+                parent.peak = max(parent.peak, peak - parent.base)
+            tracemalloc.reset_peak()
+            self.base = current
+        self.parent = session.stack[-1].name if session.stack else None
+        session.stack.append(self)
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.clock
+        session = self.session
+        session.stack.pop()
+
+        peak_mb = None
+        if session.memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            self.peak = max(self.peak, peak - self.base)
+            for parent in session.stack:
+                parent.peak = max(parent.peak, peak - parent.base)
+            peak_mb = round(self.peak / 2 ** 20, 3)
+
+        record = {'stage': self.name, 'parent': self.parent, 'start': self.start, 'seconds': seconds,
+                  'rows_in': self.rows_in, 'rows_out': self.rows_out, 'peak_mb': peak_mb}
+        record.update(self.fields)
+        if exc[0] is not None:
+            record['error'] = exc[0].__name__
+
+        session.records.append(record)
+        for callback in session.callbacks:
+            callback(record)
+        return False
+
+
+class _NullStage:
+    # Stand-in when instrumentation is off, so stages cost next to nothing
+    rows_out = None
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def stage(name, rows_in=None, **fields):
+    """
+    Context manager marking a named pipeline stage, recorded if instrument() is active.
+
+    Parameters:
+    - name: Stage name, dotted by component, e.g. 'annotate.match'
+    - rows_in: Number of input rows
+    - fields: Extra fields of the record
+    """
+    session = _session.get()
+    if session is None:
+        return _NullStage()
+    return Stage(session, name, rows_in, fields)
+
+
+def json_lines(stream=None):
+    """
+    Callback writing every record as one line of JSON, to standard error by default.
+    """
+    def emit(record):
+        print(json.dumps(record, default=str), file=stream or sys.stderr, flush=True)
+    return emit
+
+
+def log_records(logger=None, level=logging.INFO):
+    """
+    Callback sending every record to a logger; the record is attached as the
+    matrisome_stage attribute of the log record for structured handlers.
+    """
+    logger = logger or logging.getLogger('python_demo')
+
+    def emit(record):
+        logger.log(level, "stage %s took %.4f s, rows %s -> %s, peak %s MB", record['stage'], record['seconds'],
+                   record['rows_in'], record['rows_out'], record['peak_mb'], extra={'matrisome_stage': record})
+    return emit
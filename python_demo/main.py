@@ -1,20 +1,17 @@
-import pandas as pd
+import sys
 
-from python_demo.gui import matri_bar, matri_flow, matri_ring
-# from python_demo.gui_star import matri_star
-from python_demo.util import matriannotate, matrianalyze
+from python_demo.cli import main
 
 
 def run():
-    data = pd.read_csv('../data/mass-spec.csv')
+    # Same analysis as before, now through the command line interface; the mass-spec
+    # reader keeps only the gene and quantitative columns, parsed once
+    main(['analyze', '../data/mass-spec.csv', '-s', 'human', '-g', 'Gene Symbol', '--input-format', 'mass-spec'])
+    main(['plot', '../data/mass-spec.csv', '-s', 'human', '-g', 'Gene Symbol', '--input-format', 'mass-spec',
+          '-o', 'plots'])
 
-    # 'human'    'mouse'    'c.elegans'    'zebrafish'    'drosophila'
-    ann = matriannotate(data=data, gene_column="Gene Symbol", species="human")
-    tbl = matrianalyze(ann)
-    matri_bar(ann)
-    matri_flow(ann)
-    matri_ring(ann)
-    # matri_star(ann)
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
     run()
@@ -0,0 +1,199 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from python_demo.common import CATEGORY_LEVELS, DIVISION_LEVELS, check_arguments, data_check1
+from python_demo.instrument import stage
+from python_demo.reference import SPECIES, detect_id_type, gene_keys, get_reference, normalize_ids
+from python_demo.util import copy_frame
+
+# attrs['species'] of tables annotated by matriannotate_multi
+MULTI_SPECIES = 'multi'
+
+# Combined lookups kept in memory, keyed by species and reference versions
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class SpeciesIndex:
+    """
+    Combined lookup over the references of several species: one hash index over the
+    gene identifiers of all species, giving the gene code of an identifier in every
+    species at once, and one per identifier type over the normalized identifiers.
+    """
+
+    def __init__(self, refs):
+        self.refs = list(refs)
+        self.species = [ref.species for ref in self.refs]
+        self.versions = [ref.version for ref in self.refs]
+
+        genes = pd.unique(np.concatenate([np.asarray(ref.genes, dtype=object) for ref in self.refs]))
+        self.index = pd.Index(genes)
+        self.codes = np.column_stack([ref.codes(genes) for ref in self.refs]).astype(np.int32)
+
+        # Normalized identifiers of every type, built on first use
+        self.id_index = {}
+
+    def _normalized(self, id_type):
+        if id_type not in self.id_index:
+            keys = pd.unique(normalize_ids(self.index.to_numpy(), id_type))
+            codes = np.column_stack([ref.id_codes(keys, id_type) for ref in self.refs]).astype(np.int32)
+            self.id_index[id_type] = (pd.Index(keys), codes)
+        return self.id_index[id_type]
+
+    def lookup(self, keys, id_type=None):
+        """
+        Gene codes of identifiers in every species, matched as MatrisomeReference.codes does.
+
+        Returns:
+        - codes: Array of shape (len(keys), number of species), -1 where not found
+        - exact: Boolean array of the same shape, True where the identifier matched as it is
+        """
+        found = self.index.get_indexer(keys)
+        codes = np.where(found[:, None] >= 0, self.codes[found], -1)
+        exact = codes >= 0
+        if id_type is not None:
+            miss = np.flatnonzero((codes < 0).any(axis=1))
+            if len(miss):
+                index, normalized = self._normalized(id_type)
+                found = index.get_indexer(normalize_ids(keys[miss], id_type))
+                fill = np.where(found[:, None] >= 0, normalized[found], -1)
+                codes[miss] = np.where(codes[miss] >= 0, codes[miss], fill)
+        return codes, exact
+
+
+def get_species_index(species=SPECIES):
+    """
+    Return the SpeciesIndex of the current references of the given species.
+    """
+    refs = [get_reference(s) for s in species]
+    key = tuple((ref.species, ref.version) for ref in refs)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            # Indexes of older reference versions are dropped
+            _indexes.clear()
+            index = _indexes[key] = SpeciesIndex(refs)
+    return index
+
+
+def matriannotate_multi(data=None, gene_column=None, species=SPECIES, id_type='auto'):
+    """
+    Annotate a gene table against the matrisome lists of several species in one pass.
+
+    The distinct genes of the table are looked up once in a combined index of all
+    species. The result is the user's table with, for every species, its division and
+    category columns ('<species> Matrisome Division', '<species> Matrisome Category'),
+    then 'Matrisome Species', the best matching species of the gene, and the usual
+    annotation columns taken from that species, so that matrianalyze and the plots
+    work on it. One row is kept per input row: a gene with several annotations in a
+    species gets its first one, as with mode='append'.
+
+    The best match is a species that lists the gene in its matrisome, an exact match
+    before a normalized one, and the first such species in the given order; genes
+    found in no species are Non-matrisome with an empty species.
+
+    Parameters:
+    - data: A data frame
+    - gene_column: Name of the column with gene IDs
+    - species: Species to annotate against, by default all of SPECIES
+    - id_type: Identifier type of the gene column, see matriannotate
+
+    Returns:
+    - df2: Annotated data frame; attrs['species_matches'] counts the rows best matched by every species,
+      attrs['species'] is MULTI_SPECIES
+    """
+    data_check1(data)
+
+    if gene_column is None:
+        print("a column indicating gene IDs must be provided, execution stops")
+        return
+
+    if gene_column not in data.columns:
+        print(f"column {gene_column} was not found in data, execution stops")
+        return
+
+    species = list(species)
+    if not check_arguments(species=species, id_type=id_type):
+        return
+
+    n = gene_column
+    with stage('annotate', rows_in=len(data), species=','.join(species), mode='multi') as st:
+        index = get_species_index(species)
+        if id_type == 'auto':
+            id_type = detect_id_type(data[n])
+
+        # Look every distinct gene up in all species at once
+        with stage('annotate.match', rows_in=len(data)) as sm:
+            inverse, uniques = pd.factorize(gene_keys(data[n]))
+            codes, exact = index.lookup(uniques, id_type)
+            sm.rows_out = len(uniques)
+
+        with stage('annotate.assemble', rows_in=len(data)) as sa:
+            df2 = _assemble(data, n, index, inverse, codes, exact)
+            sa.rows_out = len(df2)
+
+        st.rows_out = len(df2)
+
+    df2.attrs['workflow'] = "matrisomeannotatoR"
+    df2.attrs['id_type'] = id_type
+    df2.attrs['gene_column'] = n
+    # Annotated against several references at once, which delta.reannotate cannot update
+    df2.attrs['species'] = MULTI_SPECIES
+    df2.attrs['reference_version'] = dict(zip(index.species, index.versions))
+    return df2
+
+
+def _assemble(data, n, index, inverse, codes, exact):
+    # Division and category codes of every distinct gene in every species, Non-matrisome where unmatched
+    divisions, categories = [], []
+    for j, ref in enumerate(index.refs):
+        hit = codes[:, j] >= 0
+        rows = np.where(hit, ref.starts[np.maximum(codes[:, j], 0)], 0)
+        divisions.append(np.where(hit, ref.division_codes[rows], ref.division_levels.index("Non-matrisome")))
+        categories.append(np.where(hit, ref.category_codes[rows], ref.category_levels.index("Non-matrisome")))
+
+    # Best species: matrisome genes first, exact matches before normalized ones, then species order
+    matrisome = np.column_stack([np.asarray(ref.division_levels)[divisions[j]] != "Non-matrisome"
+                                 for j, ref in enumerate(index.refs)]) & (codes >= 0)
+    score = np.where(matrisome, 2 + exact, (codes >= 0).astype(int))
+    best = np.where(score.max(axis=1) > 0, score.argmax(axis=1), -1)
+
+    # Per-row values through the inverse of the distinct genes; missing genes are unmatched
+    best = np.append(best, -1)[inverse]
+    df2 = copy_frame(data)
+    for j, ref in enumerate(index.refs):
+        non_division = ref.division_levels.index("Non-matrisome")
+        non_category = ref.category_levels.index("Non-matrisome")
+        df2[f'{ref.species} Matrisome Division'] = pd.Categorical.from_codes(
+            np.append(divisions[j], non_division)[inverse], ref.division_levels)
+        df2[f'{ref.species} Matrisome Category'] = pd.Categorical.from_codes(
+            np.append(categories[j], non_category)[inverse], ref.category_levels)
+    df2['Matrisome Species'] = pd.Categorical.from_codes(best, index.species)
+
+    # Annotation of the best species, over the levels of all species
+    division_levels = _union([ref.division_levels for ref in index.refs], DIVISION_LEVELS)
+    category_levels = _union([ref.category_levels for ref in index.refs], CATEGORY_LEVELS)
+    division = np.full(len(df2), division_levels.index("Non-matrisome"))
+    category = np.full(len(df2), category_levels.index("Non-matrisome"))
+    for j, ref in enumerate(index.refs):
+        rows = np.flatnonzero(best == j)
+        division[rows] = pd.Index(division_levels).get_indexer(
+            np.asarray(ref.division_levels)[np.append(divisions[j], 0)[inverse[rows]]])
+        category[rows] = pd.Index(category_levels).get_indexer(
+            np.asarray(ref.category_levels)[np.append(categories[j], 0)[inverse[rows]]])
+
+    gene = data[n].to_numpy(dtype=object, na_value="")
+    df2['Annotated Gene'] = np.where(gene == "", "gene name missing in original data", gene)
+    df2['Annotated Matrisome Division'] = pd.Categorical.from_codes(division, division_levels)
+    df2['Annotated Matrisome Category'] = pd.Categorical.from_codes(category, category_levels)
+
+    df2.attrs['species_matches'] = dict(zip(index.species, np.bincount(best[best >= 0],
+                                                                        minlength=len(index.species)).tolist()))
+    return df2
+
+
+def _union(level_lists, order):
+    values = [v for levels in level_lists for v in levels]
+    return [v for v in order if v in values] + sorted(set(values) - set(order))
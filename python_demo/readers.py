@@ -0,0 +1,251 @@
+import csv
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Input formats with a dedicated reader
+INPUT_FORMATS = ['mass-spec', 'cbioportal']
+
+# Bump when the parsed tables change, so that older cached tables are not used
+READER_VERSION = 1
+
+# Scaffold mass-spec exports: one column per measure and sample, named '<measure>_<sample>'
+MASS_SPEC_COUNTS = ['Total Spectrum Count', 'Exclusive Spectrum Count', 'Total Unique Spectrum Count',
+                    'Exclusive Unique Spectrum Count', 'Total Unique Peptide Count', 'Exclusive Unique Peptide Count']
+MASS_SPEC_PERCENTS = ['Protein Identification Probability', 'Percent Coverage', 'Percentage of Total Spectra']
+
+# cBioPortal mutated and copy-number altered gene tables
+CBIOPORTAL_COUNTS = ['# Mut', '#', 'Profiled Samples']
+CBIOPORTAL_PERCENTS = ['Freq']
+
+_hashes = {}
+
+
+def file_hash(path):
+    """
+    BLAKE2b hash of the content of a file, memoized on path, size and mtime.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _hashes[key] = h.hexdigest()
+    return _hashes[key]
+
+
+def read_header(path, sep):
+    """
+    Column names of a text table; quoted names may contain the separator, and a UTF-8
+    byte order mark is dropped.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return next(csv.reader(f, delimiter=sep), [])
+
+
+def _measure_columns(header, prefixes):
+    pattern = re.compile('^(' + '|'.join(re.escape(p) for p in prefixes) + ')_')
+    return [name for name in header if pattern.match(name)]
+
+
+def detect_format(path, sep=None):
+    """
+    Input format of a text table from its header: 'mass-spec', 'cbioportal' or None.
+    """
+    if sep is None:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            sep = '\t' if '\t' in f.readline() else ','
+    header = read_header(path, sep)
+    if _measure_columns(header, MASS_SPEC_COUNTS + MASS_SPEC_PERCENTS):
+        return 'mass-spec'
+    if 'Gene' in header and 'Freq' in header and 'Profiled Samples' in header:
+        return 'cbioportal'
+    return None
+
+
+def read_mass_spec(path, gene_column='Gene Symbol', columns=None, cache_dir=None, sep=',', keep=()):
+    """
+    Read a mass-spec export, keeping only the gene column and the quantitative columns.
+
+    Spectrum and peptide counts are read as integers and the percentages ('2.45%')
+    as floats without the percent sign, as numeric_columns would parse them, so that
+    matrianalyze uses the columns as they are.
+
+    Parameters:
+    - path: CSV file
+    - gene_column: Name of the column with gene IDs
+    - columns: Quantitative columns to keep, by default the spectrum counts, peptide
+      counts and percentages of every sample
+    - cache_dir: Directory to keep the parsed table in as Parquet, keyed by the hash
+      of the file; None to always parse
+    - sep: Field separator
+    - keep: Other columns to read as text, e.g. a groupby column
+
+    Returns:
+    - data: Data frame
+    """
+    header = read_header(path, sep)
+    if columns is None:
+        counts = _measure_columns(header, MASS_SPEC_COUNTS)
+        percents = _measure_columns(header, MASS_SPEC_PERCENTS)
+    else:
+        percents = [n for n in columns if n in _measure_columns(header, MASS_SPEC_PERCENTS)]
+        counts = [n for n in columns if n not in percents]
+    return read_columns(path, gene_column, counts, percents, sep, cache_dir, keep)
+
+
+def read_cbioportal(path, gene_column='Gene', columns=None, cache_dir=None, sep='\t', keep=()):
+    """
+    Read a cBioPortal gene table (mutated or copy-number altered genes), keeping only
+    the gene column and the sample counts and frequencies.
+
+    Parameters:
+    - path: Tab-separated file
+    - gene_column: Name of the column with gene IDs
+    - columns: Quantitative columns to keep, by default '# Mut', '#', 'Profiled Samples'
+      and 'Freq' where present; 'Freq' is read as a float without the percent sign
+    - cache_dir: Directory to keep the parsed table in as Parquet, keyed by the hash
+      of the file; None to always parse
+    - sep: Field separator
+    - keep: Other columns to read as text, e.g. a groupby column
+
+    Returns:
+    - data: Data frame
+    """
+    header = read_header(path, sep)
+    if columns is None:
+        columns = [n for n in CBIOPORTAL_COUNTS + CBIOPORTAL_PERCENTS if n in header]
+    percents = [n for n in columns if n in CBIOPORTAL_PERCENTS]
+    counts = [n for n in columns if n not in percents]
+    return read_columns(path, gene_column, counts, percents, sep, cache_dir, keep)
+
+
+def read_columns(path, gene_column, counts, percents, sep, cache_dir=None, keep=()):
+    """
+    Read the gene column, integer columns, percentage columns and the text columns
+    in keep of a text table, in the order of the file.
+
+    The table is parsed by the multi-threaded pyarrow CSV reader if pyarrow is
+    installed, by the pandas C parser otherwise. With cache_dir, the result is kept
+    as Parquet under the hash of the file and the columns read, and read back from
+    there on later calls.
+
+    Returns:
+    - data: Data frame, None if a column is missing or does not parse
+    """
+    header = read_header(path, sep)
+    text = [gene_column] + [n for n in keep if n != gene_column]
+    missing = [n for n in text + counts + percents if n not in header]
+    if missing:
+        print(f"columns {', '.join(map(str, missing))} were not found in {path}, execution stops")
+        return
+
+    names = [n for n in header if n in text or n in counts or n in percents]
+
+    cached = None
+    if cache_dir is not None:
+        settings = repr((READER_VERSION, file_hash(path), sep, text, counts, percents))
+        key = hashlib.blake2b(settings.encode(), digest_size=16).hexdigest()
+        cached = os.path.join(cache_dir, f'{key}.parquet')
+        if os.path.exists(cached):
+            return pd.read_parquet(cached)
+
+    try:
+        data = _read_arrow(path, sep, names, text, counts, percents)
+    except ImportError:
+        data = _read_pandas(path, sep, names, text, counts, percents)
+    except ValueError as e:
+        # pyarrow.ArrowInvalid is a ValueError
+        print(f"{path} could not be parsed ({str(e).splitlines()[0]}), execution stops")
+        return
+    if data is None:
+        return
+
+    if cached is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = cached + '.tmp'
+        data.to_parquet(tmp, index=False)
+        os.replace(tmp, cached)
+    return data
+
+
+def _read_arrow(path, sep, names, text, counts, percents):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as csv
+
+    types = {n: pa.string() for n in text}
+    types.update({n: pa.int64() for n in counts})
+    types.update({n: pa.string() for n in percents})
+    table = csv.read_csv(path, parse_options=csv.ParseOptions(delimiter=sep),
+                         convert_options=csv.ConvertOptions(include_columns=names, column_types=types,
+                                                            strings_can_be_null=True))
+
+    # '2.45%' -> 2.45
+    for n in percents:
+        i = table.schema.get_field_index(n)
+        table = table.set_column(i, n, pc.cast(pc.utf8_rtrim(pc.utf8_trim_whitespace(table[n]), characters='%'),
+                                               pa.float64()))
+    return table.to_pandas()
+
+
+def _read_pandas(path, sep, names, text, counts, percents):
+    dtypes = {n: object for n in text}
+    dtypes.update({n: str for n in percents})
+    try:
+        data = pd.read_csv(path, sep=sep, usecols=names, dtype=dtypes, encoding='utf-8-sig')
+    except ValueError as e:
+        print(f"{path} could not be parsed ({e}), execution stops")
+        return
+
+    for n in counts:
+        if not pd.api.types.is_numeric_dtype(data[n].dtype):
+            print(f"{path} could not be parsed (column {n} is not numeric), execution stops")
+            return
+    for n in percents:
+        x = data[n].str.strip().str.rstrip('%')
+        data[n] = pd.to_numeric(x, errors='coerce').astype(np.float64)
+        if (data[n].isna() & x.notna()).any():
+            print(f"{path} could not be parsed (column {n} is not a percentage), execution stops")
+            return
+    return data
+
+
+def read_input_format(path, fmt, gene_column=None, cache_dir=None, sep=None, keep=()):
+    """
+    Read a table with the reader of its input format.
+
+    Parameters:
+    - path: Text file
+    - fmt: One of INPUT_FORMATS, or 'auto' to detect it from the header
+    - gene_column: Name of the column with gene IDs, by default that of the format
+    - cache_dir: Parquet cache directory, see read_columns
+    - sep: Field separator, by default that of the format
+    - keep: Other columns to read as text
+
+    Returns:
+    - data: Data frame, None if the format is not recognized
+    """
+    if fmt == 'auto':
+        fmt = detect_format(path, sep)
+        if fmt is None:
+            print(f"the format of {path} is not recognized, execution stops")
+            return
+
+    options = {'cache_dir': cache_dir, 'keep': keep}
+    if gene_column is not None:
+        options['gene_column'] = gene_column
+    if sep is not None:
+        options['sep'] = sep
+
+    if fmt == 'mass-spec':
+        return read_mass_spec(path, **options)
+    if fmt == 'cbioportal':
+        return read_cbioportal(path, **options)
+    print(f"input format {fmt} is not recognized, execution stops")
+    return
@@ -0,0 +1,735 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype, is_object_dtype, is_string_dtype
+
+from python_demo.common import CATEGORY_LEVELS, DIVISION_LEVELS, ID_TYPES, SPECIES, argument_error
+from python_demo.instrument import stage
+
+RDA_PATH = '../data/matrisome.list.rda'
+REFERENCE_COLUMNS = ['gene', 'category', 'family']
+
+ENSEMBL_PATTERN = r'^ENS[A-Z]*G\d+(?:\.\d+)?$'
+ENTREZ_PATTERN = r'^\d+$'
+
+# Bump when the layout of the cached files changes, so old caches get rebuilt
+CACHE_FORMAT = 1
+MANIFEST = 'manifest.json'
+
+# Number of MatrisomeReference objects kept in memory (all species of one version)
+REGISTRY_SIZE = 5
+
+# Bump when the layout of the memory-mapped reference store changes
+STORE_FORMAT = 1
+STORE_META = 'store.json'
+# With MATRISOME_STORE=1 get_reference maps the shared store instead of building a reference per process
+_use_store = os.environ.get('MATRISOME_STORE', '') not in ('', '0')
+
+_checksums = {}
+_manifests = {}
+_registry = OrderedDict()
+_registry_lock = threading.Lock()
+
+
+def get_matrisome_data(rda_path=RDA_PATH):
+    # rpy2 is only needed to build the cache, so it is imported here
+    import rpy2.robjects as robjects
+    from rpy2.robjects import pandas2ri
+
+    # Enable conversion between pandas and R data frames
+    pandas2ri.activate()
+    # Load the R `load` function
+    robjects.r['load'](rda_path)
+    # Read the R object, assuming matrisome_list is the object name in R
+    matrisome_list = robjects.globalenv['matrisome.list']
+
+    return {species: pandas2ri.rpy2py(matrisome_list.rx2(species)) for species in SPECIES}
+
+
+def source_checksum(rda_path=RDA_PATH):
+    """
+    SHA-256 of the matrisome .rda file, memoized on path, size and mtime.
+    """
+    st = os.stat(rda_path)
+    key = (os.path.abspath(rda_path), st.st_size, st.st_mtime_ns)
+    if key not in _checksums:
+        h = hashlib.sha256()
+        with open(rda_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _checksums[key] = h.hexdigest()
+    return _checksums[key]
+
+
+def default_cache_dir(rda_path=RDA_PATH):
+    cache_dir = os.environ.get('MATRISOME_CACHE_DIR')
+    if cache_dir:
+        return cache_dir
+    return os.path.join(os.path.dirname(os.path.abspath(rda_path)), 'matrisome_cache')
+
+
+def read_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _manifests:
+        with open(path) as f:
+            _manifests[key] = json.load(f)
+    return _manifests[key]
+
+
+def _write_atomic(path, write):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def build_reference_cache(rda_path=RDA_PATH, cache_dir=None):
+    """
+    Convert the matrisome .rda into the on-disk cache (one .npz file per species).
+
+    This is the only step that needs R and rpy2. Every column is stored as a
+    fixed-width unicode array, so loading a species later needs numpy only.
+
+    Parameters:
+    - rda_path: Path of matrisome.list.rda
+    - cache_dir: Directory of the cache, defaults to default_cache_dir(rda_path)
+
+    Returns:
+    - manifest: Dictionary describing the cache that was written
+    """
+    cache_dir = cache_dir or default_cache_dir(rda_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    checksum = source_checksum(rda_path)
+    with stage('reference.read_rda'):
+        matrisome_list = get_matrisome_data(rda_path)
+
+    files = {}
+    rows = {}
+    for species in SPECIES:
+        k = matrisome_list[species]
+        arrays = {col: k[col].astype(str).to_numpy(dtype=str) for col in REFERENCE_COLUMNS}
+        fname = f'{species}.{checksum[:12]}.npz'
+        _write_atomic(os.path.join(cache_dir, fname), lambda f: np.savez(f, **arrays))
+        files[species] = fname
+        rows[species] = len(k)
+
+    manifest = {
+        'format': CACHE_FORMAT,
+        'source': os.path.basename(rda_path),
+        'sha256': checksum,
+        'species': files,
+        'rows': rows
+    }
+    _write_atomic(os.path.join(cache_dir, MANIFEST),
+                  lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+
+    # Remove species files left over from an older source file
+    for fname in os.listdir(cache_dir):
+        if fname.endswith('.npz') and fname not in files.values():
+            os.remove(os.path.join(cache_dir, fname))
+
+    return manifest
+
+
+def current_manifest(rda_path=RDA_PATH, cache_dir=None):
+    """
+    Return the cache manifest, rebuilding the cache first if the source .rda
+    has changed since it was built. Without the .rda the cache is used as is.
+    """
+    cache_dir = cache_dir or default_cache_dir(rda_path)
+    manifest = read_manifest(cache_dir)
+
+    if os.path.exists(rda_path):
+        if (manifest is None or manifest.get('format') != CACHE_FORMAT
+                or manifest.get('sha256') != source_checksum(rda_path)):
+            with stage('reference.build'):
+                manifest = build_reference_cache(rda_path, cache_dir)
+    elif manifest is None:
+        raise FileNotFoundError(f"neither {rda_path} nor a matrisome cache in {cache_dir} was found")
+
+    return manifest
+
+
+def reference_version(rda_path=RDA_PATH, cache_dir=None):
+    return current_manifest(rda_path, cache_dir)['sha256'][:12]
+
+
+def load_species(species, rda_path=RDA_PATH, cache_dir=None):
+    """
+    Load the matrisome table of one species from the cache.
+
+    Parameters:
+    - species: One of SPECIES
+    - rda_path: Path of matrisome.list.rda, used to check that the cache is current
+    - cache_dir: Directory of the cache, defaults to default_cache_dir(rda_path)
+
+    Returns:
+    - k: Data frame with the gene, category and family columns
+    """
+    error = argument_error(species=species)
+    if error is not None:
+        raise ValueError(error)
+
+    cache_dir = cache_dir or default_cache_dir(rda_path)
+    manifest = current_manifest(rda_path, cache_dir)
+
+    with np.load(os.path.join(cache_dir, manifest['species'][species]), allow_pickle=False) as npz:
+        return pd.DataFrame({col: npz[col].astype(object) for col in REFERENCE_COLUMNS})
+
+
+def normalize_species(species, k):
+    """
+    Harmonize the division (category) and category (family) labels of a species
+    with the human/mouse vocabulary.
+
+    Parameters:
+    - species: One of SPECIES
+    - k: Data frame as returned by load_species
+
+    Returns:
+    - k: New data frame with relabelled columns, the input is left untouched
+    """
+    division = k['category'].to_numpy(dtype=object)
+    category = k['family'].to_numpy(dtype=object)
+
+    if species == "c.elegans":
+        category = np.where(category == "ECM-affiliated", "ECM-affiliated Proteins", category)
+    elif species == "zebrafish":
+        division = np.where(division == "not.available", "Non-matrisome", division)
+        category = np.where(np.isin(category, ["", "not.available"]), "Non-matrisome", category)
+    elif species == "drosophila":
+        division = np.select(
+            [division == "Homologs/Orthologs to Mammalian Matrisome-Associated Genes",
+             division == "Homologs/Orthologs to Mammalian Core Matrisome Genes"],
+            ["Matrisome-associated", "Core matrisome"],
+            default="Drosophila matrisome").astype(object)
+        category = np.where(category == "ECM-affiliated", "ECM-affiliated Proteins", category)
+
+    return pd.DataFrame({'gene': k['gene'].to_numpy(dtype=object), 'category': division, 'family': category})
+
+
+class MatrisomeReference:
+    """
+    Normalized, read-only matrisome table of one species and reference version,
+    together with a hash index from gene identifier to its annotations.
+
+    A gene identifier can carry more than one annotation in the matrisome lists;
+    its rows are stored contiguously, starting at starts[code] and spanning
+    counts[code] rows of the division and category arrays. The same rows are
+    also encoded as integer codes into division_levels and category_levels.
+    """
+
+    def __init__(self, species, version, k):
+        k = normalize_species(species, k).drop_duplicates(ignore_index=True)
+
+        codes, genes = pd.factorize(k['gene'])
+        order = np.argsort(codes, kind='stable')
+
+        self.species = species
+        self.version = version
+        self.genes = _readonly(np.asarray(genes, dtype=object))
+        self.index = pd.Index(self.genes)
+        self.counts = _readonly(np.bincount(codes, minlength=len(genes)))
+        self.starts = _readonly(np.cumsum(self.counts) - self.counts)
+        self.gene = _readonly(k['gene'].to_numpy()[order])
+        self.division = _readonly(k['category'].to_numpy()[order])
+        self.category = _readonly(k['family'].to_numpy()[order])
+
+        # Fixed level order first, then any label a newer reference may add
+        self.division_levels = _levels(DIVISION_LEVELS, self.division)
+        self.category_levels = _levels(CATEGORY_LEVELS, self.category)
+        self.division_codes = _readonly(pd.Index(self.division_levels).get_indexer(self.division).astype(np.int8))
+        self.category_codes = _readonly(pd.Index(self.category_levels).get_indexer(self.category).astype(np.int8))
+
+        # One index per identifier type, keyed by the normalized identifier
+        self.id_types = _readonly(classify_ids(self.genes))
+        self.id_index = {}
+        for id_type in ID_TYPES:
+            positions = np.flatnonzero(self.id_types == id_type)
+            keys = normalize_ids(self.genes[positions], id_type)
+            first = ~pd.Series(keys).duplicated().to_numpy()
+            self.id_index[id_type] = (pd.Index(keys[first]), _readonly(positions[first]))
+
+        # Build the hash tables now rather than on the first lookup
+        self.index.get_indexer(self.genes[:1])
+        for keys, _ in self.id_index.values():
+            keys.get_indexer(keys[:1])
+
+    def __len__(self):
+        return len(self.gene)
+
+    def __repr__(self):
+        return f"MatrisomeReference(species={self.species!r}, version={self.version!r}, rows={len(self)})"
+
+    @property
+    def table(self):
+        # A fresh frame over the read-only arrays, so callers cannot alter the cached copy
+        return pd.DataFrame({'gene': self.gene, 'category': self.division, 'family': self.category}, copy=False)
+
+    def codes(self, genes, id_type=None):
+        """
+        Vectorized lookup of gene identifiers, returning -1 where a gene is not in the matrisome.
+
+        Identifiers are matched exactly; with an id_type, those without an exact
+        match are looked up again after normalization (case-insensitive symbols,
+        version-stripped Ensembl IDs).
+        """
+        genes = np.asarray(genes, dtype=object)
+        if id_type is None:
+            return self.index.get_indexer(genes)
+
+        # Normalize each distinct identifier once rather than every row
+        inverse, uniques = pd.factorize(genes)
+        if len(uniques) == 0:
+            return np.full(len(genes), -1)
+        codes = self.index.get_indexer(uniques)
+        miss = np.flatnonzero(codes < 0)
+        if len(miss):
+            codes[miss] = self.id_codes(normalize_ids(uniques[miss], id_type), id_type)
+        return np.where(inverse >= 0, codes[inverse], -1)
+
+    def id_codes(self, keys, id_type):
+        """
+        Gene codes of identifiers already normalized with normalize_ids, -1 where not found.
+        """
+        index, positions = self.id_index[id_type]
+        if len(index) == 0:
+            return np.full(len(keys), -1)
+        found = index.get_indexer(keys)
+        return np.where(found >= 0, positions[found], -1)
+
+    def lookup(self, gene):
+        """
+        Return the list of (division, category) annotations of a single gene identifier.
+        """
+        code = self.index.get_indexer([gene])[0]
+        if code < 0:
+            return []
+        rows = range(self.starts[code], self.starts[code] + self.counts[code])
+        return [(self.division[i], self.category[i]) for i in rows]
+
+
+def annotation_fingerprints(ref):
+    """
+    64-bit fingerprint of the annotations of every gene of a reference, a hash of its
+    (division, category) rows in order. A gene keeps its fingerprint across reference
+    versions as long as its annotations stay the same.
+    """
+    fingerprints = getattr(ref, '_fingerprints', None)
+    if fingerprints is None:
+        labels = (np.array(ref.division_levels, dtype=object)[ref.division_codes] + '\x1f'
+                  + np.array(ref.category_levels, dtype=object)[ref.category_codes])
+        rows = pd.util.hash_array(labels)
+        # Weigh the rows by their position within the gene, so the order counts too
+        offsets = (np.arange(len(rows)) - np.repeat(ref.starts, ref.counts)).astype(np.uint64)
+        rows = rows * (2 * offsets + np.uint64(1))
+        fingerprints = np.add.reduceat(rows, ref.starts) if len(rows) else np.zeros(0, dtype=np.uint64)
+        ref._fingerprints = fingerprints = _readonly(fingerprints + ref.counts.astype(np.uint64))
+    return fingerprints
+
+
+class GeneFingerprints:
+    """
+    Annotation fingerprints of the matrisome genes an annotated table matched, with
+    the reference version they come from. matriannotate keeps them in
+    attrs['gene_fingerprints'], so delta.reannotate can find the genes of the table
+    that a newer reference annotates differently.
+    """
+
+    def __init__(self, version, genes, fingerprints):
+        self.version = version
+        self.genes = np.asarray(genes, dtype=object)
+        self.fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.genes)
+
+    def __repr__(self):
+        return f"GeneFingerprints(version={self.version!r}, genes={len(self)})"
+
+    def __deepcopy__(self, memo):
+        # reannotate builds a new instance rather than editing this one, so the genes and
+        # fingerprints of every table derived from an annotated one can be shared
+        return self
+
+    @classmethod
+    def from_rows(cls, ref, ref_rows):
+        """
+        Fingerprints of the genes whose reference rows occur in ref_rows, as returned by annotate_codes.
+        """
+        hit = np.zeros(len(ref), dtype=bool)
+        hit[ref_rows[ref_rows >= 0]] = True
+        genes = np.flatnonzero(np.logical_or.reduceat(hit, ref.starts)) if len(ref) else np.zeros(0, dtype=np.int64)
+        return cls(ref.version, np.asarray(ref.genes)[genes], annotation_fingerprints(ref)[genes])
+
+    def get(self, genes):
+        """
+        Fingerprints of reference gene names, 0 for genes the table did not match.
+        """
+        found = pd.Index(self.genes).get_indexer(np.asarray(genes, dtype=object))
+        return np.where(found >= 0, self.fingerprints[found], np.uint64(0))
+
+    def to_dict(self):
+        return {'version': self.version, 'genes': self.genes.tolist(),
+                'fingerprints': [format(int(x), '016x') for x in self.fingerprints]}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['version'], d['genes'], np.array([int(x, 16) for x in d['fingerprints']], dtype=np.uint64))
+
+
+def gene_keys(values):
+    """
+    Turn a gene column into an object array of identifier strings, keeping missing values.
+    Numeric columns (NCBI Gene IDs) are written without a decimal part.
+    """
+    s = pd.Series(values)
+    if is_numeric_dtype(s.dtype) and not is_bool_dtype(s.dtype):
+        s = s.astype('Int64') if (s.dropna() % 1 == 0).all() else s
+        return np.where(s.isna(), None, s.astype(str)).astype(object)
+    if is_object_dtype(s.dtype) or is_string_dtype(s.dtype):
+        return s.to_numpy(dtype=object, na_value=None)
+    return s.astype(str).to_numpy(dtype=object)
+
+
+def classify_ids(values):
+    """
+    Return the identifier type (one of ID_TYPES) of every value.
+    """
+    s = pd.Series(values, dtype=object).astype(str).str.strip()
+    return np.select([s.str.match(ENSEMBL_PATTERN, case=False), s.str.match(ENTREZ_PATTERN)],
+                     ['ensembl', 'entrez'], default='symbol').astype(object)
+
+
+def detect_id_type(values, sample_size=1000, seed=0):
+    """
+    Guess the identifier type of a gene column from a random sample of its values.
+
+    Parameters:
+    - values: Gene column
+    - sample_size: Number of non-missing values inspected
+
+    Returns:
+    - id_type: One of ID_TYPES
+    """
+    s = pd.Series(values)
+    if is_numeric_dtype(s.dtype) and not is_bool_dtype(s.dtype):
+        return 'entrez'
+    if len(s) > sample_size:
+        s = s.sample(sample_size, random_state=seed)
+    s = s[s.notna()]
+    if len(s) == 0:
+        return 'symbol'
+
+    found = pd.Series(classify_ids(s.to_numpy())).value_counts()
+    return found.index[0]
+
+
+def normalize_ids(values, id_type):
+    """
+    Normalize identifiers of one type to the form used as key in MatrisomeReference.id_index.
+    """
+    s = pd.Series(values, dtype=object).astype(str).str.strip()
+    if id_type == 'ensembl':
+        return s.str.upper().str.replace(r'\.\d+$', '', regex=True).to_numpy(dtype=object)
+    if id_type == 'symbol':
+        return s.str.upper().to_numpy(dtype=object)
+    return s.to_numpy(dtype=object)
+
+
+def _levels(levels, values):
+    return levels + sorted(set(values) - set(levels))
+
+
+def _readonly(a):
+    a.flags.writeable = False
+    return a
+
+
+class MappedReference:
+    """
+    MatrisomeReference read from the memory-mapped reference store.
+
+    Every array is a read-only memory map of a .npy file of the store, so processes
+    mapping the same store share one copy of the reference in the page cache and
+    nothing is parsed or indexed at startup. Gene identifiers are stored sorted and
+    looked up by binary search instead of a hash index; gene codes are positions
+    in that sorted order.
+    """
+
+    def __init__(self, species, path):
+        with open(os.path.join(path, STORE_META)) as f:
+            meta = json.load(f)
+        if meta.get('format') != STORE_FORMAT or species not in meta['species']:
+            raise ValueError(f"{path} is not a reference store of {species}")
+
+        def array(name):
+            return np.load(os.path.join(path, f'{species}.{name}.npy'), mmap_mode='r')
+
+        self.species = species
+        self.version = meta['version']
+        self.path = path
+        self.genes = array('genes')
+        self.counts = array('counts')
+        self.starts = array('starts')
+        self.division_codes = array('division_codes')
+        self.category_codes = array('category_codes')
+        self.division_levels = meta['species'][species]['division_levels']
+        self.category_levels = meta['species'][species]['category_levels']
+        self.id_index = {id_type: (array(f'{id_type}_keys'), array(f'{id_type}_positions')) for id_type in ID_TYPES}
+
+    def __len__(self):
+        return len(self.division_codes)
+
+    def __repr__(self):
+        return f"MappedReference(species={self.species!r}, version={self.version!r}, rows={len(self)})"
+
+    @property
+    def gene(self):
+        return np.repeat(self.genes, self.counts).astype(object)
+
+    @property
+    def division(self):
+        return np.array(self.division_levels, dtype=object)[self.division_codes]
+
+    @property
+    def category(self):
+        return np.array(self.category_levels, dtype=object)[self.category_codes]
+
+    @property
+    def table(self):
+        return pd.DataFrame({'gene': self.gene, 'category': self.division, 'family': self.category})
+
+    def codes(self, genes, id_type=None):
+        """
+        Vectorized lookup of gene identifiers, returning -1 where a gene is not in the
+        matrisome. Matches as MatrisomeReference.codes does.
+        """
+        inverse, uniques = pd.factorize(np.asarray(genes, dtype=object))
+        if len(uniques) == 0:
+            return np.full(len(inverse), -1)
+        codes = _search(self.genes, uniques)
+        miss = np.flatnonzero(codes < 0)
+        if id_type is not None and len(miss):
+            codes[miss] = self.id_codes(normalize_ids(uniques[miss], id_type), id_type)
+        return np.where(inverse >= 0, codes[inverse], -1)
+
+    def id_codes(self, keys, id_type):
+        """
+        Gene codes of identifiers already normalized with normalize_ids, -1 where not found.
+        """
+        index, positions = self.id_index[id_type]
+        if len(index) == 0:
+            return np.full(len(keys), -1)
+        found = _search(index, keys)
+        return np.where(found >= 0, positions[found], -1)
+
+    def lookup(self, gene):
+        """
+        Return the list of (division, category) annotations of a single gene identifier.
+        """
+        code = self.codes([gene])[0]
+        if code < 0:
+            return []
+        rows = range(self.starts[code], self.starts[code] + self.counts[code])
+        return [(self.division_levels[self.division_codes[i]], self.category_levels[self.category_codes[i]])
+                for i in rows]
+
+
+def _search(keys, values):
+    # Position of every value in a sorted unicode key array, -1 where it is absent
+    values = np.asarray(values, dtype=object)
+    found = np.full(len(values), -1)
+    if len(keys) == 0:
+        return found
+
+    text = np.flatnonzero([isinstance(v, str) for v in values])
+    strings = values[text].astype(str)
+    # Longer strings cannot be stored keys, and would be truncated by the cast
+    fits = np.char.str_len(strings) <= keys.dtype.itemsize // 4
+    text, strings = text[fits], strings[fits].astype(keys.dtype)
+
+    positions = np.minimum(np.searchsorted(keys, strings), len(keys) - 1)
+    hit = keys[positions] == strings
+    found[text[hit]] = positions[hit]
+    return found
+
+
+def _store_arrays(ref):
+    """
+    Arrays of the reference store of one MatrisomeReference, with the genes sorted.
+    """
+    order = np.argsort(ref.genes.astype(str), kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    counts = ref.counts[order]
+    starts = np.cumsum(counts) - counts
+    # Reference row of every row of the store, the rows of a gene staying in order
+    rows = np.repeat(ref.starts[order] - starts, counts) + np.arange(counts.sum())
+
+    arrays = {
+        'genes': ref.genes[order].astype(str),
+        'counts': counts,
+        'starts': starts,
+        'division_codes': ref.division_codes[rows],
+        'category_codes': ref.category_codes[rows]
+    }
+    for id_type, (keys, positions) in ref.id_index.items():
+        keys = np.asarray(keys, dtype=str)
+        by_key = np.argsort(keys, kind='stable')
+        arrays[f'{id_type}_keys'] = keys[by_key]
+        arrays[f'{id_type}_positions'] = rank[positions[by_key]]
+    return arrays
+
+
+def store_path(rda_path=RDA_PATH, cache_dir=None):
+    cache_dir = cache_dir or default_cache_dir(rda_path)
+    return os.path.join(cache_dir, f'store.{reference_version(rda_path, cache_dir)}')
+
+
+def build_reference_store(rda_path=RDA_PATH, cache_dir=None):
+    """
+    Write the memory-mapped reference store of the current reference version, unless
+    it exists already. Build it once, e.g. before starting a pool of workers, and the
+    workers map it instead of loading the references themselves.
+
+    Parameters:
+    - rda_path: Path of matrisome.list.rda
+    - cache_dir: Directory of the cache, defaults to default_cache_dir(rda_path)
+
+    Returns:
+    - path: Directory of the store
+    """
+    cache_dir = cache_dir or default_cache_dir(rda_path)
+    path = store_path(rda_path, cache_dir)
+    if os.path.exists(os.path.join(path, STORE_META)):
+        return path
+
+    version = os.path.basename(path).split('.', 1)[1]
+    # Written next to the store and renamed into place, so concurrent builders do not clash
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    meta = {'format': STORE_FORMAT, 'version': version, 'species': {}}
+    with stage('reference.store', version=version):
+        for species in SPECIES:
+            ref = MatrisomeReference(species, version, load_species(species, rda_path, cache_dir))
+            for name, a in _store_arrays(ref).items():
+                np.save(os.path.join(tmp, f'{species}.{name}.npy'), a, allow_pickle=False)
+            meta['species'][species] = {'rows': len(ref), 'division_levels': ref.division_levels,
+                                        'category_levels': ref.category_levels}
+        with open(os.path.join(tmp, STORE_META), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Another process finished the same store first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    # Stores of older versions can go; processes still mapping them keep their files open
+    for fname in os.listdir(cache_dir):
+        if fname.startswith('store.') and not fname.endswith('.tmp') and fname != os.path.basename(path):
+            shutil.rmtree(os.path.join(cache_dir, fname), ignore_errors=True)
+
+    return path
+
+
+def map_reference(species, rda_path=RDA_PATH, cache_dir=None):
+    """
+    Map the reference of a species from the reference store, building the store first
+    if needed.
+
+    Returns:
+    - ref: MappedReference
+    """
+    error = argument_error(species=species)
+    if error is not None:
+        raise ValueError(error)
+    return MappedReference(species, build_reference_store(rda_path, cache_dir))
+
+
+def get_reference(species, rda_path=RDA_PATH, cache_dir=None):
+    """
+    Return the MatrisomeReference of a species for the current reference version.
+
+    References are kept in a process-wide registry keyed by species and version,
+    so the cache is read and normalized only once per worker. With the reference
+    store enabled (set_reference_store or MATRISOME_STORE=1) the reference is a
+    MappedReference shared by all processes.
+    """
+    key = (species, reference_version(rda_path, cache_dir))
+
+    with _registry_lock:
+        ref = _registry.get(key)
+        if ref is not None:
+            _registry.move_to_end(key)
+            return ref
+
+    with stage('reference.load', species=species, mapped=_use_store) as st:
+        if _use_store:
+            ref = map_reference(species, rda_path, cache_dir)
+        else:
+            ref = MatrisomeReference(species, key[1], load_species(species, rda_path, cache_dir))
+        st.rows_out = len(ref)
+
+    with _registry_lock:
+        _registry[key] = ref
+        _registry.move_to_end(key)
+        while len(_registry) > REGISTRY_SIZE:
+            _registry.popitem(last=False)
+
+    return ref
+
+
+def set_registry_size(size):
+    """
+    Change how many references the registry keeps, evicting the least recently used ones.
+    """
+    global REGISTRY_SIZE
+    with _registry_lock:
+        REGISTRY_SIZE = size
+        while len(_registry) > REGISTRY_SIZE:
+            _registry.popitem(last=False)
+
+
+def set_reference_store(enabled=True):
+    """
+    Switch get_reference between the memory-mapped reference store and references
+    built in every process. Worker processes inherit the MATRISOME_STORE environment
+    variable, which is set accordingly.
+    """
+    global _use_store
+    _use_store = bool(enabled)
+    os.environ['MATRISOME_STORE'] = '1' if _use_store else '0'
+    invalidate_reference()
+
+
+def invalidate_reference(species=None, version=None):
+    """
+    Drop references from the registry. With no arguments the registry is cleared.
+
+    Returns:
+    - removed: Number of references that were dropped
+    """
+    with _registry_lock:
+        keys = [key for key in _registry
+                if (species is None or key[0] == species) and (version is None or key[1] == version)]
+        for key in keys:
+            del _registry[key]
+    return len(keys)
+
+
+if __name__ == '__main__':
+    print(build_reference_cache())
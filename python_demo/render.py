@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from python_demo.gui import bar_counts, draw_bar, draw_flow, draw_ring, draw_star, flow_svg
+from python_demo.instrument import stage
+from python_demo.summary import get_summary
+
+# Plots drawn by the batch renderer and the formats they can be written in
+PLOTS = ['bar', 'flow', 'ring', 'star']
+FORMATS = ['png', 'svg', 'pdf']
+
+
+def _init_worker():
+    # Headless backend in every worker process
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _save(fig, path, dpi):
+    fig.savefig(path, dpi=dpi)
+    # Drop the artists now rather than when the figure is collected
+    fig.clear()
+    return path
+
+
+def render_summary(summary, output_dir, plots=PLOTS, fmt='png', dpi=100):
+    """
+    Render the plots of one MatrisomeSummary into a directory.
+
+    The figures are plain matplotlib Figure instances, not registered with pyplot,
+    so nothing is kept around between calls.
+
+    Parameters:
+    - summary: MatrisomeSummary
+    - output_dir: Directory the files are written to, created if needed
+    - plots: Plots to draw, any of PLOTS
+    - fmt: One of FORMATS
+    - dpi: Resolution of raster output
+
+    Returns:
+    - paths: Paths of the written files
+    """
+    from matplotlib.figure import Figure
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+
+    if 'bar' in plots:
+        with stage('render.bar', format=fmt):
+            d1 = bar_counts(summary)
+            for source, name in (("Annotated Matrisome Division", "matri_bar_division"),
+                                 ("Annotated Matrisome Category", "matri_bar_category")):
+                fig = draw_bar(Figure(figsize=(12, 8)), d1, source)
+                paths.append(_save(fig, os.path.join(output_dir, f'{name}.{fmt}'), dpi))
+
+    if 'flow' in plots:
+        with stage('render.flow', format=fmt):
+            path = os.path.join(output_dir, f'matri_flow.{fmt}')
+            if fmt == 'svg':
+                with open(path, 'w') as f:
+                    f.write(flow_svg(summary))
+                paths.append(path)
+            else:
+                paths.append(_save(draw_flow(Figure(figsize=(12, 8)), summary), path, dpi))
+
+    if 'ring' in plots:
+        with stage('render.ring', format=fmt):
+            fig = draw_ring(Figure(figsize=(12, 8)), summary)
+            paths.append(_save(fig, os.path.join(output_dir, f'matri_ring.{fmt}'), dpi))
+
+    if 'star' in plots:
+        with stage('render.star', format=fmt):
+            fig = draw_star(Figure(figsize=(10, 8)), summary)
+            paths.append(_save(fig, os.path.join(output_dir, f'matri_star.{fmt}'), dpi))
+
+    return paths
+
+
+def _render_task(task):
+    name, summary, output_dir, plots, fmt, dpi = task
+    return name, render_summary(summary, output_dir, plots, fmt, dpi)
+
+
+def render_batch(datasets=None, output_dir=None, plots=PLOTS, fmt='png', dpi=100, processes=None):
+    """
+    Render the matri* plots of many datasets across a process pool.
+
+    Every dataset gets its own subdirectory of output_dir, so datasets never overwrite
+    each other's files. Only the small summaries are sent to the workers.
+
+    Parameters:
+    - datasets: Dictionary (or iterable of pairs) of name -> annotated data frame,
+      matrianalyze table or MatrisomeSummary
+    - output_dir: Directory the per-dataset subdirectories are created in
+    - plots: Plots to draw, any of PLOTS
+    - fmt: One of FORMATS
+    - dpi: Resolution of raster output
+    - processes: Number of worker processes, by default one per CPU; 1 renders in this process
+
+    Returns:
+    - paths: Dictionary of name -> paths of the written files
+    """
+    if datasets is None:
+        print("no data provided, execution stops")
+        return
+
+    if output_dir is None:
+        print("no output directory provided, execution stops")
+        return
+
+    if fmt not in FORMATS:
+        print(f"fmt should be one of {', '.join(FORMATS)}, execution stops")
+        return
+
+    unknown = [p for p in plots if p not in PLOTS]
+    if unknown:
+        print(f"plots {', '.join(unknown)} are not recognized, execution stops")
+        return
+
+    items = datasets.items() if isinstance(datasets, dict) else datasets
+    tasks = []
+    for name, data in items:
+        summary = get_summary(data)
+        if summary is None:
+            print(f"dataset {name} is skipped")
+            continue
+        # Keep the name usable as a directory
+        folder = str(name).replace(os.sep, '_')
+        tasks.append((name, summary, os.path.join(output_dir, folder), list(plots), fmt, dpi))
+
+    # Figures are saved without pyplot, so rendering here does not need the backend switched
+    if processes == 1 or len(tasks) <= 1:
+        return dict(map(_render_task, tasks))
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+        chunksize = max(1, len(tasks) // (4 * (processes or os.cpu_count() or 1)))
+        return dict(pool.map(_render_task, tasks, chunksize=chunksize))
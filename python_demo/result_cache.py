@@ -0,0 +1,200 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from python_demo.instrument import stage
+
+# Bump when matriannotate or matrianalyze results change, so that older stored results are not used
+RESULT_VERSION = 1
+
+# The cache is off unless enabled with set_result_cache or MATRISOME_RESULT_CACHE=<directory>
+_memory = OrderedDict()
+_lock = threading.Lock()
+_settings = {'memory_size': 0, 'cache_dir': None, 'max_bytes': 0}
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'memory_evictions': 0,
+          'disk_evictions': 0}
+
+
+def set_result_cache(memory_size=16, cache_dir=None, max_bytes=1 << 30):
+    """
+    Enable the result cache of matriannotate and matrianalyze, or disable it with
+    memory_size=0 and no cache_dir.
+
+    A call whose table, arguments, species and reference version were seen before
+    returns a copy of the stored result instead of computing it again. Results are
+    kept in memory, least recently used ones evicted beyond memory_size, and, with
+    cache_dir, pickled on disk, least recently used files evicted beyond max_bytes.
+
+    Parameters:
+    - memory_size: Number of results kept in memory
+    - cache_dir: Directory of the disk tier, None for memory only
+    - max_bytes: Total size of the files the disk tier keeps
+    """
+    with _lock:
+        _settings.update(memory_size=max(int(memory_size), 0), cache_dir=cache_dir, max_bytes=int(max_bytes))
+        while len(_memory) > _settings['memory_size']:
+            _memory.popitem(last=False)
+            _stats['memory_evictions'] += 1
+
+
+def result_cache_enabled():
+    return _settings['memory_size'] > 0 or _settings['cache_dir'] is not None
+
+
+def result_cache_stats():
+    """
+    Counters of the result cache since the process started or clear_result_cache,
+    for monitoring: memory_hits, disk_hits, misses, stores, memory_evictions,
+    disk_evictions, plus the current number of results in memory.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats['memory_items'] = len(_memory)
+    stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits'])
+                              / max(stats['memory_hits'] + stats['disk_hits'] + stats['misses'], 1), 4)
+    return stats
+
+
+def clear_result_cache(disk=False):
+    """
+    Drop the results kept in memory, and with disk=True the files of the disk tier,
+    and reset the counters.
+    """
+    with _lock:
+        _memory.clear()
+        for name in _stats:
+            _stats[name] = 0
+        cache_dir = _settings['cache_dir']
+    if disk and cache_dir is not None and os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(cache_dir, name))
+
+
+def result_key(data, *parts):
+    """
+    Key of a call on a data frame: a BLAKE2b hash of the column names and dtypes, of
+    the row hashes of pandas' vectorized hash_pandas_object over the index and every
+    column, and of the other arguments in parts.
+
+    Every column is hashed, not only the gene and numeric ones, as annotated tables
+    carry all columns of the input.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((RESULT_VERSION, parts, data.shape, [str(c) for c in data.columns],
+                   [str(t) for t in data.dtypes])).encode())
+    h.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def labels_key(labels):
+    """
+    Hash of a sequence of labels, e.g. the groupby labels of matrianalyze.
+    """
+    return hashlib.blake2b(pd.util.hash_array(np.asarray(labels, dtype=object)).tobytes(),
+                           digest_size=16).hexdigest()
+
+
+def _path(key):
+    return os.path.join(_settings['cache_dir'], f'{key}.pkl')
+
+
+def cached_result(key):
+    """
+    Return a copy of the result stored under key, or None if there is none.
+    """
+    with stage('result_cache.lookup') as sc:
+        with _lock:
+            result = _memory.get(key)
+            if result is not None:
+                _memory.move_to_end(key)
+                _stats['memory_hits'] += 1
+        if result is not None:
+            sc.set(hit='memory')
+            return result.copy()
+
+        if _settings['cache_dir'] is not None:
+            try:
+                with open(_path(key), 'rb') as f:
+                    result = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                result = None
+            try:
+                # Mark the file as recently used for eviction
+                os.utime(_path(key))
+            except OSError:
+                pass
+        if result is None:
+            with _lock:
+                _stats['misses'] += 1
+            sc.set(hit=None)
+            return
+
+        with _lock:
+            _stats['disk_hits'] += 1
+        _remember(key, result)
+        sc.set(hit='disk')
+        return result.copy()
+
+
+def store_result(key, result):
+    """
+    Store a copy of a result under key, in memory and on disk.
+    """
+    result = result.copy()
+    with _lock:
+        _stats['stores'] += 1
+    _remember(key, result)
+
+    cache_dir = _settings['cache_dir']
+    if cache_dir is None:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f'{_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, _path(key))
+    _evict_files(cache_dir)
+
+
+def _remember(key, result):
+    with _lock:
+        if _settings['memory_size'] == 0:
+            return
+        _memory[key] = result
+        _memory.move_to_end(key)
+        while len(_memory) > _settings['memory_size']:
+            _memory.popitem(last=False)
+            _stats['memory_evictions'] += 1
+
+
+def _evict_files(cache_dir):
+    # Least recently used files first, until the tier fits in max_bytes
+    files = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.pkl'):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime_ns, st.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= _settings['max_bytes']:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        with _lock:
+            _stats['disk_evictions'] += 1
+
+
+if os.environ.get('MATRISOME_RESULT_CACHE'):
+    set_result_cache(cache_dir=os.environ['MATRISOME_RESULT_CACHE'])
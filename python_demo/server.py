@@ -0,0 +1,187 @@
+import json
+import os
+import socketserver
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from python_demo.common import argument_error, check_arguments
+from python_demo.reference import SPECIES, detect_id_type, gene_keys, get_reference
+from python_demo.util import annotate_codes, annotation_codes
+
+
+def annotate_genes(genes, species, id_type='auto'):
+    """
+    Annotate a list of gene IDs against the resident reference, without building a data frame.
+
+    Parameters:
+    - genes: List of gene IDs
+    - species: One of 'human', 'mouse', 'c.elegans', 'zebrafish', 'drosophila'
+    - id_type: Identifier type of the genes, see matriannotate
+
+    Returns:
+    - result: Dictionary with one entry per output row (index into genes, gene, division,
+      category; genes with several annotations get several rows) and the division and
+      category counts
+    """
+    ref = get_reference(species)
+    keys = gene_keys(genes)
+    if id_type == 'auto':
+        id_type = detect_id_type(keys)
+    rows, ref_rows = annotate_codes(ref, keys, id_type)
+    index = np.arange(len(keys)) if rows is None else rows
+
+    division, category = annotation_codes(ref, ref_rows)
+    division_labels = np.array(ref.division_levels, dtype=object)
+    category_labels = np.array(ref.category_levels, dtype=object)
+
+    division_counts = np.bincount(division, minlength=len(division_labels))
+    category_counts = np.bincount(category, minlength=len(category_labels))
+
+    return {
+        'species': species,
+        'id_type': id_type,
+        'version': ref.version,
+        'index': index.tolist(),
+        'gene': [genes[i] for i in index],
+        'division': division_labels[division].tolist(),
+        'category': category_labels[category].tolist(),
+        'division_counts': {label: int(n) for label, n in zip(division_labels, division_counts) if n},
+        'category_counts': {label: int(n) for label, n in zip(category_labels, category_counts) if n}
+    }
+
+
+class AnnotationHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the annotation service.
+
+    GET  /health    loaded species and reference versions
+    POST /annotate  {"genes": [...], "species": "human", "id_type": "auto"} -> annotate_genes result
+
+    Genes are strings, integers (NCBI Gene IDs) or null. Only the species loaded by
+    make_server are served, so that no request waits for a reference to load.
+    Invalid requests get a 400 and failures a 500 reply, both with a JSON error.
+    """
+
+    server_version = "matrisome/1"
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self._reply(404, {'error': f"unknown path {self.path}"})
+        self._reply(200, {'status': 'ok',
+                          'versions': {s: get_reference(s).version for s in self.server.species}})
+
+    def do_POST(self):
+        if self.path != '/annotate':
+            return self._reply(404, {'error': f"unknown path {self.path}"})
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._reply(400, {'error': "request body should be JSON"})
+        if not isinstance(request, dict):
+            return self._reply(400, {'error': "request body should be a JSON object"})
+
+        genes = request.get('genes')
+        species = request.get('species', self.server.species[0])
+        id_type = request.get('id_type', 'auto')
+
+        if not isinstance(genes, list):
+            return self._reply(400, {'error': "genes should be a list of gene IDs"})
+        if not all(g is None or isinstance(g, str) or (isinstance(g, int) and not isinstance(g, bool)) for g in genes):
+            return self._reply(400, {'error': "gene IDs should be strings, integers or null"})
+        if not isinstance(species, str) or not isinstance(id_type, (str, type(None))):
+            return self._reply(400, {'error': "species and id_type should be strings"})
+        error = argument_error(species=species, id_type=id_type)
+        if error is not None:
+            return self._reply(400, {'error': error})
+        if species not in self.server.species:
+            return self._reply(400, {'error': f"Species {species} is not loaded on this server"})
+
+        start = time.perf_counter()
+        try:
+            result = annotate_genes(genes, species, id_type)
+        except Exception as e:
+            self.log_error("annotation failed: %r", e)
+            return self._reply(500, {'error': f"annotation failed: {type(e).__name__}"})
+        result['milliseconds'] = round((time.perf_counter() - start) * 1000, 3)
+        self._reply(200, result)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no host address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def make_server(species=SPECIES, host='127.0.0.1', port=8765, socket_path=None, quiet=False):
+    """
+    Build the annotation server with the references of the given species loaded.
+
+    Parameters:
+    - species: Species whose references are loaded up front and kept resident
+    - host, port: Address of the HTTP server
+    - socket_path: Path of a Unix socket to listen on instead of host and port
+    - quiet: If True requests are not logged
+
+    Returns:
+    - server: socketserver instance, run it with serve_forever()
+    """
+    species = list(species)
+    if not check_arguments(species=species):
+        return
+
+    # Load the references and their indexes once, they stay in the registry while the server runs
+    for s in species:
+        get_reference(s)
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, AnnotationHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), AnnotationHandler)
+
+    server.species = species
+    server.quiet = quiet
+    return server
+
+
+def serve(species=SPECIES, host='127.0.0.1', port=8765, socket_path=None, quiet=False):
+    """
+    Run the annotation server until interrupted. See make_server.
+    """
+    server = make_server(species, host, port, socket_path, quiet)
+    if server is None:
+        return
+
+    where = socket_path if socket_path is not None else f"http://{host}:{server.server_address[1]}"
+    print(f"serving {', '.join(server.species)} on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from python_demo.common import check_arguments
+from python_demo.reference import detect_id_type, gene_keys, get_reference
+from python_demo.util import annotate_codes, annotation_codes
+
+
+def matrisome_indicator(genes=None, species=None, id_type='auto'):
+    """
+    Build a sparse indicator matrix from genes to matrisome annotations.
+
+    Parameters:
+    - genes: Gene IDs, one per gene of the expression matrix
+    - species: One of 'human', 'mouse', 'c.elegans', 'zebrafish', 'drosophila'
+    - id_type: Identifier type of the genes, see matriannotate
+
+    Returns:
+    - indicator: CSR matrix of shape (annotations, genes) with a 1 where a gene has the annotation
+    - labels: Annotation of every row, the divisions followed by the categories
+    """
+    ref = get_reference(species)
+    keys = gene_keys(genes)
+    if id_type == 'auto':
+        id_type = detect_id_type(keys)
+    rows, ref_rows = annotate_codes(ref, keys, id_type)
+    gene_index = np.arange(len(keys)) if rows is None else rows
+
+    nd = len(ref.division_levels)
+    division, category = annotation_codes(ref, ref_rows)
+
+    # Every gene counts once towards its division and once towards its category
+    row = np.concatenate([division, nd + category])
+    col = np.concatenate([gene_index, gene_index])
+    indicator = sp.csr_matrix((np.ones(len(row)), (row, col)), shape=(nd + len(ref.category_levels), len(keys)))
+
+    # Keep the annotations that at least one gene has, as matrianalyze does
+    observed = np.flatnonzero(np.bincount(row, minlength=indicator.shape[0]))
+    labels = np.array(ref.division_levels + ref.category_levels, dtype=object)[observed]
+    return indicator[observed], labels
+
+
+def matrianalyze_sparse(matrix=None, genes=None, species=None, gene_axis=0, samples=None, id_type='auto',
+                        groups=None):
+    """
+    Division and category totals of a sparse gene-by-cell (or gene-by-sample) matrix,
+    computed with one sparse matrix product and without building a dense gene table.
+
+    Parameters:
+    - matrix: scipy.sparse matrix (CSR or CSC) of counts
+    - genes: Gene IDs along the gene axis of the matrix
+    - species: One of 'human', 'mouse', 'c.elegans', 'zebrafish', 'drosophila'
+    - gene_axis: 0 if genes are rows (genes x cells), 1 if genes are columns (cells x genes)
+    - samples: Optional labels of the cells/samples, used as column names
+    - id_type: Identifier type of the genes, see matriannotate
+    - groups: Optional label per cell/sample (e.g. a cluster); cells of a group are
+      summed in the same product and the result has one column per group
+
+    Returns:
+    - z: Data frame in the matrianalyze layout, one column per cell/sample or group
+    """
+    if matrix is None:
+        print("no data provided, execution stops")
+        return
+
+    if genes is None:
+        print("gene IDs along the gene axis must be provided, execution stops")
+        return
+
+    if not check_arguments(species=species, id_type=id_type):
+        return
+
+    if gene_axis not in (0, 1):
+        print("gene_axis should be 0 or 1, execution stops")
+        return
+
+    if len(genes) != matrix.shape[gene_axis]:
+        print("the number of gene IDs does not match the gene axis of the matrix, execution stops")
+        return
+
+    n_cells = matrix.shape[1 - gene_axis]
+    if groups is not None and len(groups) != n_cells:
+        print("groups should have one label per cell/sample, execution stops")
+        return
+
+    indicator, labels = matrisome_indicator(genes, species, id_type)
+
+    if gene_axis == 0:
+        totals = indicator @ matrix
+    else:
+        totals = (matrix @ indicator.T).T
+
+    if groups is not None:
+        # Cell-to-group indicator, so that the groups come out of one more sparse product
+        codes, samples = pd.factorize(pd.Series(groups), sort=True)
+        keep = np.flatnonzero(codes >= 0)
+        members = sp.csr_matrix((np.ones(len(keep)), (keep, codes[keep])), shape=(n_cells, len(samples)))
+        totals = totals @ members
+    totals = totals.toarray() if sp.issparse(totals) else np.asarray(totals)
+
+    z = pd.DataFrame(totals, index=pd.Index(labels, name="Matrisome Annotation"), columns=samples)
+    z.attrs['workflow'] = "matrisomeanalyzeR"
+
+    return z
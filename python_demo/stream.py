@@ -0,0 +1,197 @@
+import os
+
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+from python_demo.common import check_arguments
+from python_demo.reference import detect_id_type, get_reference
+from python_demo.summary import CATEGORY, DIVISION, MatrisomeSummary
+from python_demo.util import PairSums, annotate_frame, numeric_columns, pair_sums, pair_totals
+
+
+def default_sep(path):
+    """
+    Field separator implied by a file name: a tab for .tsv/.txt files and a comma otherwise.
+    """
+    return '\t' if os.fspath(path).lower().endswith(('.tsv', '.txt')) else ','
+
+
+def read_chunks(source, chunksize=100000, sep=None, **read_kw):
+    """
+    Iterate over a gene table in chunks.
+
+    Parameters:
+    - source: Path of a CSV/TSV file, or an iterable of data frames
+    - chunksize: Number of rows per chunk when reading a file
+    - sep: Field separator, by default a tab for .tsv/.txt files and a comma otherwise
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if sep is None:
+            sep = default_sep(source)
+        with pd.read_csv(source, sep=sep, chunksize=chunksize, **read_kw) as reader:
+            yield from reader
+    else:
+        yield from source
+
+
+def matriannotate_stream(source=None, gene_column=None, species=None, chunksize=100000, sep=None,
+                         id_type='auto', accumulator=None, mode='expand'):
+    """
+    Annotate a gene table chunk by chunk, so that only one chunk is held in memory.
+
+    The chunks are annotated like matriannotate does and yielded one at a time;
+    the identifier type is detected on the first chunk and used for all of them.
+
+    Parameters:
+    - source: Path of a CSV/TSV file, or an iterable of data frames
+    - gene_column: Name of the column with gene IDs
+    - species: One of 'human', 'mouse', 'c.elegans', 'zebrafish', 'drosophila'
+    - chunksize: Number of rows per chunk when reading a file
+    - sep: Field separator of the file
+    - id_type: Identifier type of the gene column, see matriannotate
+    - accumulator: Optional MatrianalyzeAccumulator fed with every annotated chunk
+    - mode: 'expand' or 'append', see matriannotate
+
+    Returns:
+    - chunks: Generator of annotated data frames, None if an argument is invalid
+    """
+    if source is None:
+        print("no data provided, execution stops")
+        return
+
+    if gene_column is None:
+        print("a column indicating gene IDs must be provided, execution stops")
+        return
+
+    if not check_arguments(species=species, id_type=id_type, mode=mode):
+        return
+
+    # The arguments are checked at the call, the chunks are only read once iterated
+    return _annotate_chunks(source, gene_column, species, chunksize, sep, id_type, accumulator, mode)
+
+
+def _annotate_chunks(source, gene_column, species, chunksize, sep, id_type, accumulator, mode):
+    ref = get_reference(species)
+    start = 0
+    # Chunks read from a file belong to nobody else and need no copy
+    copy = False if isinstance(source, (str, os.PathLike)) else None
+
+    for data in read_chunks(source, chunksize, sep):
+        if id_type == 'auto':
+            id_type = detect_id_type(data[gene_column])
+
+        df2 = annotate_frame(ref, data, gene_column, id_type, mode, copy)
+        if mode == 'expand':
+            df2.index = pd.RangeIndex(start, start + len(df2))
+            start += len(df2)
+
+        if accumulator is not None:
+            accumulator.update(df2)
+        yield df2
+
+
+def write_annotated_stream(source=None, output=None, gene_column=None, species=None, chunksize=100000,
+                           sep=None, id_type='auto', analyze=False, mode='expand'):
+    """
+    Annotate a gene table chunk by chunk and append every chunk to an output file.
+
+    Parameters:
+    - source: Path of a CSV/TSV file, or an iterable of data frames
+    - output: Path of the annotated file, tab-separated for .tsv/.txt and comma-separated otherwise
+    - analyze: If True the matrianalyze totals of the whole table are computed along the way
+    - mode: 'expand' or 'append', see matriannotate
+
+    Returns:
+    - z: Division/category totals as returned by matrianalyze if analyze is True, otherwise None
+    """
+    if output is None:
+        print("no output path provided, execution stops")
+        return
+
+    accumulator = MatrianalyzeAccumulator() if analyze else None
+    out_sep = default_sep(output)
+
+    # No output file is created for invalid arguments
+    chunks = matriannotate_stream(source, gene_column, species, chunksize, sep, id_type, accumulator, mode)
+    if chunks is None:
+        return
+
+    with open(output, 'w', newline='') as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, sep=out_sep, header=(i == 0), index=False)
+
+    return accumulator.result() if analyze else None
+
+
+class MatrianalyzeAccumulator:
+    """
+    Running matrianalyze over annotated chunks: division and category totals of
+    every numeric column, summed over all rows seen so far.
+
+    A column is left out of the result as soon as one chunk has a value in it that
+    cannot be read as a number, like matrianalyze drops columns with missing values.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.excluded = set()
+        self.integer = set()
+        self.pairs = None
+        self.counts = None
+        self.division_levels = []
+        self.category_levels = []
+
+    def update(self, data):
+        tr = numeric_columns(data, exclude=[data.attrs['gene_column']] if 'gene_column' in data.attrs else [])
+
+        if self.columns is None:
+            self.columns = list(tr.columns)
+            self.integer = {col for col in self.columns if is_integer_dtype(tr[col].dtype)}
+        self.excluded.update(col for col in self.columns if col not in tr.columns)
+        self.integer &= {col for col in tr.columns if is_integer_dtype(tr[col].dtype)}
+        tr = tr[[col for col in self.columns if col not in self.excluded]]
+
+        pairs = pair_sums(data, tr)
+        for levels, found in ((self.division_levels, pairs.index.levels[0]),
+                              (self.category_levels, pairs.index.levels[1])):
+            levels.extend(v for v in found if v not in levels)
+
+        pairs.index = pairs.index.to_flat_index()
+        self.pairs = pairs if self.pairs is None else self.pairs.add(pairs, fill_value=0)
+
+        # Gene counts per division and category, for the summary matrianalyze attaches
+        counts = MatrisomeSummary.from_annotated(data).counts.stack()
+        counts.index = counts.index.to_flat_index()
+        self.counts = counts if self.counts is None else self.counts.add(counts, fill_value=0)
+
+    def result(self):
+        if self.columns is None:
+            print("no data was accumulated, execution stops")
+            return
+
+        columns = [col for col in self.columns if col not in self.excluded]
+        pairs = self.pairs[columns].astype({col: 'int64' for col in columns if col in self.integer})
+        pairs.index = pd.MultiIndex.from_arrays([
+            pd.Categorical([key[0] for key in pairs.index], categories=self.division_levels),
+            pd.Categorical([key[1] for key in pairs.index], categories=self.category_levels)
+        ])
+
+        z = pair_totals(pairs)
+
+        z.index.name = "Matrisome Annotation"
+        z.attrs['workflow'] = "matrisomeanalyzeR"
+        z.attrs['matrisome_pairs'] = PairSums(pairs)
+
+        counts = self.counts[self.counts > 0].astype('int64')
+        matrix = pd.Series(counts.to_numpy(), index=pd.MultiIndex.from_tuples(counts.index)).unstack(fill_value=0)
+        matrix = matrix.reindex(index=_in_order(self.division_levels, matrix.index),
+                                columns=_in_order(self.category_levels, matrix.columns))
+        matrix.index.name, matrix.columns.name = DIVISION, CATEGORY
+        z.attrs['matrisome_summary'] = MatrisomeSummary(matrix)
+
+        return z
+
+
+def _in_order(levels, values):
+    # Values in the order of levels, those not in levels after them
+    return [v for v in levels if v in values] + [v for v in values if v not in levels]
@@ -0,0 +1,133 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from python_demo.common import MATRISOME_COLORS, label_codes
+
+DIVISION = 'Annotated Matrisome Division'
+CATEGORY = 'Annotated Matrisome Category'
+
+
+class MatrisomeSummary:
+    """
+    Division x category gene counts of an annotated table, with the flows,
+    totals, percentages and colors that matri_bar, matri_flow, matri_ring
+    and matri_star draw from.
+
+    Build it with summarize(data), which caches it on the annotated frame.
+    """
+
+    def __init__(self, counts, fingerprint=None):
+        self.counts = counts
+        self.fingerprint = fingerprint
+
+        # Division -> category flows, in level order
+        flows = counts.stack()
+        flows = flows[flows > 0].rename('Freq').reset_index()
+        flows.columns = [DIVISION, CATEGORY, 'Freq']
+        flows['color'] = [MATRISOME_COLORS.get(v, "#D9D9D9") for v in flows[CATEGORY]]
+        self.flows = flows
+
+        self.division_counts = counts.sum(axis=1)
+        self.category_counts = counts.sum(axis=0)
+        self.total = int(self.category_counts.sum())
+
+        # One row per category, as used by the ring and star plots
+        categories = self.category_counts.rename('Freq').reset_index()
+        categories.columns = [CATEGORY, 'Freq']
+        categories['color'] = [MATRISOME_COLORS.get(v, "#D9D9D9") for v in categories[CATEGORY]]
+        categories['Percent'] = (categories['Freq'] / max(self.total, 1) * 100).round(1)
+        self.categories = categories
+
+        self.labels = list(self.division_counts.index) + list(self.category_counts.index)
+
+    def __repr__(self):
+        return (f"MatrisomeSummary(genes={self.total}, divisions={len(self.division_counts)}, "
+                f"categories={len(self.category_counts)})")
+
+    def __deepcopy__(self, memo):
+        # Immutable once built; pandas deep-copies attrs on many operations
+        return self
+
+    @classmethod
+    def from_annotated(cls, data, fingerprint=None):
+        div_codes, div_labels = label_codes(data[DIVISION])
+        cat_codes, cat_labels = label_codes(data[CATEGORY])
+        return cls.from_codes(div_codes, div_labels, cat_codes, cat_labels, fingerprint)
+
+    @classmethod
+    def from_codes(cls, div_codes, div_labels, cat_codes, cat_labels, fingerprint=None):
+        """
+        Build the summary from division and category codes of every row, -1 for missing.
+        """
+        valid = (div_codes >= 0) & (cat_codes >= 0)
+        joint = div_codes[valid].astype(np.int64) * len(cat_labels) + cat_codes[valid]
+        counts = np.bincount(joint, minlength=len(div_labels) * len(cat_labels))
+        counts = counts.reshape(len(div_labels), len(cat_labels))
+
+        # Keep the levels that occur
+        rows = np.flatnonzero(counts.sum(axis=1))
+        cols = np.flatnonzero(counts.sum(axis=0))
+        counts = pd.DataFrame(counts[np.ix_(rows, cols)],
+                              index=pd.Index(np.asarray(div_labels, dtype=object)[rows], name=DIVISION),
+                              columns=pd.Index(np.asarray(cat_labels, dtype=object)[cols], name=CATEGORY))
+        return cls(counts, fingerprint)
+
+
+def annotation_key(data):
+    """
+    Cheap fingerprint of the division and category columns, used to tell whether
+    a cached summary still describes the frame.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(len(data)).encode())
+    for n in (DIVISION, CATEGORY):
+        col = data[n]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            h.update('\x00'.join(map(str, col.cat.categories)).encode())
+            h.update(col.cat.codes.to_numpy().tobytes())
+        else:
+            h.update(pd.util.hash_array(col.to_numpy(dtype=object)).tobytes())
+    return h.hexdigest()
+
+
+def summarize(data):
+    """
+    Return the MatrisomeSummary of an annotated frame.
+
+    The summary is cached in data.attrs['matrisome_summary'] and rebuilt when the
+    annotation columns have changed since it was computed.
+    """
+    key = annotation_key(data)
+    summary = data.attrs.get('matrisome_summary')
+    if not isinstance(summary, MatrisomeSummary) or summary.fingerprint != key:
+        summary = MatrisomeSummary.from_annotated(data, key)
+        data.attrs['matrisome_summary'] = summary
+    return summary
+
+
+def get_summary(data):
+    """
+    Accept a MatrisomeSummary, an annotated frame or a matrianalyze table, and
+    return the MatrisomeSummary to plot. Prints a message and returns None otherwise.
+    """
+    if isinstance(data, MatrisomeSummary):
+        return data
+
+    if data is None:
+        print("no data provided, execution stops")
+        return
+
+    if not isinstance(data, pd.DataFrame):
+        print("data should be in data.frame format, execution stops")
+        return
+
+    workflow = data.attrs.get('workflow')
+    if workflow == "matrisomeannotatoR":
+        return summarize(data)
+    if workflow == "matrisomeanalyzeR" and isinstance(data.attrs.get('matrisome_summary'), MatrisomeSummary):
+        return data.attrs['matrisome_summary']
+
+    print("graphs can only be drawn for annotated files, execution stops")
+    return
@@ -1,32 +1,43 @@
+import numpy as np
 import pandas as pd
-import rpy2.robjects as robjects
-from rpy2.robjects import pandas2ri
-
-from python_demo.common import data_check2, data_check1
-
-
-def get_matrisome_data():
-    # Enable conversion between pandas and R data frames
-    pandas2ri.activate()
-    # Load the R `load` function
-    robjects.r['load']('../data/matrisome.list.rda')
-    # Read the R object, assuming matrisome_list is the object name in R
-    matrisome_list = robjects.globalenv['matrisome.list']
-
-    human_matrisome = pandas2ri.rpy2py(matrisome_list.rx2('human'))
-    mouse_matrisome = pandas2ri.rpy2py(matrisome_list.rx2('mouse'))
-    c_elegans_matrisome = pandas2ri.rpy2py(matrisome_list.rx2('c.elegans'))
-    zebrafish_matrisome = pandas2ri.rpy2py(matrisome_list.rx2('zebrafish'))
-    drosophila_matrisome = pandas2ri.rpy2py(matrisome_list.rx2('drosophila'))
-
-    return {'human': human_matrisome,
-            'mouse': mouse_matrisome,
-            'c.elegans': c_elegans_matrisome,
-            'zebrafish': zebrafish_matrisome,
-            'drosophila': drosophila_matrisome}
-
-
-def matriannotate(data=None, gene_column=None, species=None):
+from pandas.api.types import is_bool_dtype, is_integer_dtype, is_numeric_dtype
+
+from python_demo.common import check_arguments, data_check2, data_check1, label_codes
+from python_demo.instrument import stage
+from python_demo.reference import GeneFingerprints, detect_id_type, gene_keys, get_reference
+from python_demo.result_cache import cached_result, labels_key, result_cache_enabled, result_key, store_result
+from python_demo.summary import summarize
+
+# Names util provided before they moved, kept importable from here for existing code
+from python_demo.common import ANNOTATE_MODES, DUPLICATE_POLICIES
+from python_demo.reference import get_matrisome_data
+
+__all__ = ['matriannotate', 'annotate_frame', 'copy_frame', 'annotate_codes', 'expand_codes', 'annotation_codes',
+           'matrianalyze', 'PairSums', 'pair_sums', 'pair_totals', 'ANNOTATION_COLUMNS', 'numeric_columns',
+           'ANNOTATE_MODES', 'DUPLICATE_POLICIES', 'get_matrisome_data']
+
+
+def matriannotate(data=None, gene_column=None, species=None, id_type='auto', mode='expand', copy=None):
+    """
+    Annotate a gene table with the matrisome division and category of every gene.
+
+    Parameters:
+    - data: A data frame
+    - gene_column: Name of the column with gene IDs
+    - species: One of SPECIES
+    - id_type: Identifier type of the gene column, one of ID_TYPES, 'auto' to detect it
+      or None to match the values as they are
+    - mode: 'expand' returns a new table with the annotation columns first and a row per
+      annotation; 'append' adds the annotation columns to the user's table, one row per
+      input row with the first annotation of every gene
+    - copy: With mode='append', whether the result copies the user's columns. By default
+      they are copied unless pandas copy-on-write is enabled, in which case they are
+      shared until either frame is changed. copy=False always shares them, so values
+      changed in place show in both frames
+
+    Returns:
+    - df2: Annotated data frame
+    """
     data_check1(data)
 
     if gene_column is None:
@@ -37,102 +48,426 @@ def matriannotate(data=None, gene_column=None, species=None):
         print("no species provided, execution stops")
         return
 
-    df = data.copy()
-    n = gene_column
-    matrisome_list = get_matrisome_data()
-
-    # Select the corresponding matrisome data based on species
-    if species == "human":
-        k = matrisome_list['human']
-    elif species == "mouse":
-        k = matrisome_list['mouse']
-    elif species == "c.elegans":
-        k = matrisome_list['c.elegans']
-        k['family'] = k['family'].apply(lambda x: "ECM-affiliated Proteins" if x == "ECM-affiliated" else x)
-    elif species == "zebrafish":
-        k = matrisome_list['zebrafish']
-        k['category'] = k['category'].apply(lambda x: "Non-matrisome" if x == "not.available" else x)
-        k['family'] = k['family'].apply(lambda x: "Non-matrisome" if x in ["", "not.available"] else x)
-    elif species == "drosophila":
-        k = matrisome_list['drosophila']
-        k['category'] = k['category'].apply(
-            lambda x: "Matrisome-associated" if x == "Homologs/Orthologs to Mammalian Matrisome-Associated Genes" else (
-                "Core matrisome" if x == "Homologs/Orthologs to Mammalian Core Matrisome Genes" else "Drosophila matrisome"))
-        k['family'] = k['family'].apply(lambda x: "ECM-affiliated Proteins" if x == "ECM-affiliated" else x)
-    else:
-        print(f"Species {species} is not recognized, execution stops")
+    if not check_arguments(species=species, id_type=id_type, mode=mode):
         return
 
-    # Merge data frames
-    left_key = 'gene'
-    df2 = pd.merge(k, df, left_on=left_key, right_on=n, how='right').drop_duplicates()
-    df2 = df2.drop(columns=left_key)  # Drop the key column from the left data frame
-    # Reorder the key column 'gene' to be the first column
-    columns = [n] + [col for col in df2.columns if col != n]
-    df2 = df2[columns]
-
-    # Handle column names
-    # Rename only the first 3 columns
-    new_column_names = ['Annotated Gene', 'Annotated Matrisome Division', 'Annotated Matrisome Category']
-    if len(df2.columns) > 3:
-        new_column_names.extend(df2.columns[3:])
-
-    # Update column names
-    df2.columns = new_column_names
-
-    # Fill missing values
-    df2['Annotated Gene'] = df2['Annotated Gene'].replace("", "gene name missing in original data")
-    df2.update(df2[['Annotated Matrisome Division']].fillna("Non-matrisome"))
-    df2.update(df2[['Annotated Matrisome Category']].fillna("Non-matrisome"))
-    df2.fillna("", inplace=True)
+    n = gene_column
+    # Normalized reference, shared by all calls for this species and version
+    ref = get_reference(species)
+
+    # Identical calls are answered from the result cache when it is enabled
+    key = None
+    if result_cache_enabled():
+        key = result_key(data, 'annotate', n, species, ref.version, id_type, mode)
+        df2 = cached_result(key)
+        if df2 is not None:
+            return _with_annotation(data, df2, copy) if mode == 'append' else df2
+
+    with stage('annotate', rows_in=len(data), species=species, mode=mode) as st:
+        # Gene Symbols, NCBI Gene IDs or Ensembl Gene IDs, detected from a sample of the column
+        if id_type == 'auto':
+            id_type = detect_id_type(data[n])
+
+        df2 = annotate_frame(ref, data, n, id_type, mode, copy)
+        st.rows_out = len(df2)
+
+    if key is not None:
+        # In append mode only the annotation columns are kept, the user's columns are taken from data
+        store_result(key, df2[ANNOTATION_COLUMNS] if mode == 'append' else df2)
+    return df2
+
+
+def _with_annotation(data, annotation, copy=None):
+    # Append-mode result from the cached annotation columns, sharing or copying data as copy asks
+    df2 = copy_frame(data, copy)
+    for col in ANNOTATION_COLUMNS:
+        df2[col] = annotation[col].array
+    df2.attrs.update(annotation.attrs)
+    return df2
+
+
+def annotate_frame(ref, data, gene_column, id_type, mode='expand', copy=None):
+    """
+    Annotate a data frame against a MatrisomeReference, the core of matriannotate
+    without the argument checks.
+    """
+    n = gene_column
+    with stage('annotate.match', rows_in=len(data)) as st:
+        rows, ref_rows = annotate_codes(ref, gene_keys(data[n]), id_type, first=(mode == 'append'))
+        st.rows_out = len(ref_rows)
+
+    with stage('annotate.assemble', rows_in=len(ref_rows)) as st:
+        if mode == 'append':
+            df2 = _append(ref, data, n, ref_rows, copy)
+            # The gene column stays a user column, matrianalyze must not sum it
+            df2.attrs['gene_column'] = n
+        else:
+            df2 = _assemble(ref, data, n, rows, ref_rows)
+        st.rows_out = len(df2)
 
     # Set attributes
     df2.attrs['workflow'] = "matrisomeannotatoR"
+    df2.attrs['id_type'] = id_type
+    # Reference the annotation comes from, so delta.reannotate can bring it up to date later
+    df2.attrs['species'] = ref.species
+    df2.attrs['reference_version'] = ref.version
+    df2.attrs['gene_fingerprints'] = GeneFingerprints.from_rows(ref, ref_rows)
 
     return df2
 
 
-def matrianalyze(data=None):
-    data_check2(data)
+def copy_frame(data, copy=None):
+    """
+    Copy of a data frame to add columns to: a shallow copy under pandas copy-on-write
+    or with copy=False, a deep copy otherwise, so that changing the result never
+    changes data unless asked for.
+    """
+    if copy is None:
+        copy = pd.options.mode.copy_on_write is not True
+    return data.copy(deep=copy)
 
-    if len(data.columns) < 1:
-        print("data should be annotated first, execution stops")
-        return
 
-    n = "Annotated Gene"
-    df = data.copy()
-    # Remove non-numeric characters and convert to numeric
-    tr = df.apply(lambda x: pd.to_numeric(x.astype(str).str.replace(r'[^0-9.-]', '', regex=True), errors='coerce'))
+def _append(ref, data, n, ref_rows, copy=None):
+    """
+    Add the annotation columns at the end of the user's table, row by row in the
+    user's order and index, leaving the user's columns and dtypes as they are.
+    """
+    division, category = annotation_codes(ref, ref_rows)
 
-    # Remove columns with all NaN values
-    tr = tr.loc[:, ~tr.isna().any()]
+    gene = data[n].to_numpy(dtype=object, na_value="")
+    gene = np.where(gene == "", "gene name missing in original data", gene)
 
-    nmtr = tr.columns.tolist()
+    df2 = copy_frame(data, copy)
+    df2['Annotated Gene'] = gene
+    df2['Annotated Matrisome Division'] = pd.Categorical.from_codes(division, ref.division_levels)
+    df2['Annotated Matrisome Category'] = pd.Categorical.from_codes(category, ref.category_levels)
+    return df2
 
-    # Merge with the original data
-    tr = pd.concat([df[[n]], tr], axis=1)
 
-    # Ensure columns are numeric, avoiding issues with duplicate column names
-    tr.iloc[:, 1:] = tr.iloc[:, 1:].apply(pd.to_numeric, errors='coerce')
+def _assemble(ref, data, n, rows, ref_rows):
+    # Annotations as categoricals over the reference levels, Non-matrisome where unmatched
+    division, category = annotation_codes(ref, ref_rows)
 
-    # Aggregate data
-    df2_2 = df.iloc[:, :3]
-    bf = pd.merge(df2_2, tr, left_on=n, right_on=n).drop_duplicates()
+    # User columns other than the gene column, expanded only if a gene has several annotations
+    keep = np.flatnonzero(data.columns != n)
+    df2 = data.take(keep, axis=1)
+    if rows is not None:
+        df2 = df2.take(rows)
+    df2.index = pd.RangeIndex(len(df2))
 
-    # Prepare columns for aggregation: "Annotated Matrisome Division" and columns from the 4th column onward
-    division_cols = ['Annotated Matrisome Division'] + bf.columns[3:].tolist()
-    category_cols = ['Annotated Matrisome Category'] + bf.columns[3:].tolist()
+    # Fill missing values, touching only the columns that have any
+    for i in np.flatnonzero(df2.isna().any().to_numpy()):
+        df2.isetitem(i, df2.iloc[:, i].astype(object).fillna(""))
 
-    # Aggregate based on "Annotated Matrisome Division"
-    a = bf[division_cols].groupby('Annotated Matrisome Division').sum()
+    gene = data[n] if rows is None else data[n].iloc[rows]
+    gene = gene.replace("", "gene name missing in original data").fillna("").to_numpy()
 
-    # Aggregate based on "Annotated Matrisome Category"
-    b = bf[category_cols].groupby('Annotated Matrisome Category').sum()
+    df2.insert(0, 'Annotated Gene', gene)
+    df2.insert(1, 'Annotated Matrisome Division', pd.Categorical.from_codes(division, ref.division_levels))
+    df2.insert(2, 'Annotated Matrisome Category', pd.Categorical.from_codes(category, ref.category_levels))
+    return df2
 
-    # Concatenate the results
-    z = pd.concat([a, b])
 
-    z.index.name = "Matrisome Annotation"
-    z.attrs['workflow'] = "matrisomeanalyzeR"
+def annotate_codes(ref, keys, id_type=None, first=False):
+    """
+    Match gene identifiers against a MatrisomeReference.
+
+    Parameters:
+    - ref: MatrisomeReference of the species
+    - keys: Array of gene identifiers
+    - id_type: Identifier type used for the normalized lookup, None for exact matches only
+    - first: If True genes with several annotations keep only the first one, in
+      reference order, so that the output rows are always the input rows
+
+    Returns:
+    - rows: Position in keys of every output row, None when no gene has more
+      than one annotation and the output rows are the input rows
+    - ref_rows: Reference row of every output row, -1 for non-matrisome genes
+    """
+    return expand_codes(ref, ref.codes(keys, id_type), first)
+
+
+def expand_codes(ref, codes, first=False):
+    """
+    Turn reference gene codes (MatrisomeReference.codes, -1 for no match) into output
+    rows and reference rows, as returned by annotate_codes.
+    """
+    hit = codes >= 0
+    if first:
+        return None, np.where(hit, ref.starts[codes], -1)
+    n_match = np.ones(len(codes), dtype=np.int64)
+    n_match[hit] = ref.counts[codes[hit]]
+
+    if (n_match == 1).all():
+        return None, np.where(hit, ref.starts[codes], -1)
+
+    # Repeat the rows of ambiguous genes, once per annotation in reference order
+    rows = np.repeat(np.arange(len(codes)), n_match)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_match) - n_match, n_match)
+    return rows, np.where(hit[rows], ref.starts[codes[rows]] + offsets, -1)
+
+
+def annotation_codes(ref, ref_rows):
+    """
+    Division and category codes, into ref.division_levels and ref.category_levels, of
+    reference rows as returned by annotate_codes; Non-matrisome where the row is -1.
+    """
+    division = np.where(ref_rows >= 0, ref.division_codes[ref_rows], ref.division_levels.index("Non-matrisome"))
+    category = np.where(ref_rows >= 0, ref.category_codes[ref_rows], ref.category_levels.index("Non-matrisome"))
+    return division, category
+
+
+def matrianalyze(data=None, duplicates='sum', groupby=None):
+    """
+    Tabulate an annotated table: the sums of every numeric column per matrisome
+    division, followed by the sums per matrisome category.
+
+    Parameters:
+    - data: Annotated data frame, as returned by matriannotate
+    - duplicates: How rows sharing gene, division and category are combined, one of DUPLICATE_POLICIES
+    - groupby: Optional column name of data (e.g. a cluster or condition) or a label per row;
+      the table is then computed for every group in the same pass
+
+    Returns:
+    - z: Data frame indexed by "Matrisome Annotation", or by (group, "Matrisome Annotation")
+      when groupby is given; z.unstack(0) puts the groups side by side
+    """
+    data_check2(data)
+
+    if len(data.columns) < 1:
+        print("data should be annotated first, execution stops")
+        return
+
+    if not check_arguments(duplicates=duplicates):
+        return
+
+    groups = None
+    # The gene column of a table annotated with mode='append'
+    exclude = [data.attrs['gene_column']] if 'gene_column' in data.attrs else []
+    if groupby is not None:
+        if isinstance(groupby, str):
+            if groupby not in data.columns:
+                print(f"column {groupby} was not found in data, execution stops")
+                return
+            groups = data[groupby]
+            exclude.append(groupby)
+        else:
+            groups = pd.Series(groupby, name="Group")
+            if len(groups) != len(data):
+                print("groupby should have one label per row of data, execution stops")
+                return
+
+    key = None
+    if result_cache_enabled():
+        group_key = groupby if groups is None or isinstance(groupby, str) else labels_key(groups)
+        key = result_key(data, 'analyze', duplicates, group_key, exclude, data.attrs.get('reference_version'))
+        z = cached_result(key)
+        if z is not None:
+            # Same annotation columns, so the stored summary describes data as well
+            if 'matrisome_summary' in z.attrs:
+                data.attrs['matrisome_summary'] = z.attrs['matrisome_summary']
+            return z
+
+    with stage('analyze', rows_in=len(data)) as st:
+        # Convert to numeric, keeping only columns with a number in every row
+        with stage('analyze.coerce', rows_in=len(data), columns=data.shape[1]) as sc:
+            tr = numeric_columns(data, exclude=exclude)
+            sc.set(numeric_columns=tr.shape[1])
+
+        # Sum per division and category in one pass, then roll up to the two annotation levels
+        with stage('analyze.aggregate', rows_in=len(data)) as sa:
+            pairs = pair_sums(data, tr, duplicates, groups)
+            z = pair_totals(pairs)
+            sa.rows_out = len(z)
+
+        z.attrs['workflow'] = "matrisomeanalyzeR"
+        z.attrs['matrisome_pairs'] = PairSums(pairs, duplicates, groupby if isinstance(groupby, str) else None)
+        if 'reference_version' in data.attrs:
+            z.attrs['reference_version'] = data.attrs['reference_version']
+        # Gene counts of the annotated table, so that the table can be passed to the plots
+        with stage('analyze.summary', rows_in=len(data)):
+            z.attrs['matrisome_summary'] = summarize(data)
+        st.rows_out = len(z)
+
+    if key is not None:
+        store_result(key, z)
+    return z
+
+
+class PairSums:
+    """
+    The (division, category) sums a matrianalyze table was rolled up from, as returned
+    by pair_sums, kept in attrs['matrisome_pairs'] so that delta.update_totals can
+    update the table without the rows it was computed from.
+    """
+
+    def __init__(self, pairs, duplicates='sum', groupby=None):
+        self.pairs = pairs
+        self.duplicates = duplicates
+        self.groupby = groupby
+
+    def __repr__(self):
+        return f"PairSums(pairs={len(self.pairs)}, duplicates={self.duplicates!r}, groupby={self.groupby!r})"
+
+    def __deepcopy__(self, memo):
+        # update_totals copies pairs before adding to them, so copies of the table can share
+        # the sums instead of deep-copying a data frame on every pandas operation
+        return self
+
+
+def pair_sums(data, values, duplicates='sum', groups=None):
+    """
+    Sum numeric columns per (division, category) pair of an annotated table.
+
+    Parameters:
+    - data: Annotated data frame
+    - values: Numeric columns of data, as returned by numeric_columns
+    - duplicates: 'sum' adds up all rows; 'first' and 'max' first reduce the rows
+      sharing gene, division and category to the first row or the column maxima
+    - groups: Optional series with a group label per row of data
+
+    Returns:
+    - pairs: Data frame of sums indexed by the (division, category) pairs that occur,
+      in level order, or by (group, division, category) when groups are given
+    """
+    div_codes, div_labels = label_codes(data['Annotated Matrisome Division'])
+    cat_codes, cat_labels = label_codes(data['Annotated Matrisome Category'])
+    n_pairs = len(div_labels) * len(cat_labels)
+
+    if groups is None:
+        group_codes, group_labels = np.zeros(len(data), dtype=np.int64), pd.Index([0])
+    else:
+        group_codes, group_labels = label_codes(groups)
+    n_groups = len(group_labels) * n_pairs
+
+    # Numeric block with contiguous columns
+    x = np.empty((len(values), values.shape[1]), order='F')
+    for j in range(values.shape[1]):
+        x[:, j] = values.iloc[:, j].to_numpy(dtype=np.float64)
+
+    joint = (group_codes.astype(np.int64) * len(div_labels) + div_codes) * len(cat_labels) + cat_codes
+    valid = (div_codes >= 0) & (cat_codes >= 0) & (group_codes >= 0)
+    if not valid.all():
+        joint, x = joint[valid], x[valid]
+
+    if duplicates != 'sum':
+        genes = pd.factorize(data['Annotated Gene'])[0][valid]
+        key = genes.astype(np.int64) * n_groups + joint
+        if duplicates == 'first':
+            _, first = np.unique(key, return_index=True)
+            joint, x = joint[first], x[first]
+        elif len(key):
+            order = np.argsort(key, kind='stable')
+            key = key[order]
+            starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+            joint, x = joint[order][starts], np.maximum.reduceat(x[order], starts, axis=0)
+
+    # Segment sums over the pair codes, one bincount per column
+    counts = np.bincount(joint, minlength=n_groups)
+    sums = np.empty((n_groups, x.shape[1]))
+    for j in range(x.shape[1]):
+        sums[:, j] = np.bincount(joint, weights=x[:, j], minlength=n_groups)
+
+    found = np.flatnonzero(counts)
+    levels = [pd.Categorical.from_codes(found // n_pairs, group_labels),
+              pd.Categorical.from_codes(found % n_pairs // len(cat_labels), div_labels),
+              pd.Categorical.from_codes(found % len(cat_labels), cat_labels)]
+    names = [None, 'Annotated Matrisome Division', 'Annotated Matrisome Category']
+    if groups is None:
+        levels, names = levels[1:], names[1:]
+    else:
+        names[0] = groups.name
+    out = pd.DataFrame(sums[found], index=pd.MultiIndex.from_arrays(levels, names=names), columns=values.columns)
+
+    # Integer columns stay integer
+    for j in np.flatnonzero([is_integer_dtype(dtype) for dtype in values.dtypes]):
+        out.isetitem(j, out.iloc[:, j].astype(np.int64))
+    return out
+
+
+def pair_totals(pairs):
+    """
+    Roll (division, category) sums up to the matrianalyze layout: the division totals
+    followed by the category totals, for every group if the pairs are grouped.
+    """
+    if pairs.index.nlevels == 2:
+        a = pairs.groupby(level=0, observed=True).sum()
+        b = pairs.groupby(level=1, observed=True).sum()
+        z = pd.concat([a, b])
+        z.index = z.index.astype(object)
+        z.index.name = "Matrisome Annotation"
+        return z
+
+    group = pairs.index.names[0]
+    a = pairs.groupby(level=[0, 1], observed=True).sum()
+    b = pairs.groupby(level=[0, 2], observed=True).sum()
+    a.index.names = b.index.names = [group, "Matrisome Annotation"]
+    z = pd.concat([a, b])
 
+    # Keep each group together, divisions before categories
+    order = np.argsort(np.concatenate([a.index.codes[0], b.index.codes[0]]), kind='stable')
+    z = z.iloc[order]
+    z.index = pd.MultiIndex.from_arrays([z.index.get_level_values(0),
+                                         z.index.get_level_values(1).astype(object)], names=z.index.names)
     return z
+
+
+ANNOTATION_COLUMNS = ['Annotated Gene', 'Annotated Matrisome Division', 'Annotated Matrisome Category']
+
+
+def numeric_columns(data, sample_size=64, exclude=()):
+    """
+    Return the columns of an annotated table, other than the annotation columns
+    and those in exclude, that hold a number in every row.
+
+    Columns that already have a numeric dtype are kept as they are. Other columns are
+    first tried on a small sample of rows and only converted in full if the sample
+    parses: plain numbers, percentages such as '0.9%', and values from which the
+    non-numeric characters are removed, in that order.
+    """
+    columns = []
+    for i in np.flatnonzero(~data.columns.isin(ANNOTATION_COLUMNS + list(exclude))):
+        x = data.iloc[:, i]
+
+        if is_bool_dtype(x.dtype):
+            continue
+        if not is_numeric_dtype(x.dtype):
+            if isinstance(x.dtype, pd.CategoricalDtype):
+                x = x.astype(object)
+            sample = x.iloc[np.linspace(0, len(x) - 1, sample_size).astype(int)] if len(x) > sample_size else x
+            first = _first_parser(sample)
+            if first is None:
+                continue
+            x = _parse_numbers(x, first)
+
+        if not x.isna().any():
+            columns.append(x)
+
+    if not columns:
+        return pd.DataFrame(index=data.index)
+    return pd.concat(columns, axis=1)
+
+
+_PARSERS = [
+    lambda x: pd.to_numeric(x, errors='coerce'),
+    lambda x: pd.to_numeric(x.astype(str).str.rstrip('%'), errors='coerce'),
+    lambda x: pd.to_numeric(x.astype(str).str.replace(r'[^0-9.-]', '', regex=True), errors='coerce')
+]
+
+
+def _first_parser(x, start=0):
+    for i in range(start, len(_PARSERS)):
+        if not _PARSERS[i](x).isna().any():
+            return i
+    return None
+
+
+def _parse_numbers(x, first=0):
+    v = _PARSERS[first](x)
+    bad = v.isna().to_numpy()
+    if bad.any():
+        # Try the remaining parsers on the failing rows first, the whole column is only reparsed if one works
+        retry = _first_parser(x[bad], first + 1)
+        if retry is not None:
+            v = _PARSERS[retry](x)
+    return v
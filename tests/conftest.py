@@ -0,0 +1,41 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BUNDLED_RDA = os.path.join(ROOT, 'python_demo', 'matrisome.list.rda')
+
+
+@pytest.fixture(scope='session')
+def matrisome_data(tmp_path_factory):
+    """
+    Run from a scratch directory with the bundled matrisome list at ../data, where
+    the package looks for it, and its reference cache built there.
+    """
+    from python_demo.reference import build_reference_cache
+
+    base = tmp_path_factory.mktemp('matrisome')
+    os.makedirs(base / 'data')
+    os.makedirs(base / 'work')
+    shutil.copy(BUNDLED_RDA, base / 'data' / 'matrisome.list.rda')
+
+    cwd = os.getcwd()
+    os.chdir(base / 'work')
+    try:
+        build_reference_cache()
+    except ImportError:
+        os.chdir(cwd)
+        pytest.skip("rpy2 is needed to read the matrisome .rda file")
+    yield base
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope='session')
+def examples(matrisome_data):
+    from python_demo.bench import example_tables
+
+    return {name: (data, gene_column, species) for name, data, gene_column, species in example_tables()}
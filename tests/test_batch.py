@@ -0,0 +1,90 @@
+import os
+import shutil
+import threading
+
+from python_demo import batch
+from python_demo.batch import read_manifest, run_batch
+from python_demo.bench import EXAMPLES_DIR
+from python_demo.instrument import instrument
+
+
+def _inputs(tmp_path):
+    source = tmp_path / 'in'
+    source.mkdir()
+    for name in os.listdir(os.path.join(EXAMPLES_DIR, 'Breast Invasive Carcinoma (TCGA, Cell 2015)')):
+        if name.endswith('.txt'):
+            shutil.copy(os.path.join(EXAMPLES_DIR, 'Breast Invasive Carcinoma (TCGA, Cell 2015)', name), source)
+    return source
+
+
+def test_run_batch_records_stages_of_worker_threads(matrisome_data, tmp_path):
+    source = _inputs(tmp_path)
+    with instrument(memory=False) as records:
+        z = run_batch(str(source), str(tmp_path / 'out'), 'human', plots=[], workers=2)
+
+    files = len(os.listdir(source))
+    assert z.shape[1] == files + 1
+    stages = [r['stage'] for r in records]
+    assert stages.count('annotate') == files
+    assert stages.count('analyze') == files
+    # Stages of one thread nest in that thread only
+    assert all(r['parent'] == 'annotate' for r in records if r['stage'] == 'annotate.match')
+
+
+def test_run_batch_resumes(matrisome_data, tmp_path):
+    source = _inputs(tmp_path)
+    first = run_batch(str(source), str(tmp_path / 'out'), 'human', plots=[])
+    with instrument(memory=False) as records:
+        second = run_batch(str(source), str(tmp_path / 'out'), 'human', plots=[])
+
+    assert second.equals(first)
+    assert not any(r['stage'] == 'annotate' for r in records)
+    assert all(entry['status'] == 'done' for entry in read_manifest(str(tmp_path / 'out')).values())
+
+
+def _run_in_thread(*args, **kwargs):
+    # run_batch must return when rendering fails, not wait forever on its queues
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(z=run_batch(*args, **kwargs)), daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive(), "run_batch did not return"
+    return result['z']
+
+
+def test_run_batch_survives_render_errors(matrisome_data, tmp_path, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("render failed")
+
+    monkeypatch.setattr(batch, 'render_summary', fail)
+    source = _inputs(tmp_path)
+    z = _run_in_thread(str(source), str(tmp_path / 'out'), 'human', render_processes=1, queue_size=1)
+
+    assert z is None
+    manifest = read_manifest(str(tmp_path / 'out'))
+    assert len(manifest) == len(os.listdir(source))
+    assert all(entry == {**entry, 'status': 'failed', 'error': "render failed"} for entry in manifest.values())
+
+
+def test_run_batch_survives_a_broken_render_stage(matrisome_data, tmp_path, monkeypatch):
+    def fail(name, entry):
+        raise OSError("disk full")
+
+    # Failures are recorded too, so a manifest that cannot be written stops the render thread
+    monkeypatch.setattr(batch, '_write_manifest', fail)
+    source = _inputs(tmp_path)
+    z = _run_in_thread(str(source), str(tmp_path / 'out'), 'human', plots=[], workers=1, queue_size=1)
+    assert z is None
+
+
+def test_run_batch_survives_render_submit_errors(matrisome_data, tmp_path, monkeypatch):
+    def submit(*args):
+        raise RuntimeError("render pool is broken")
+
+    # As pool.submit raises BrokenProcessPool once a render process was killed
+    monkeypatch.setattr(batch, '_Immediate', submit)
+    source = _inputs(tmp_path)
+    z = _run_in_thread(str(source), str(tmp_path / 'out'), 'human', render_processes=1, queue_size=1)
+
+    assert z is None
+    assert all(entry['error'] == "render pool is broken" for entry in read_manifest(str(tmp_path / 'out')).values())
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+from python_demo.common import argument_error, check_arguments
+from python_demo.util import matriannotate
+
+
+@pytest.mark.parametrize('arguments, error', [
+    ({'species': 'human', 'id_type': 'auto', 'mode': 'append', 'duplicates': 'first'}, None),
+    ({'species': ['human', 'mouse'], 'id_type': None}, None),
+    ({'species': []}, "no species provided"),
+    ({'species': ['human', 'dog']}, "Species dog is not recognized"),
+    ({'id_type': 'uniprot'}, "id_type uniprot is not recognized"),
+    ({'mode': 'replace'}, "mode should be one of expand, append"),
+])
+def test_argument_error(arguments, error):
+    assert argument_error(**arguments) == error
+
+
+def test_check_arguments(capsys):
+    assert check_arguments(species='human')
+    assert not check_arguments(species='dog')
+    assert capsys.readouterr().out == "Species dog is not recognized, execution stops\n"
+    assert matriannotate(pd.DataFrame({'Gene': ['COL1A1']}), 'Gene', 'dog') is None
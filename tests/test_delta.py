@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from python_demo.common import ANNOTATE_MODES, DUPLICATE_POLICIES
+from python_demo.delta import diff_references, reannotate, update_totals
+from python_demo.reference import MatrisomeReference, get_reference, load_species
+from python_demo.stream import MatrianalyzeAccumulator
+from python_demo.util import annotate_frame, matrianalyze, matriannotate
+
+
+@pytest.fixture(scope='module')
+def references(matrisome_data):
+    old = get_reference('human')
+    k = load_species('human').copy()
+    k.loc[k['gene'] == 'COL1A1', 'family'] = 'Proteoglycans'
+    k = k[k['gene'] != 'FN1']
+    k = pd.concat([k, pd.DataFrame({'gene': ['ASPM', 'ASPM'], 'category': ['Core matrisome', 'Matrisome-associated'],
+                                    'family': ['Collagens', 'Secreted Factors']})], ignore_index=True)
+    return old, MatrisomeReference('human', 'v2-test', k)
+
+
+def test_diff_references(references):
+    diff = diff_references(*references).set_index('Gene')['Change']
+    assert diff.to_dict() == {'COL1A1': 'changed', 'FN1': 'removed', 'ASPM': 'added'}
+
+
+@pytest.mark.parametrize('mode', ANNOTATE_MODES)
+@pytest.mark.parametrize('use_previous', [False, True])
+def test_reannotate_and_update_totals(examples, references, mode, use_previous):
+    old, new = references
+    data, gene_column, species = examples['mass-spec']
+    ann0 = matriannotate(data, gene_column, species, mode=mode)
+    expected = annotate_frame(new, data, gene_column, ann0.attrs['id_type'], mode)
+
+    ann, removed, added = reannotate(ann0, new, previous=old if use_previous else None)
+    pd.testing.assert_frame_equal(ann, expected)
+
+    for duplicates in DUPLICATE_POLICIES:
+        z = update_totals(matrianalyze(ann0, duplicates=duplicates), removed, added)
+        full = matrianalyze(expected, duplicates=duplicates)
+        pd.testing.assert_frame_equal(z, full, check_exact=False)
+        assert z.attrs['matrisome_summary'].counts.equals(full.attrs['matrisome_summary'].counts)
+
+
+def test_update_totals_of_accumulated_table(examples, references):
+    old, new = references
+    data, gene_column, species = examples['mass-spec']
+    ann0 = matriannotate(data, gene_column, species)
+    accumulator = MatrianalyzeAccumulator()
+    for start in range(0, len(ann0), 200):
+        accumulator.update(ann0.iloc[start:start + 200])
+    z0 = accumulator.result()
+    assert z0.attrs['matrisome_summary'].counts.equals(matrianalyze(ann0).attrs['matrisome_summary'].counts)
+
+    ann, removed, added = reannotate(ann0, new)
+    z = update_totals(z0, removed, added)
+    pd.testing.assert_frame_equal(z, matrianalyze(ann), check_exact=False, check_names=False)
+
+
+def test_update_totals_refuses_grouped_tables(examples, capsys):
+    data, gene_column, species = examples['mass-spec']
+    ann = matriannotate(data, gene_column, species)
+    z = matrianalyze(ann, groupby=ann.index % 2 == 0)
+    assert update_totals(z, ann.iloc[:0], ann.iloc[:0]) is None
+    assert "execution stops" in capsys.readouterr().out
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from python_demo.bench import EXAMPLES_DIR, example_tables
+from python_demo.common import ANNOTATE_MODES, DUPLICATE_POLICIES
+from python_demo.engines import (_comparable, matrianalyze_arrow, matrianalyze_polars, matriannotate_arrow,
+                                 matriannotate_polars, read_source)
+from python_demo.util import matrianalyze, matriannotate
+
+pa = pytest.importorskip('pyarrow')
+
+EXAMPLES = [name for name, *_ in example_tables()]
+
+
+def _annotate(engine, data, gene_column, species, mode):
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    if engine == 'arrow':
+        return matriannotate_arrow(table, gene_column, species, mode=mode)
+    pl = pytest.importorskip('polars')
+    return matriannotate_polars(pl.from_arrow(table), gene_column, species, mode=mode)
+
+
+def _analyze(engine, ann, gene_column, mode, duplicates):
+    if engine == 'arrow':
+        return matrianalyze_arrow(ann, duplicates=duplicates)
+    exclude = [gene_column] if mode == 'append' else []
+    return matrianalyze_polars(ann, duplicates=duplicates, exclude=exclude)
+
+
+@pytest.mark.parametrize('engine', ['arrow', 'polars'])
+@pytest.mark.parametrize('mode', ANNOTATE_MODES)
+@pytest.mark.parametrize('name', EXAMPLES)
+def test_annotate_matches_pandas(examples, name, mode, engine):
+    data, gene_column, species = examples[name]
+    expected = matriannotate(data, gene_column, species, mode=mode)
+    ann = _annotate(engine, data, gene_column, species, mode)
+
+    pd.testing.assert_frame_equal(_comparable(ann.to_pandas()), _comparable(expected), check_dtype=False)
+
+
+@pytest.mark.parametrize('duplicates', DUPLICATE_POLICIES)
+@pytest.mark.parametrize('engine', ['arrow', 'polars'])
+@pytest.mark.parametrize('mode', ANNOTATE_MODES)
+@pytest.mark.parametrize('name', EXAMPLES)
+def test_analyze_matches_pandas(examples, name, mode, engine, duplicates):
+    data, gene_column, species = examples[name]
+    expected = matrianalyze(matriannotate(data, gene_column, species, mode=mode), duplicates=duplicates)
+    ann = _annotate(engine, data, gene_column, species, mode)
+
+    pd.testing.assert_frame_equal(_analyze(engine, ann, gene_column, mode, duplicates), expected)
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow', 'polars'])
+def test_read_source_uses_sep(tmp_path, engine):
+    if engine != 'pandas':
+        pytest.importorskip(engine if engine == 'polars' else 'pyarrow')
+    data = pd.read_csv(f'{EXAMPLES_DIR}/Mass-spec/mass-spec.csv')
+    path = tmp_path / 'semicolons.csv'
+    data.to_csv(path, sep=';', index=False)
+
+    table = read_source(path, engine, sep=';')
+    if engine == 'polars':
+        table = table.collect()
+    columns = list(table.columns) if engine != 'arrow' else table.column_names
+    assert columns == list(data.columns)
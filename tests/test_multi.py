@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from python_demo.bench import synthetic_table
+from python_demo.common import SPECIES
+from python_demo.delta import reannotate
+from python_demo.multi import MULTI_SPECIES, matriannotate_multi
+from python_demo.reference import get_reference
+from python_demo.util import matrianalyze, matriannotate
+
+
+@pytest.fixture(scope='module')
+def tables(examples):
+    tables = {name: (data, gene_column) for name, (data, gene_column, _) in examples.items()}
+    tables['mouse synthetic'] = (synthetic_table(5000, 'mouse', seed=1), 'Gene Symbol')
+    return tables
+
+
+@pytest.mark.parametrize('name', ['mass-spec', 'mouse synthetic'])
+def test_species_columns_match_matriannotate(tables, name):
+    data, gene_column = tables[name]
+    multi = matriannotate_multi(data, gene_column)
+    for species in SPECIES:
+        ann = matriannotate(data, gene_column, species, mode='append')
+        for label in ('Division', 'Category'):
+            pd.testing.assert_series_equal(multi[f'{species} Matrisome {label}'].astype(object),
+                                           ann[f'Annotated Matrisome {label}'].astype(object), check_names=False)
+    assert sum(multi.attrs['species_matches'].values()) == multi['Matrisome Species'].notna().sum()
+    assert matrianalyze(multi) is not None
+
+
+def test_reannotate_refuses_multi_species_tables(tables, capsys):
+    data, gene_column = tables['mass-spec']
+    multi = matriannotate_multi(data, gene_column)
+    assert multi.attrs['species'] == MULTI_SPECIES
+    assert reannotate(multi) is None
+    assert reannotate(multi, previous=get_reference('human')) is None
+    assert capsys.readouterr().out.count("execution stops") == 2
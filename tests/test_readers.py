@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from python_demo.readers import detect_format, read_cbioportal, read_header, read_mass_spec
+
+
+def _write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_read_header_keeps_quoted_separators(tmp_path):
+    path = _write(tmp_path / 'table.csv', '\ufeff"Gene Symbol","Desc, long",Total Spectrum Count_A\nCOL1A1,"x, y",3\n')
+    assert read_header(path, ',') == ['Gene Symbol', 'Desc, long', 'Total Spectrum Count_A']
+
+
+def test_read_mass_spec(tmp_path):
+    path = _write(tmp_path / 'mass-spec.csv',
+                  'Gene Symbol,"Desc, long",Total Spectrum Count_A,Percent Coverage_A\n'
+                  'COL1A1,"x, y",3,2.45%\n'
+                  'FN1,z,5,10%\n')
+    assert detect_format(path) == 'mass-spec'
+    data = read_mass_spec(path)
+    assert list(data.columns) == ['Gene Symbol', 'Total Spectrum Count_A', 'Percent Coverage_A']
+    assert data['Total Spectrum Count_A'].dtype == np.int64
+    assert data['Percent Coverage_A'].tolist() == [2.45, 10.0]
+
+
+def test_read_cbioportal(tmp_path):
+    path = _write(tmp_path / 'mutated.txt',
+                  'Gene\tMutSig(Q-value)\t# Mut\t#\tProfiled Samples\tFreq\n'
+                  'TTN\t0.1\t40\t30\t100\t30%\n')
+    assert detect_format(path) == 'cbioportal'
+    data = read_cbioportal(path)
+    assert list(data.columns) == ['Gene', '# Mut', '#', 'Profiled Samples', 'Freq']
+    assert data['Freq'].tolist() == [30.0]
+
+
+def test_read_mass_spec_cache(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = _write(tmp_path / 'mass-spec.csv', 'Gene Symbol,Total Spectrum Count_A\nCOL1A1,3\n')
+    cache_dir = tmp_path / 'cache'
+    first = read_mass_spec(path, cache_dir=str(cache_dir))
+    assert len(list(cache_dir.iterdir())) == 1
+    assert read_mass_spec(path, cache_dir=str(cache_dir)).equals(first)
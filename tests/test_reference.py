@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from python_demo.common import ID_TYPES, SPECIES
+from python_demo.reference import MatrisomeReference, load_species, map_reference, reference_version
+from python_demo.util import annotate_codes, annotate_frame, annotation_codes
+
+
+@pytest.fixture(scope='module')
+def references(matrisome_data):
+    version = reference_version()
+    return {species: (MatrisomeReference(species, version, load_species(species)), map_reference(species))
+            for species in SPECIES}
+
+
+def _queries(ref):
+    # Genes as listed, in other case, with Ensembl version suffixes, and values found nowhere
+    genes = np.asarray(ref.genes, dtype=object)
+    return np.concatenate([genes, np.array([g.lower() for g in genes], dtype=object),
+                           np.array([g + '.3' for g in genes], dtype=object),
+                           np.array([None, '', 'x' * 500, 'NOPE'], dtype=object)])
+
+
+@pytest.mark.parametrize('species', SPECIES)
+@pytest.mark.parametrize('id_type', [None] + ID_TYPES)
+def test_mapped_reference_matches(references, species, id_type):
+    built, mapped = references[species]
+    keys = _queries(built)
+    for first in (False, True):
+        rows, ref_rows = annotate_codes(built, keys, id_type, first=first)
+        mapped_rows, mapped_ref_rows = annotate_codes(mapped, keys, id_type, first=first)
+        assert (rows is None) == (mapped_rows is None)
+        if rows is not None:
+            np.testing.assert_array_equal(rows, mapped_rows)
+        for codes, mapped_codes in zip(annotation_codes(built, ref_rows), annotation_codes(mapped, mapped_ref_rows)):
+            np.testing.assert_array_equal(codes, mapped_codes)
+
+
+@pytest.mark.parametrize('species', SPECIES)
+def test_mapped_reference_table(references, species):
+    built, mapped = references[species]
+    assert built.version == mapped.version
+    order = list(built.table.columns)
+    pd.testing.assert_frame_equal(built.table.sort_values(order, kind='stable').reset_index(drop=True),
+                                  mapped.table.sort_values(order, kind='stable').reset_index(drop=True))
+
+
+@pytest.mark.parametrize('mode', ['expand', 'append'])
+def test_mapped_reference_annotates_examples(references, examples, mode):
+    for data, gene_column, species in examples.values():
+        built, mapped = references[species]
+        ann = annotate_frame(built, data, gene_column, 'symbol', mode)
+        mapped_ann = annotate_frame(mapped, data, gene_column, 'symbol', mode)
+        pd.testing.assert_frame_equal(ann, mapped_ann)
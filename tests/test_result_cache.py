@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from python_demo.result_cache import (cached_result, clear_result_cache, result_cache_stats, result_key,
+                                      set_result_cache, store_result)
+from python_demo.util import matrianalyze, matriannotate
+
+
+@pytest.fixture(autouse=True)
+def result_cache():
+    clear_result_cache()
+    yield
+    set_result_cache(memory_size=0)
+    clear_result_cache()
+
+
+def _table(seed=0, rows=100):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'Gene': [f'G{i}' for i in range(rows)], 'x': rng.normal(size=rows)})
+
+
+def test_key_changes_with_values_and_arguments():
+    data = _table()
+    key = result_key(data, 'annotate', 'Gene', 'human')
+    assert result_key(data.copy(), 'annotate', 'Gene', 'human') == key
+
+    changed = data.copy()
+    changed.loc[5, 'x'] += 1
+    assert result_key(changed, 'annotate', 'Gene', 'human') != key
+    assert result_key(data.rename(columns={'x': 'y'}), 'annotate', 'Gene', 'human') != key
+    assert result_key(data.set_index(data.index + 1), 'annotate', 'Gene', 'human') != key
+    assert result_key(data, 'annotate', 'Gene', 'mouse') != key
+
+
+def test_memory_tier_hits_and_evicts():
+    set_result_cache(memory_size=2)
+    tables = [_table(seed) for seed in range(3)]
+    keys = [result_key(t) for t in tables]
+
+    assert cached_result(keys[0]) is None
+    for key, table in zip(keys, tables):
+        store_result(key, table)
+
+    # The least recently used result went first
+    assert cached_result(keys[0]) is None
+    hit = cached_result(keys[2])
+    pd.testing.assert_frame_equal(hit, tables[2])
+    # Hits are copies, changing them leaves the stored result as it was
+    hit.loc[0, 'x'] = np.nan
+    assert cached_result(keys[2]).equals(tables[2])
+
+    stats = result_cache_stats()
+    assert stats['memory_hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['stores'] == 3
+    assert stats['memory_evictions'] == 1
+    assert stats['memory_items'] == 2
+    assert stats['hit_rate'] == 0.5
+
+
+def test_disk_tier_hits_and_evicts(tmp_path):
+    tables = [_table(seed, rows=2000) for seed in range(4)]
+    keys = [result_key(t) for t in tables]
+
+    set_result_cache(memory_size=0, cache_dir=str(tmp_path))
+    store_result(keys[0], tables[0])
+    pd.testing.assert_frame_equal(cached_result(keys[0]), tables[0])
+    assert result_cache_stats()['disk_hits'] == 1
+
+    size = os.path.getsize(tmp_path / f'{keys[0]}.pkl')
+    set_result_cache(memory_size=0, cache_dir=str(tmp_path), max_bytes=2 * size)
+    for key, table in zip(keys[1:], tables[1:]):
+        store_result(key, table)
+
+    files = [f for f in os.listdir(tmp_path) if f.endswith('.pkl')]
+    assert len(files) == 2
+    assert sum(os.path.getsize(tmp_path / f) for f in files) <= 2 * size
+    assert result_cache_stats()['disk_evictions'] == 2
+
+    clear_result_cache(disk=True)
+    assert not os.listdir(tmp_path)
+
+
+def test_matriannotate_and_matrianalyze(examples):
+    data, gene_column, species = examples['mass-spec']
+    set_result_cache(memory_size=8)
+
+    for mode in ('expand', 'append'):
+        ann = matriannotate(data, gene_column, species, mode=mode)
+        pd.testing.assert_frame_equal(matriannotate(data, gene_column, species, mode=mode), ann)
+        assert matriannotate(data, gene_column, species, mode=mode).attrs.keys() == ann.attrs.keys()
+        z = matrianalyze(ann)
+        pd.testing.assert_frame_equal(matrianalyze(ann), z)
+    stats = result_cache_stats()
+    assert stats['misses'] == 4
+    assert stats['memory_hits'] == 6
+
+    # Other arguments are other results
+    matriannotate(data, gene_column, species, mode='expand', id_type='symbol')
+    matrianalyze(ann, duplicates='first')
+    assert result_cache_stats()['misses'] == 6
+
+
+def test_append_hits_follow_copy(examples):
+    data, gene_column, species = examples['mass-spec']
+    column = next(c for c in data.columns if pd.api.types.is_numeric_dtype(data[c].dtype))
+    set_result_cache(memory_size=8)
+
+    for _ in range(2):
+        shared = matriannotate(data, gene_column, species, mode='append', copy=False)
+        assert np.shares_memory(shared[column].to_numpy(), data[column].to_numpy())
+        copied = matriannotate(data, gene_column, species, mode='append')
+        assert not np.shares_memory(copied[column].to_numpy(), data[column].to_numpy())
+    assert result_cache_stats()['memory_hits'] == 3
@@ -0,0 +1,62 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from python_demo import server as server_module
+from python_demo.server import make_server
+
+
+@pytest.fixture(scope='module')
+def address(matrisome_data):
+    server = make_server(['human'], port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def _post(address, body):
+    connection = http.client.HTTPConnection(*address, timeout=10)
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    connection.request('POST', '/annotate', data, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    reply = json.loads(response.read())
+    connection.close()
+    return response.status, reply
+
+
+def test_annotate(address):
+    status, reply = _post(address, {'genes': ['COL1A1', 'TTN', None], 'species': 'human'})
+    assert status == 200
+    assert reply['species'] == 'human'
+
+
+@pytest.mark.parametrize('body', [
+    b'not json',
+    b'[1, 2]',
+    {'genes': 'COL1A1'},
+    {'genes': ['COL1A1', 1.5]},
+    {'genes': ['COL1A1', True]},
+    {'genes': [{'symbol': 'COL1A1'}]},
+    {'genes': ['COL1A1'], 'species': ['human']},
+    {'genes': ['COL1A1'], 'species': 'dog'},
+    {'genes': ['COL1A1'], 'id_type': 'uniprot'},
+    {'genes': ['COL1A1'], 'species': 'mouse'},
+])
+def test_bad_requests(address, body):
+    status, reply = _post(address, body)
+    assert status == 400
+    assert 'error' in reply
+
+
+def test_annotation_errors(address, monkeypatch):
+    def fail(genes, species, id_type='auto'):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server_module, 'annotate_genes', fail)
+    status, reply = _post(address, {'genes': ['COL1A1']})
+    assert status == 500
+    assert reply == {'error': "annotation failed: RuntimeError"}
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from python_demo.bench import synthetic_table
+from python_demo.util import matrianalyze, matriannotate, numeric_columns
+
+sp = pytest.importorskip('scipy.sparse')
+from python_demo.sparse import matrianalyze_sparse  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def tables(examples):
+    tables = {name: (data, gene_column, species) for name, (data, gene_column, species) in examples.items()}
+    tables['mouse synthetic'] = (synthetic_table(5000, 'mouse', seed=1, duplicate_rate=0.1), 'Gene Symbol', 'mouse')
+    return tables
+
+
+def _dense(data, gene_column):
+    values = numeric_columns(data, exclude=[gene_column]).fillna(0)
+    return pd.concat([data[[gene_column]], values], axis=1), values
+
+
+@pytest.mark.parametrize('name', ['mass-spec', 'mouse synthetic'])
+@pytest.mark.parametrize('gene_axis', [0, 1])
+def test_matches_matrianalyze(tables, name, gene_axis):
+    data, gene_column, species = tables[name]
+    data, values = _dense(data, gene_column)
+    expected = matrianalyze(matriannotate(data, gene_column, species))
+
+    matrix = sp.csr_matrix(values.to_numpy(dtype=np.float64))
+    if gene_axis == 1:
+        matrix = matrix.T.tocsc()
+    z = matrianalyze_sparse(matrix, data[gene_column], species, gene_axis=gene_axis, samples=list(values.columns))
+    pd.testing.assert_frame_equal(z, expected, check_dtype=False, check_names=False, check_index_type=False)
+
+
+def test_groups_sum_their_cells(tables):
+    data, gene_column, species = tables['mouse synthetic']
+    data, values = _dense(data, gene_column)
+    groups = ['a', 'b'] * (values.shape[1] // 2) + ['a'] * (values.shape[1] % 2)
+
+    matrix = sp.csr_matrix(values.to_numpy(dtype=np.float64))
+    z = matrianalyze_sparse(matrix, data[gene_column], species, samples=list(values.columns))
+    grouped = matrianalyze_sparse(matrix, data[gene_column], species, groups=groups)
+    pd.testing.assert_frame_equal(grouped, z.T.groupby(groups).sum().T, check_names=False)
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from python_demo.stream import matriannotate_stream, write_annotated_stream
+from python_demo.util import matriannotate
+
+
+def test_arguments_are_checked_at_the_call(tmp_path, capsys):
+    source = tmp_path / 'in.csv'
+    pd.DataFrame({'Gene': ['COL1A1']}).to_csv(source, index=False)
+
+    assert matriannotate_stream(str(source), 'Gene', 'martian') is None
+    assert write_annotated_stream(str(source), str(tmp_path / 'out.csv'), 'Gene', 'martian') is None
+    assert not (tmp_path / 'out.csv').exists()
+    assert capsys.readouterr().out.count("execution stops") == 2
+
+
+def test_stream_matches_matriannotate(examples, tmp_path):
+    data, gene_column, species = examples['mass-spec']
+    source = tmp_path / 'in.csv'
+    data.to_csv(source, index=False)
+
+    for mode in ('expand', 'append'):
+        chunks = list(matriannotate_stream(str(source), gene_column, species, chunksize=300, mode=mode))
+        expected = matriannotate(pd.read_csv(source), gene_column, species, mode=mode)
+        pd.testing.assert_frame_equal(pd.concat(chunks), expected)
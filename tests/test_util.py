@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from python_demo.util import matriannotate
+
+
+def _numeric_column(data):
+    return next(c for c in data.columns if pd.api.types.is_numeric_dtype(data[c].dtype))
+
+
+def test_append_copies_columns(examples):
+    data, gene_column, species = examples['mass-spec']
+    column = _numeric_column(data)
+    before = data[column].copy()
+    ann = matriannotate(data, gene_column, species, mode='append')
+    ann.loc[ann.index[0], column] = -1
+    pd.testing.assert_series_equal(data[column], before)
+
+
+def test_append_shares_columns_with_copy_false(examples):
+    data, gene_column, species = examples['mass-spec']
+    column = _numeric_column(data)
+    ann = matriannotate(data, gene_column, species, mode='append', copy=False)
+    assert np.shares_memory(ann[column].to_numpy(), data[column].to_numpy())